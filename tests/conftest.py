@@ -9,6 +9,32 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '.'))
 from testenv import Env
 
 
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'client_caps(*features): needs these example client '
+                   'features, other crypto libs are deselected')
+
+
+def pytest_collection_modifyitems(config, items):
+    # deselect crypto libs whose client lacks a feature the test needs
+    selected = []
+    deselected = []
+    for item in items:
+        marker = item.get_closest_marker('client_caps')
+        callspec = getattr(item, 'callspec', None)
+        if marker is not None and callspec is not None \
+                and 'client' in callspec.params:
+            caps = Env.client_caps(callspec.params['client'])
+            if caps is not None and not all([caps.supports(feature)
+                                            for feature in marker.args]):
+                deselected.append(item)
+                continue
+        selected.append(item)
+    if len(deselected) > 0:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
 @pytest.mark.usefixtures("env")
 def pytest_report_header(config):
     env = Env()
@@ -42,6 +42,7 @@ class TestQuicHandshake:
         cr.assert_non_resume_handshake()
 
     # session resumption, get
+    @pytest.mark.client_caps('session')
     def test_01_02(self, env: Env, client: ExampleClient, ha: HAProxy):
         # run GET with sessions but no early data, cleared first, then reused
         client.clear_session()
@@ -64,6 +65,7 @@ class TestQuicHandshake:
         assert cr.returncode == 0
         cr.assert_non_resume_handshake()
 
+    @pytest.mark.client_caps('early-data')
     def test_01_03(self, env: Env, client: ExampleClient, ha: HAProxy):
         # run GET with sessions, cleared first, without a session, early
         # data will not even be attempted
@@ -0,0 +1,170 @@
+import binascii
+import logging
+import random
+
+import pytest
+
+from testenv import HandShake, HandshakeDiff
+from testenv.tls import ClientHello, DataCursor, HSReassembler, ParseError
+
+
+log = logging.getLogger(__name__)
+
+
+# the CRYPTO frame with the client's Initial ClientHello, RFC 9001 A.2
+RFC9001_CRYPTO_FRAME = binascii.unhexlify(
+    '060040f1010000ed0303ebf8fa56f12939b9584a3896472ec40bb863cfd3e868'
+    '04fe3a47f06a2b69484c00000413011302010000c000000010000e00000b6578'
+    '616d706c652e636f6dff01000100000a00080006001d00170018001000070005'
+    '04616c706e000500050100000000003300260024001d00209370b2c9caa47fba'
+    'baf4559fedba753de171fa71f50f1ce15d43e994ec74d748002b000302030400'
+    '0d0010000e0403050306030203080408050806002d00020101001c0002400100'
+    '3900320408ffffffffffffffff05048000ffff07048000ffff08011001048000'
+    '75300901100f088394c8f03e51570806048000ffff')
+
+
+def rfc9001_client_hello() -> ClientHello:
+    # skip the frame type, offset and length
+    recs = list(HandShake(source=[RFC9001_CRYPTO_FRAME[4:]], strict=True))
+    assert len(recs) == 1
+    return recs[0]
+
+
+def _vec(data: bytes, n: int = 2) -> bytes:
+    return len(data).to_bytes(n, byteorder='big') + data
+
+
+def client_hello(grease: int, cookie: bytes = None) -> ClientHello:
+    # a TLS 1.3 ClientHello with the GREASE value `grease` in its
+    # ciphers, extensions, groups, versions, signature algorithms
+    # and ALPN
+    g = grease.to_bytes(2, byteorder='big')
+    exts = [
+        (grease, b''),
+        (0x0a, _vec(g + b'\x00\x1d\x00\x17')),
+        (0x0d, _vec(g + b'\x04\x03\x08\x04')),
+        (0x10, _vec(_vec(g, 1) + _vec(b'h3', 1))),
+        (0x2b, _vec(g + b'\x03\x04', 1)),
+    ]
+    if cookie is not None:
+        exts.append((0x2c, _vec(cookie)))
+    body = b'\x03\x03' + bytes(32) + _vec(b'', 1) \
+        + _vec(g + b'\x13\x01\x13\x02') + _vec(b'\x00', 1) \
+        + _vec(b''.join([eid.to_bytes(2, byteorder='big') + _vec(edata)
+                         for eid, edata in exts]))
+    recs = list(HandShake(source=[b'\x01' + _vec(body, 3)], strict=True))
+    return recs[0]
+
+
+def _join_and_retry(blocks) -> list:
+    # the record names the former HandShake._parse found: join all
+    # blocks, parse one record and drop the first block on failure
+    blocks = [bytes(b) for b in blocks]
+    names = []
+    while len(blocks) > 0:
+        d = DataCursor(b''.join(blocks))
+        try:
+            hsid = d.get_int(1)
+            if hsid not in HandShake.RT_CLS_BY_ID:
+                raise ParseError(f'unknown type {hsid}')
+            rec_len = d.get_int(3)
+            if rec_len > len(d):
+                blocks = blocks[1:]
+                continue
+            d.skip(rec_len)
+        except ParseError:
+            blocks = blocks[1:]
+            continue
+        names.append(HandShake.RT_NAME_BY_ID[hsid])
+        cons_len = d.pos
+        while cons_len > 0 and len(blocks) > 0:
+            if cons_len >= len(blocks[0]):
+                cons_len -= len(blocks[0])
+                blocks = blocks[1:]
+            else:
+                blocks[0] = blocks[0][cons_len:]
+                cons_len = 0
+    return names
+
+
+class TestTlsParse:
+
+    def test_05_01_client_hello(self):
+        hello = rfc9001_client_hello()
+        assert hello.name == 'ClientHello'
+        assert hello.extension_ids == [0x00, 0xff01, 0x0a, 0x10, 0x05,
+                                       0x33, 0x2b, 0x0d, 0x2d, 0x1c, 0x39]
+        assert list(hello.get_extension(0x0a).groups) == [0x1d, 0x17, 0x18]
+
+    def test_05_02_ja3(self):
+        hello = rfc9001_client_hello()
+        assert hello.ja3_string == \
+            '771,4865-4866,0-65281-10-16-5-51-43-13-45-28-57,29-23-24,'
+        assert hello.ja3 == '41bc9ae914d6cb3bd0bd0a5453ab7d7f'
+
+    def test_05_03_ja4(self):
+        hello = rfc9001_client_hello()
+        assert hello.ja4.startswith('q13d0211an_')
+        assert hello.fingerprint == rfc9001_client_hello().fingerprint
+
+    def test_05_04_diff_grease(self):
+        # GREASE values and cookies differ between connections
+        a = client_hello(0x0a0a, cookie=b'cookie-a')
+        b = client_hello(0xdada, cookie=b'cookie-bb')
+        diff = HandshakeDiff([a], [b])
+        assert not diff, diff.to_text()
+        assert a.ja3 == b.ja3
+
+    def test_05_05_diff_groups(self):
+        a = client_hello(0x0a0a)
+        b = rfc9001_client_hello()
+        changes = {(rec, field) for rec, field, _, _ in HandshakeDiff([a], [b])}
+        assert ('ClientHello', 'ciphers') not in changes
+        assert ('ClientHello', 'SUPPORTED_GROUPS') in changes
+        assert ('ClientHello', 'SIGNATURE_ALGORITHMS') in changes
+
+    def test_05_06_data_cursor(self):
+        data = b'\x00\x03abc\x40\x25\x13\x01\x13\x02'
+        d = DataCursor(data)
+        d.skip(2)
+        field = d.get_field(3)
+        assert isinstance(field, memoryview) and field.obj is data
+        assert bytes(field) == b'abc'
+        assert d.get_qint() == 0x25
+        assert list(d.get_u16_array(len(d))) == [0x1301, 0x1302]
+        with pytest.raises(ParseError):
+            d.skip(1)
+
+    def test_05_07_reassembler(self):
+        recs = [RFC9001_CRYPTO_FRAME[4:], b'\x08\x00\x00\x02\x00\x00',
+                b'\x14\x00\x00\x20' + bytes(32)]
+        names = ['ClientHello', 'EncryptedExtensions', 'Finished']
+        data = b''.join(recs)
+        # records split anywhere
+        for pos in range(1, len(data)):
+            found = [r.name for r in HandShake(source=[data[:pos], data[pos:]],
+                                               strict=True)]
+            assert found == names, f'split at {pos}'
+        # records come as soon as they are complete
+        reassembler = HSReassembler()
+        assert reassembler.feed(data[:10]) == []
+        assert [r.name for r in reassembler.feed(data[10:-4])] == names[:2]
+        assert [r.name for r in reassembler.feed(data[-4:])] == names[2:]
+        assert reassembler.finish(strict=True) == []
+        # a garbage block is dropped, parsing resumes at the next one
+        found = [r.name for r in HandShake(
+            source=[recs[0], b'\xff\x00\x01', recs[1], recs[2]])]
+        assert found == names
+        # never fewer records than the former join-and-retry parsing
+        rnd = random.Random(4711)
+        for _ in range(500):
+            blocks = []
+            for rec in rnd.sample(recs, k=len(recs)):
+                if rnd.random() < 0.3:
+                    blocks.append(rnd.randbytes(rnd.randint(1, 8)))
+                cut = sorted(rnd.sample(range(1, len(rec)),
+                                        k=rnd.randint(0, 2)))
+                blocks.extend([rec[a:b] for a, b in
+                               zip([0] + cut, cut + [len(rec)])])
+            found = [r.name for r in HandShake(source=blocks)]
+            assert len(found) >= len(_join_and_retry(blocks)), blocks
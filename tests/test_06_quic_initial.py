@@ -0,0 +1,142 @@
+import logging
+import struct
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from testenv.pcap import PcapReader, PcapWriter
+from testenv.quic import InitialKeys, QuicInitialDecoder, QuicVersion, \
+    quic_connections
+
+from .test_05_tls_parse import RFC9001_CRYPTO_FRAME
+
+
+log = logging.getLogger(__name__)
+
+
+# the client's original destination connection id, RFC 9001 A.1
+RFC9001_DCID = bytes.fromhex('8394c8f03e515708')
+# the unprotected header of the client Initial and the protected one, A.2
+RFC9001_CLIENT_HEADER = bytes.fromhex(
+    'c300000001088394c8f03e5157080000449e00000002')
+RFC9001_CLIENT_PROTECTED_HEADER = bytes.fromhex(
+    'c000000001088394c8f03e5157080000449e7b9aec34')
+# the protected server Initial, A.3
+RFC9001_SERVER_INITIAL = bytes.fromhex(
+    'cf000000010008f067a5502a4262b5004075c0d95a482cd0991cd25b0aac406a'
+    '5816b6394100f37a1c69797554780bb38cc5a99f5ede4cf73c3ec2493a1839b3'
+    'dbcba3f6ea46c5b7684df3548e7ddeb9c3bf9c73cc3f3bded74b562bfb19fb84'
+    '022f8ef4cdd93795d77d06edbb7aaf2f58891850abbdca3d20398c276456cbc4'
+    '2158407dd074ee')
+RFC9001_JA3 = '41bc9ae914d6cb3bd0bd0a5453ab7d7f'
+
+CLIENT = ('10.0.0.1', 50000)
+SERVER = ('10.0.0.2', 443)
+
+
+def rfc9001_client_initial() -> bytes:
+    # protect the client Initial of A.2: the CRYPTO frame padded to
+    # 1162 bytes, packet number 2 in 4 bytes
+    keys = InitialKeys(QuicVersion.V1, RFC9001_DCID, is_client=True)
+    payload = RFC9001_CRYPTO_FRAME \
+        + bytes(1162 - len(RFC9001_CRYPTO_FRAME))
+    header = bytearray(RFC9001_CLIENT_HEADER)
+    nonce = bytes([a ^ b for a, b in zip(
+        keys.iv, (2).to_bytes(12, byteorder='big'))])
+    data = AESGCM(keys.key).encrypt(nonce, payload, bytes(header))
+    mask = keys.hp_mask(data[:16])
+    header[0] ^= mask[0] & 0x0f
+    for i in range(4):
+        header[len(header) - 4 + i] ^= mask[1 + i]
+    return bytes(header) + data
+
+
+def _block(btype: int, body: bytes) -> bytes:
+    body += bytes(-len(body) % 4)
+    blen = struct.pack('<I', 12 + len(body))
+    return struct.pack('<I', btype) + blen + body + blen
+
+
+def write_pcapng(path: str, packets):
+    # a section with one raw IP interface in nanoseconds
+    options = struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0)
+    with open(path, 'wb') as fd:
+        fd.write(_block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0,
+                                                 -1)))
+        fd.write(_block(1, struct.pack('<HHI', PcapWriter.LINKTYPE_RAW, 0,
+                                       0) + options))
+        for ts_ns, data in packets:
+            fd.write(_block(6, struct.pack('<IIIII', 0, ts_ns >> 32,
+                                           ts_ns & 0xffffffff, len(data),
+                                           len(data)) + data))
+
+
+def write_quic_pcap(path: str):
+    with PcapWriter(path) as w:
+        w.write_udp(CLIENT, SERVER, rfc9001_client_initial(), ts=1.0)
+        w.write_udp(SERVER, CLIENT, RFC9001_SERVER_INITIAL, ts=1.5)
+
+
+class TestQuicInitial:
+
+    def test_06_01_keys(self):
+        keys = InitialKeys(QuicVersion.V1, RFC9001_DCID, is_client=True)
+        assert keys.key.hex() == '1f369613dd76d5467730efcbe3b1a22d'
+        assert keys.iv.hex() == 'fa044b2f42a3fd3b46fb255c'
+        assert keys.hp.hex() == '9f50449e04a0e810283a1e9933adedd2'
+        keys = InitialKeys(QuicVersion.V1, RFC9001_DCID, is_client=False)
+        assert keys.key.hex() == 'cf3a5331653c364c88f0f379b6067e37'
+        assert keys.iv.hex() == '0ac1493ca1905853b0bba03e'
+        assert keys.hp.hex() == 'c206b8d9b9f0f37644430b490eeaa314'
+
+    def test_06_02_client_initial(self):
+        data = rfc9001_client_initial()
+        assert len(data) == 1200
+        assert data.startswith(RFC9001_CLIENT_PROTECTED_HEADER)
+        dec = QuicInitialDecoder()
+        packets = dec.add_datagram(data, from_client=True)
+        assert [(p.ptype, p.pn) for p in packets] == [('Initial', 2)]
+        assert dec.original_dcid == RFC9001_DCID
+        sent, received = dec.handshake()
+        assert [hrec.name for hrec in sent] == ['ClientHello']
+        assert sent[0].ja3 == RFC9001_JA3
+        assert received == []
+
+    def test_06_03_server_initial(self):
+        dec = QuicInitialDecoder()
+        # without the client's Initial, there are no keys
+        assert dec.add_datagram(RFC9001_SERVER_INITIAL,
+                                from_client=False) == []
+        dec.add_datagram(rfc9001_client_initial(), from_client=True)
+        packets = dec.add_datagram(RFC9001_SERVER_INITIAL, from_client=False)
+        assert [(p.ptype, p.pn) for p in packets] == [('Initial', 1)]
+        assert packets[0].scid.hex() == 'f067a5502a4262b5'
+        assert dec.packets == 2
+        sent, received = dec.handshake()
+        assert [hrec.name for hrec in received] == ['ServerHello']
+        assert received[0].cipher == 0x1301
+
+    def test_06_04_pcap(self, tmp_path):
+        path = str(tmp_path / 'quic.pcap')
+        write_quic_pcap(path)
+        packets = list(PcapReader(path))
+        assert [p.ts for p in packets] == [1.0, 1.5]
+        conns = quic_connections(path, port=SERVER[1])
+        assert list(conns.keys()) == [CLIENT]
+        sent, received = conns[CLIENT].handshake()
+        assert [hrec.name for hrec in sent + received] == \
+            ['ClientHello', 'ServerHello']
+
+    def test_06_05_pcapng(self, tmp_path):
+        pcap_path = str(tmp_path / 'quic.pcap')
+        write_quic_pcap(pcap_path)
+        path = str(tmp_path / 'quic.pcapng')
+        write_pcapng(path, [(1_000_000_000 + 250, p.data)
+                            for p in PcapReader(pcap_path)])
+        packets = list(PcapReader(path))
+        assert len(packets) == 2
+        assert packets[0].linktype == PcapWriter.LINKTYPE_RAW
+        assert packets[0].ts == 1.00000025
+        conns = quic_connections(path, port=SERVER[1])
+        sent, received = conns[CLIENT].handshake()
+        assert sent[0].ja3 == RFC9001_JA3
+        assert received[0].name == 'ServerHello'
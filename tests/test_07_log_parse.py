@@ -0,0 +1,169 @@
+import logging
+import os
+import re
+import threading
+import time
+
+from testenv import HandShake
+from testenv.log import HexDumpScanner, LogFile, MultiMatcher
+from testenv.logrotate import LogRotator
+
+from .test_05_tls_parse import RFC9001_CRYPTO_FRAME
+
+
+log = logging.getLogger(__name__)
+
+
+def ngtcp2_dump(data: bytes):
+    # like the hexdumps of the ngtcp2 example clients
+    lines = []
+    for off in range(0, len(data), 16):
+        chunk = data[off:off + 16]
+        hx = ' '.join([f'{b:02x}' for b in chunk[:8]])
+        if len(chunk) > 8:
+            hx += '  ' + ' '.join([f'{b:02x}' for b in chunk[8:]])
+        asc = ''.join([chr(b) if 32 <= b < 127 else '.' for b in chunk])
+        lines.append(f'{off:08x}  {hx:<48}  |{asc}|\n')
+    lines.append(f'{len(data):08x}\n')
+    return lines
+
+
+class TestLogParse:
+
+    def test_07_01_hexdump(self):
+        hello = RFC9001_CRYPTO_FRAME[4:]
+        lines = ['I00000000 0x8394 frm rx 1 Initial CRYPTO(0x06)\n'] \
+            + ngtcp2_dump(b'not after a CRYPTO line') \
+            + ['Ordered CRYPTO data in Initial crypto level\n'] \
+            + ngtcp2_dump(hello)
+        scanner = HexDumpScanner(source=lines, leading_regex=re.compile(
+            r'Ordered CRYPTO data in \S+ crypto level'))
+        assert list(scanner) == [hello]
+        recs = list(HandShake(source=scanner))
+        assert [hrec.name for hrec in recs] == ['ClientHello']
+
+    def test_07_02_hexdump_layouts(self):
+        data = bytes(range(40))
+        # `openssl s_client -debug`
+        lines = []
+        for off in range(0, len(data), 16):
+            hx = ' '.join([f'{b:02x}' for b in data[off:off + 16]])
+            if len(hx) > 24:
+                hx = hx[:23] + '-' + hx[24:]
+            lines.append(f'{off:04x} - {hx:<48}   ................\n')
+        assert list(HexDumpScanner(source=lines)) == [data]
+        # other layouts go through the general regex
+        lines = [f'{off:04x} {data[off:off + 16].hex(" ")}   ascii\n'
+                 for off in range(0, len(data), 16)]
+        assert list(HexDumpScanner(source=lines + ['done\n'])) == [data]
+
+    def test_07_03_log_file(self, tmp_path):
+        path = tmp_path / 'error.log'
+        path.write_bytes(b'starting\r\nlistening on :443\r\n')
+        logfile = LogFile(str(path))
+        assert list(logfile.iter_recent()) == ['starting\n',
+                                               'listening on :443\n']
+        with open(path, 'ab') as fd:
+            fd.write(b'[error] no cert\n')
+        start, end = logfile.recent_range(advance=False)
+        assert logfile.read_recent() == b'[error] no cert\n'
+        assert logfile.read_recent() == b''
+        # a range that is no longer in the file is read as far as it is
+        with open(path, 'r+b') as fd:
+            fd.truncate(start + 4)
+        assert list(logfile.iter_range(start, end)) == ['[err']
+
+    def test_07_04_multi_matcher(self):
+        patterns = {
+            'listen': r'.*listening on (\S+)',
+            'error': r'.*\[error\] (.*)',
+        }
+        m = MultiMatcher(patterns).match('[error] no cert\n', pos=7)
+        assert m.name == 'error'
+        assert m.match.group(1) == 'no cert'
+        assert m.pos == 7
+        assert MultiMatcher(patterns).match('nothing\n') is None
+        # numbered back references cannot be combined
+        m = MultiMatcher([r'(\w+) then \1', r'.*listening']).match(
+            'again then again\n')
+        assert m.name == 0
+        assert m.match.group(1) == 'again'
+        # nor can patterns with different flags
+        m = MultiMatcher([re.compile(r'ERROR'),
+                          re.compile(r'.*warn', re.IGNORECASE)]).match(
+            'a WARNING\n')
+        assert m.name == 1
+
+    def test_07_05_scan_any(self, tmp_path):
+        path = tmp_path / 'error.log'
+        path.write_text('starting\n')
+        logfile = LogFile(str(path))
+        logfile.read_recent()
+        with open(path, 'a') as fd:
+            fd.write('listening on :443\n[error] no cert\n')
+        m = logfile.scan_any({'error': r'.*\[error\] (.*)',
+                              'listen': r'.*listening on (\S+)'}, timeout=1)
+        assert m.name == 'listen'
+        assert m.match.group(1) == ':443'
+
+    def test_07_06_rotation(self, tmp_path):
+        path = str(tmp_path / 'haproxy.log')
+        rotator = LogRotator(path, max_size=100, keep=2, compression='gzip')
+        logfile = LogFile(path)
+        with open(path, 'a') as fd:
+            for i in range(4):
+                fd.write(''.join([f'{i}-{n:02d}\n' for n in range(30)]))
+                fd.flush()
+                assert rotator.rotate_if_needed()
+                assert os.path.getsize(path) == 0
+            fd.write('tail\n')
+        assert [os.path.basename(p) for p, _, _ in
+                rotator._segments.entries()] == \
+            [f'haproxy.log.{seq:06d}.gz' for seq in range(1, 5)]
+        # only the 2 newest segments are kept, the others are skipped
+        lines = list(logfile.iter_recent())
+        assert lines[0] == '2-00\n'
+        assert lines[-2:] == ['3-29\n', 'tail\n']
+        assert len(lines) == 61
+        assert logfile.read_recent() == b''
+
+    def test_07_07_rotation_concurrent(self, tmp_path):
+        # a reader sees every line a writer appends while it is rotated
+        path = str(tmp_path / 'haproxy.log')
+        rotator = LogRotator(path, max_size=20000, keep=1000,
+                             compression='gzip')
+        logfile = LogFile(path)
+        stop = threading.Event()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+
+        def write():
+            n = 0
+            while not stop.is_set():
+                os.write(fd, f'line {n}\n'.encode())
+                n += 1
+
+        writer = threading.Thread(target=write)
+        rotator.start(interval=0.001)
+        writer.start()
+        chunks = []
+        try:
+            end = time.monotonic() + 1
+            while time.monotonic() < end:
+                chunks.append(logfile.read_recent())
+        finally:
+            stop.set()
+            writer.join()
+            rotator.stop()
+            os.close(fd)
+        chunks.append(logfile.read_recent())
+        lines = b''.join(chunks).decode().splitlines()
+        assert len(rotator._segments.entries()) > 1
+        # the reader gets the same as a full read, in order. Data written
+        # right before a truncation may be lost to the rotation, leaving
+        # at most one torn line per segment, but is never lost to reading
+        assert lines == [line.rstrip('\n') for line in
+                         LogFile(path).iter_recent()]
+        matches = [re.fullmatch(r'line (\d+)', line) for line in lines]
+        numbers = [int(m.group(1)) for m in matches if m is not None]
+        assert numbers == sorted(set(numbers))
+        assert len(lines) - len(numbers) <= len(rotator._segments.entries())
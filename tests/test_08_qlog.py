@@ -0,0 +1,71 @@
+import json
+import logging
+
+from testenv.qlog import QlogReader
+
+
+log = logging.getLogger(__name__)
+
+
+QLOG_SEQ = [
+    {'qlog_version': '0.3', 'qlog_format': 'JSON-SEQ',
+     'trace': {'common_fields': {'group_id': 'c0ffee'}}},
+    {'time': 10, 'name': 'transport:packet_sent',
+     'data': {'header': {'packet_type': 'initial'}, 'raw': {'length': 1200}}},
+    {'time': 12, 'name': 'transport:packet_sent',
+     'data': {'header': {'packet_type': 'initial'}, 'raw': {'length': 1200}}},
+    {'time': 30, 'name': 'transport:packet_received',
+     'data': {'header': {'packet_type': 'handshake'}, 'raw': {'length': 900}}},
+    {'time': 31, 'name': 'recovery:metrics_updated',
+     'data': {'latest_rtt': 19, 'smoothed_rtt': 19, 'min_rtt': 19}},
+    {'time': 45, 'name': 'transport:packet_received',
+     'data': {'header': {'packet_type': '1RTT'}, 'raw': {'length': 50},
+              'frames': [{'frame_type': 'handshake_done'}]}},
+    {'time': 52, 'name': 'transport:packet_received',
+     'data': {'header': {'packet_type': '1RTT'}, 'raw': {'length': 300},
+              'frames': [{'frame_type': 'stream', 'stream_id': 0,
+                          'length': 250}]}},
+]
+
+
+class TestQlog:
+
+    def test_08_01_qlog(self, tmp_path):
+        path = tmp_path / 'client.qlog'
+        path.write_text(''.join([f'\x1e{json.dumps(rec)}\n'
+                                 for rec in QLOG_SEQ]))
+        conns = QlogReader(str(path)).connections()
+        assert len(conns) == 1
+        conn = conns[0]
+        assert conn.group_id == 'c0ffee'
+        assert conn.handshake_time == 35
+        assert conn.response_time == 42
+        assert conn.rtt_samples == [19]
+        assert conn.spaces['initial']['packets_sent'] == 2
+        assert conn.spaces['initial']['bytes_sent'] == 2400
+        assert conn.spaces['application_data']['bytes_received'] == 350
+
+    def test_08_02_qlog_ndjson(self, tmp_path):
+        # older qlogs use 'category' and 'event', one record per line
+        path = tmp_path / 'server.qlog'
+        path.write_text('\n'.join([
+            json.dumps({'qlog_version': '0.2'}),
+            json.dumps({'time': 1, 'group_id': 'a', 'category': 'transport',
+                        'event': 'packet_sent',
+                        'data': {'header': {'packet_type': 'initial'}}}),
+            '{"time": 2, "truncated',
+            json.dumps({'time': 5, 'group_id': 'b', 'category': 'transport',
+                        'event': 'packet_sent',
+                        'data': {'header': {'packet_type': 'initial'}}}),
+            json.dumps({'time': 9, 'group_id': 'a',
+                        'category': 'connectivity',
+                        'event': 'connection_state_updated',
+                        'data': {'new': 'handshake_confirmed'}}),
+        ]))
+        events = list(QlogReader(str(path)).events())
+        assert [(t, name) for t, name, _, _ in events] == [
+            (1, 'transport:packet_sent'), (5, 'transport:packet_sent'),
+            (9, 'connectivity:connection_state_updated')]
+        conns = QlogReader(str(path)).connections()
+        assert [(c.group_id, c.handshake_time) for c in conns] == [
+            ('a', 8), ('b', None)]
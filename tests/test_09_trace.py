@@ -0,0 +1,45 @@
+import logging
+
+from testenv.trace import TraceIndex, TraceParser
+
+
+log = logging.getLogger(__name__)
+
+
+TRACE = """\
+[00|quic|5|quic_conn.c:1104] qc_new_conn(): new conn : qc@0x7f01 scid=0xAB01 dcid=cd01
+[00|quic|5|quic_rx.c:2208] qc_lstnr_pkt_rcv(): new packet : qc@0x7f01 el=I
+this is no trace line
+[01|quic|5|quic_frame.c:1150] qc_parse_frm(): CRYPTO : qc@0x7f01 el=I
+[01|quic|5|ssl_sock.c:710] qc_ssl_do_hanshake(): SSL handshake OK : qc@0x7f01
+[00|quic|5|quic_conn.c:1104] qc_new_conn(): new conn : qc@0x7f02 scid=ab02
+[00|quic|5|quic_conn.c:1104] qc_new_conn(): new conn : qc@0x7f01 scid=ab03
+"""
+
+
+class TestTrace:
+
+    def test_09_01_trace(self):
+        events = list(TraceParser(TRACE.splitlines(keepends=True)))
+        assert [ev.lineno for ev in events] == [0, 1, 3, 4, 5, 6]
+        ev = events[0]
+        assert (ev.thread, ev.level, ev.func, ev.msg) == \
+            (0, 5, 'qc_new_conn', 'new conn')
+        assert ev.qc == '0x7f01'
+        assert ev.cids == ['cd01', 'ab01']
+        assert [ev.kind for ev in events[1:4]] == ['packet', 'frame', 'tls']
+        assert events[1].packet_type == 'Initial'
+        idx = TraceIndex(events)
+        # the address 0x7f01 is reused by the last connection
+        assert len(idx) == 3
+        assert [len(c) for c in idx.connections] == [4, 1, 1]
+        assert idx.for_cid('0xAB01') is idx.connections[0]
+        assert idx.get('0x7f01') is idx.connections[2]
+
+    def test_09_02_trace_incremental(self):
+        lines = TRACE.splitlines(keepends=True)
+        idx = TraceIndex()
+        idx.add_lines(lines[:3])
+        idx.add_lines(lines[3:])
+        linenos = [ev.lineno for c in idx.connections for ev in c.events]
+        assert linenos == [0, 1, 3, 4, 5, 6]
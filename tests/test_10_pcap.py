@@ -0,0 +1,86 @@
+import logging
+import struct
+
+import pytest
+
+from testenv.pcap import PcapReader, PcapWriter, ip_packets, tcp_connections
+from testenv.tls import ParseError
+
+from .test_05_tls_parse import RFC9001_CRYPTO_FRAME
+from .test_06_quic_initial import CLIENT, RFC9001_JA3, SERVER, _block, \
+    write_pcapng
+
+
+log = logging.getLogger(__name__)
+
+
+def tls_records(hello: bytes, *cuts: int):
+    # the handshake message in TLS records, split at `cuts`
+    bounds = [0] + list(cuts) + [len(hello)]
+    return [b'\x16\x03\x01' + (b - a).to_bytes(2, byteorder='big')
+            + hello[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+class TestPcap:
+
+    def test_10_01_tcp(self, tmp_path):
+        # the ClientHello in two TLS records over TCP, out of order
+        records = tls_records(RFC9001_CRYPTO_FRAME[4:], 100)
+        path = str(tmp_path / 'tls.pcap')
+        with PcapWriter(path) as w:
+            w.write_tcp(CLIENT, SERVER, seq=1000, flags=0x02)
+            w.write_tcp(CLIENT, SERVER, seq=1001 + len(records[0]),
+                        payload=records[1])
+            w.write_tcp(CLIENT, SERVER, seq=1001, payload=records[0])
+            # a retransmission
+            w.write_tcp(CLIENT, SERVER, seq=1001, payload=records[0])
+        conns = tcp_connections(path, port=SERVER[1])
+        assert len(conns) == 1
+        assert conns[0].client.src == CLIENT
+        assert not conns[0].client.has_gaps
+        sent, received = conns[0].handshake()
+        assert [hrec.name for hrec in sent] == ['ClientHello']
+        assert sent[0].ja3 == RFC9001_JA3
+        assert received == []
+
+    def test_10_02_tcp_gap(self, tmp_path):
+        # without the first record, nothing can be parsed
+        records = tls_records(RFC9001_CRYPTO_FRAME[4:], 100)
+        path = str(tmp_path / 'gap.pcap')
+        with PcapWriter(path) as w:
+            w.write_tcp(CLIENT, SERVER, seq=1000, flags=0x02)
+            w.write_tcp(CLIENT, SERVER, seq=1001 + len(records[0]),
+                        payload=records[1])
+        conns = tcp_connections(path)
+        assert conns[0].client.has_gaps
+        assert conns[0].handshake() == ([], [])
+
+    def test_10_03_ethernet(self, tmp_path):
+        # an IPv4 packet behind an ethernet header with a VLAN tag
+        ip = PcapWriter._ipv4(17, '10.0.0.1', '10.0.0.2',
+                              struct.pack('!HHHH', 1, 2, 8, 0))
+        frame = bytes(12) + b'\x81\x00\x00\x05\x08\x00' + ip
+        packets = list(PcapReader(self._write_linktype(tmp_path, 1, frame)))
+        assert [p.linktype for p in packets] == [1]
+        ips = list(ip_packets(packets))
+        assert [(p.proto, p.src, p.dst) for p in ips] == \
+            [(17, '10.0.0.1', '10.0.0.2')]
+
+    @staticmethod
+    def _write_linktype(tmp_path, linktype: int, data: bytes) -> str:
+        path = str(tmp_path / f'link{linktype}.pcap')
+        with open(path, 'wb') as fd:
+            fd.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535,
+                                 linktype))
+            fd.write(struct.pack('<IIII', 0, 0, len(data), len(data)) + data)
+        return path
+
+    def test_10_04_pcapng_interface(self, tmp_path):
+        path = str(tmp_path / 'one.pcapng')
+        write_pcapng(path, [(0, b'\x45')])
+        assert [p.data for p in PcapReader(path)] == [b'\x45']
+        # a packet of an interface that was not described
+        with open(path, 'ab') as fd:
+            fd.write(_block(6, struct.pack('<IIIII', 1, 0, 0, 1, 1) + b'\x45'))
+        with pytest.raises(ParseError):
+            list(PcapReader(path))
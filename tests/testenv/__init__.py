@@ -1,9 +1,17 @@
 from .env import Env
-from .client import ExampleClient, QuicClientRun
+from .client import ExampleClient, QuicClientRun, ClientRunner
 from .certs import TestCA, Credentials
 from .log import LogFile
-from .tls import HandShake, HSRecord
+from .tls import HandShake, HSReassembler, HSRecord, ClientHelloIndex
 from .haproxy import HAProxy
 from .httpd import Httpd
 from .curl import CurlClient, ExecResult
 from .openssl import OpensslClient
+from .aio import AsyncExampleClient, AsyncCurlClient, AsyncOpensslClient
+from .pcap import PcapReader, PcapWriter
+from .quic import QuicInitialDecoder
+from .qlog import QlogReader
+from .hscache import HandshakeCache
+from .caps import ClientCapabilities
+from .hsdiff import HandshakeDiff
+from .trace import TraceIndex, TraceParser
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from asyncio.subprocess import PIPE, Process
+from datetime import datetime
+from typing import Awaitable, Iterable, List, Optional
+
+from .certs import Credentials
+from .client import ExampleClient, QuicClientRun
+from .curl import CurlClient, ExecResult
+from .env import Env
+from .log import LogFile
+from .openssl import OpensslClient
+
+
+log = logging.getLogger(__name__)
+
+
+async def _wait_process(process: Process, aw: Awaitable,
+                        timeout: Optional[float]):
+    # await `aw` for at most `timeout` seconds. On timeout or when
+    # cancelled, the process is killed before the exception is passed on.
+    try:
+        return await asyncio.wait_for(aw, timeout=timeout)
+    except BaseException:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            log.debug(f'killed process {process.pid}')
+        raise
+
+
+async def gather_limited(aws: Iterable[Awaitable], limit: int) -> List:
+    """Await all of `aws` with at most `limit` of them running at the
+       same time, the results are in the same order."""
+    sem = asyncio.Semaphore(limit)
+
+    async def limited(aw):
+        async with sem:
+            return await aw
+
+    return await asyncio.gather(*[limited(aw) for aw in aws])
+
+
+class AsyncExampleClient(ExampleClient):
+    """An `ExampleClient` whose `http_get` is a coroutine.
+
+    The client process is killed when the deadline passes, raising
+    `asyncio.TimeoutError`, or when the task is cancelled. Each request
+    gets its own artifact directory unless `isolate_runs` is disabled.
+    """
+
+    def __init__(self, env: Env, crypto_lib: str, isolate_runs: bool = True,
+                 timeout: Optional[float] = None):
+        super().__init__(env=env, crypto_lib=crypto_lib,
+                         isolate_runs=isolate_runs)
+        self._timeout = timeout
+
+    async def http_get(self, url: str, extra_args: List[str] = None,
+                       use_session=False, data=None,
+                       credentials: Credentials = None,
+                       ciphers: str = None, run_dir: str = None,
+                       timeout: Optional[float] = None) -> QuicClientRun:
+        if timeout is None:
+            timeout = self._timeout
+        args, log_path, qlog_path, run_dir = self._prepare_get(
+            url=url, extra_args=extra_args, use_session=use_session,
+            data=data, credentials=credentials, run_dir=run_dir)
+        with open(log_path, 'w') as log_file:
+            logfile = LogFile(path=log_path)
+            log_file.write(self._log_header(args))
+            log_file.flush()
+            start = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdout=log_file, stderr=log_file)
+                await _wait_process(process, process.wait(), timeout)
+            except BaseException:
+                logfile.close()
+                raise
+            return self._finish_get(process.returncode, logfile,
+                                    qlog_path=qlog_path, run_dir=run_dir,
+                                    duration=time.monotonic() - start)
+
+
+class AsyncCurlClient(CurlClient):
+    """A `CurlClient` whose `http_get` is a coroutine, killing curl
+       when the deadline passes or the task is cancelled."""
+
+    def __init__(self, env: Env, timeout: Optional[float] = None):
+        super().__init__(env=env)
+        self._timeout = timeout
+
+    async def http_get(self, url: str, extra_args: List[str] = None,
+                       timeout: Optional[float] = None) -> ExecResult:
+        return await self._araw(url, options=extra_args,
+                                deadline=timeout if timeout is not None
+                                else self._timeout)
+
+    async def _arun(self, args, intext='',
+                    deadline: Optional[float] = None) -> ExecResult:
+        start = datetime.now()
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=PIPE if intext else None, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = await _wait_process(
+            process, process.communicate(intext.encode() if intext else None),
+            deadline)
+        return ExecResult(args=args, exit_code=process.returncode,
+                          stdout=stdout, stderr=stderr,
+                          duration=datetime.now() - start)
+
+    async def _araw(self, urls, timeout=10, options=None, insecure=False,
+                    force_resolve=True,
+                    deadline: Optional[float] = None) -> ExecResult:
+        # concurrent requests need a header file each
+        fd, headerfile = tempfile.mkstemp(prefix='curl.', suffix='.headers',
+                                          dir=self.env.gen_dir)
+        os.close(fd)
+        try:
+            args, headerfile = self._complete_args(
+                urls=urls, timeout=timeout, options=options,
+                insecure=insecure, force_resolve=force_resolve,
+                headerfile=headerfile)
+            r = await self._arun(args, deadline=deadline)
+            if r.exit_code == 0:
+                self._parse_headerfile(headerfile, r=r)
+                if r.json:
+                    r.response["json"] = r.json
+            return r
+        finally:
+            if os.path.isfile(headerfile):
+                os.remove(headerfile)
+
+
+class AsyncOpensslClient(OpensslClient):
+    """An `OpensslClient` whose `connect` is a coroutine, killing
+       s_client when the deadline passes or the task is cancelled."""
+
+    async def connect(self, url: str, extra_args: List[str] = None,
+                      intext=None, timeout: Optional[float] = 10
+                      ) -> ExecResult:
+        args = self._complete_args(url=url, options=extra_args)
+        r = await self._arun(args, intext=intext, deadline=timeout)
+        r.add_response(self._parse_response(r.stdout))
+        return r
+
+    async def _arun(self, args, intext='',
+                    deadline: Optional[float] = None) -> ExecResult:
+        start = datetime.now()
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+        async def talk():
+            if intext:
+                process.stdin.write(intext.encode())
+                await process.stdin.drain()
+            await asyncio.sleep(.5)  # give session ticket a moment to arrive
+            try:
+                process.stdin.close()
+            except Exception:
+                pass  # might have been closed already
+            return await process.communicate()
+
+        stdout, stderr = await _wait_process(process, talk(), deadline)
+        # lines, like the output of `OpensslClient`
+        return ExecResult(args=args, exit_code=process.returncode,
+                          stdout=stdout.decode(errors='replace').splitlines(
+                              keepends=True),
+                          stderr=stderr.decode(errors='replace').splitlines(
+                              keepends=True),
+                          duration=datetime.now() - start)
@@ -0,0 +1,217 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from .hscache import HandshakeCache
+from .log import HexDumpScanner
+from .qlog import QlogReader
+from .tls import ClientHello, HandShake, HSRecord
+from .trace import TraceIndex, TraceParser
+
+
+log = logging.getLogger(__name__)
+
+QUIC_CRYPTO_LINE = re.compile(r'Ordered CRYPTO data in \S+ crypto level')
+OPENSSL_WRITE_LINE = re.compile(r'write to ')
+OPENSSL_READ_LINE = re.compile(r'read from ')
+
+CSV_FIELDS = [
+    'path', 'kind', 'error', 'records', 'handshake', 'ja4',
+    'received', 'lines', 'trace_lines', 'connections', 'handshake_failures',
+    'handshake_time', 'response_time', 'smoothed_rtt',
+]
+
+
+def _file_kind(fname: str) -> Optional[str]:
+    if fname.endswith('-client.log'):
+        return 'quic-client'
+    elif fname == 'curl.log':
+        return 'openssl'
+    elif fname == 'haproxy.log':
+        return 'haproxy'
+    elif fname.endswith('.qlog') or fname.endswith('.sqlog'):
+        return 'qlog'
+    return None
+
+
+def find_files(top: str) -> List[str]:
+    """All files below `top` the analyzer knows about."""
+    paths = []
+    for dirpath, dirnames, fnames in os.walk(top):
+        dirnames.sort()
+        for fname in sorted(fnames):
+            if _file_kind(fname) is not None:
+                paths.append(os.path.join(dirpath, fname))
+    return paths
+
+
+def _read_lines(path: str) -> List[str]:
+    with open(path, errors='replace') as fd:
+        return fd.readlines()
+
+
+def _cached(cache: Optional[HandshakeCache], kind: str, path: str,
+            parse) -> List[List[HSRecord]]:
+    # the record lists `parse(lines)` gets from the file, from the
+    # cache if the file has been parsed before
+    if cache is None:
+        return parse(_read_lines(path))
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    key = cache.key(kind, [data])
+    rec_lists = cache.get(key)
+    if rec_lists is None:
+        rec_lists = parse(data.decode(errors='replace')
+                          .splitlines(keepends=True))
+        cache.put(key, rec_lists)
+    return rec_lists
+
+
+def _hs_summary(recs: List[HSRecord]) -> Dict[str, Any]:
+    hello = next((r for r in recs if isinstance(r, ClientHello)), None)
+    return {
+        'records': len(recs),
+        'handshake': ':'.join([r.name for r in recs]),
+        'ja4': hello.ja4 if hello is not None else None,
+    }
+
+
+def _parse_quic_client(lines: List[str]) -> List[List[HSRecord]]:
+    scanner = HexDumpScanner(source=lines, leading_regex=QUIC_CRYPTO_LINE)
+    return [list(HandShake(source=scanner))]
+
+
+def _analyze_quic_client(path: str, cache: Optional[HandshakeCache] = None
+                         ) -> List[Dict[str, Any]]:
+    recs, = _cached(cache, 'quic-client', path, _parse_quic_client)
+    return [_hs_summary(recs)]
+
+
+def _parse_openssl(lines: List[str]) -> List[List[HSRecord]]:
+    return [list(HandShake(source=HexDumpScanner(
+        source=lines, leading_regex=regex), skip_rec_header=True))
+        for regex in [OPENSSL_WRITE_LINE, OPENSSL_READ_LINE]]
+
+
+def _analyze_openssl(path: str, cache: Optional[HandshakeCache] = None
+                     ) -> List[Dict[str, Any]]:
+    sent, recvd = _cached(cache, 'openssl-debug', path, _parse_openssl)
+    row = _hs_summary(sent)
+    row['received'] = ':'.join([r.name for r in recvd])
+    return [row]
+
+
+def _analyze_haproxy(path: str, cache=None) -> List[Dict[str, Any]]:
+    lines = 0
+    trace_lines = 0
+    failures = 0
+    index = TraceIndex()
+    with open(path, errors='replace') as fd:
+        for line in fd:
+            lines += 1
+            ev = TraceParser.parse_line(line, lines)
+            if ev is not None:
+                trace_lines += 1
+                index.add(ev)
+            elif 'handshake failure' in line.lower():
+                failures += 1
+    return [{
+        'lines': lines,
+        'trace_lines': trace_lines,
+        'connections': len(index),
+        'handshake_failures': failures,
+    }]
+
+
+def _analyze_qlog(path: str, cache=None) -> List[Dict[str, Any]]:
+    return [conn.to_json() for conn in QlogReader(path).connections()]
+
+
+ANALYZERS = {
+    'quic-client': _analyze_quic_client,
+    'openssl': _analyze_openssl,
+    'haproxy': _analyze_haproxy,
+    'qlog': _analyze_qlog,
+}
+
+
+def analyze_file(path: str, cache_dir: Optional[str] = None
+                 ) -> List[Dict[str, Any]]:
+    """Summary rows for one file, errors are reported in the row. With
+       a `cache_dir`, parsed handshakes are kept in a `HandshakeCache`."""
+    kind = _file_kind(os.path.basename(path))
+    cache = HandshakeCache(cache_dir) if cache_dir is not None else None
+    try:
+        rows = ANALYZERS[kind](path, cache=cache)
+    except Exception as ex:
+        rows = [{'error': f'{type(ex).__name__}: {ex}'}]
+    for row in rows:
+        row['path'] = path
+        row['kind'] = kind
+    return rows
+
+
+def analyze(paths: List[str], jobs: Optional[int] = None,
+            cache_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Analyze the files in a pool of `jobs` processes, the rows are
+       returned in the order of `paths`."""
+    analyze_one = partial(analyze_file, cache_dir=cache_dir)
+    if jobs == 1:
+        results = map(analyze_one, paths)
+        return [row for rows in results for row in rows]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunksize = max(1, len(paths) // (4 * (jobs or os.cpu_count() or 1)))
+        results = pool.map(analyze_one, paths, chunksize=chunksize)
+        return [row for rows in results for row in rows]
+
+
+def write_ndjson(rows: List[Dict[str, Any]], out):
+    for row in rows:
+        out.write(json.dumps(row))
+        out.write('\n')
+
+
+def write_csv(rows: List[Dict[str, Any]], out):
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='analyze', description="""
+        summarize the client logs, haproxy traces and qlogs found in
+        archived gen/ directories
+        """)
+    parser.add_argument('dirs', nargs='+', help='directories to scan')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of processes, default: all cores')
+    parser.add_argument('-f', '--format', choices=['ndjson', 'csv'],
+                        default='ndjson')
+    parser.add_argument('-o', '--output', default=None,
+                        help='file to write to, default: stdout')
+    parser.add_argument('--cache', default=None, metavar='DIR',
+                        help='keep parsed handshakes in DIR for the next run')
+    args = parser.parse_args()
+    paths = []
+    for top in args.dirs:
+        paths.extend(find_files(top))
+    rows = analyze(paths, jobs=args.jobs, cache_dir=args.cache)
+    writer = write_csv if args.format == 'csv' else write_ndjson
+    if args.output is None:
+        writer(rows, sys.stdout)
+    else:
+        with open(args.output, 'w', newline='') as fd:
+            writer(rows, fd)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+import argparse
+import binascii
+import importlib.util
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from .hsdiff import HandshakeDiff
+from .log import HexDumpScanner
+from .tls import Certificate, HandShake
+
+
+log = logging.getLogger(__name__)
+
+
+def _u16(n):
+    return n.to_bytes(2, byteorder='big')
+
+
+def _u24(n):
+    return n.to_bytes(3, byteorder='big')
+
+
+def _vec8(data):
+    return bytes([len(data)]) + data
+
+
+def _vec16(data):
+    return _u16(len(data)) + data
+
+
+def _ext(eid, data):
+    return _u16(eid) + _vec16(data)
+
+
+def _hs(hsid, body):
+    return bytes([hsid]) + _u24(len(body)) + body
+
+
+def certificate_record(entries: int, cert_size: int) -> bytes:
+    # a TLS 1.3 Certificate handshake record with `entries` certificates
+    # of random data, each without extensions
+    clist = b''.join([_u24(cert_size) + os.urandom(cert_size) + b'\x00\x00'
+                      for _ in range(entries)])
+    body = b'\x00' + _u24(len(clist)) + clist
+    return b'\x0b' + _u24(len(body)) + body
+
+
+def quic_handshake_records(cert_entries: int = 2,
+                           cert_size: int = 1200) -> List[bytes]:
+    # a QUIC ClientHello and the server flight answering it, with
+    # random keys, ids and certificates
+    tp = b''.join([bytes([pid, len(val)]) + val for pid, val in [
+        (0x01, b'\x80\x00\x75\x30'), (0x04, b'\x80\x10\x00\x00'),
+        (0x08, b'\x40\x64'), (0x0f, os.urandom(8)),
+    ]])
+    chello = _hs(1, _u16(0x0303) + os.urandom(32) + _vec8(os.urandom(32))
+                 + _vec16(b'\x13\x01\x13\x02\x13\x03') + _vec8(b'\x00')
+                 + _vec16(b''.join([
+                     _ext(0x00, _vec16(b'\x00' + _vec16(b'one.example.org'))),
+                     _ext(0x0a, _vec16(b'\x00\x1d\x00\x17\x00\x18\x00\x19')),
+                     _ext(0x0d, _vec16(b'\x04\x03\x08\x04\x04\x01\x05\x03')),
+                     _ext(0x10, _vec16(_vec8(b'h3'))),
+                     _ext(0x2b, _vec8(b'\x03\x04')),
+                     _ext(0x2d, _vec8(b'\x01')),
+                     _ext(0x33, _vec16(b'\x00\x1d' + _vec16(os.urandom(32))
+                                       + b'\x00\x17' + _vec16(os.urandom(65)))),
+                     _ext(0x39, tp),
+                 ])))
+    shello = _hs(2, _u16(0x0303) + os.urandom(32) + _vec8(os.urandom(32))
+                 + b'\x13\x01\x00' + _vec16(b''.join([
+                     _ext(0x2b, b'\x03\x04'),
+                     _ext(0x33, b'\x00\x1d' + _vec16(os.urandom(32))),
+                 ])))
+    ee = _hs(8, _vec16(b''.join([
+        _ext(0x10, _vec16(_vec8(b'h3'))),
+        _ext(0x39, tp + b'\x00\x08' + os.urandom(8)),
+    ])))
+    cert = certificate_record(entries=cert_entries, cert_size=cert_size)
+    cverify = _hs(15, b'\x08\x04' + _vec16(os.urandom(256)))
+    finished = _hs(20, os.urandom(32))
+    ticket = _hs(4, os.urandom(8) + _vec8(os.urandom(8))
+                 + _vec16(os.urandom(180))
+                 + _vec16(_ext(0x2a, b'\xff\xff\xff\xff')))
+    return [chello, shello, ee, cert, cverify, finished, ticket]
+
+
+def _slicing_certificate(data):
+    # the certificate list walk with helpers that return a sliced copy
+    # of the remaining data, as the parser did before `DataCursor`
+    def get_int(d, n):
+        return d[n:], int.from_bytes(d[0:n], byteorder='big')
+
+    def get_len_field(d, n):
+        d, dlen = get_int(d, n)
+        return d[dlen:], d[0:dlen]
+
+    d, context = get_int(data, 1)
+    d, clist = get_len_field(d, 3)
+    certs = []
+    while len(clist) > 0:
+        clist, cert_data = get_len_field(clist, 3)
+        clist, cert_exts = get_len_field(clist, 2)
+        certs.append(cert_data)
+    return certs
+
+
+def _timed(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def bench_certificate(entries: int = 200, cert_size: int = 4096,
+                      rounds: int = 20):
+    rec = certificate_record(entries=entries, cert_size=cert_size)
+    rec_data = rec[4:]
+    t_slice = _timed(lambda: _slicing_certificate(rec_data), rounds)
+    t_cursor = _timed(lambda: Certificate(hsid=11, name='Certificate',
+                                          data=rec_data), rounds)
+    t_hs = _timed(lambda: list(HandShake(source=[rec])), rounds)
+    print(f'Certificate record: {entries} entries of {cert_size} bytes, '
+          f'{len(rec)} bytes total, {rounds} rounds')
+    print(f'  slicing walk:    {t_slice * 1000:10.3f} ms')
+    print(f'  DataCursor:      {t_cursor * 1000:10.3f} ms '
+          f'({t_slice / t_cursor:.1f}x)')
+    print(f'  HandShake parse: {t_hs * 1000:10.3f} ms')
+
+
+def _load_tls_module(rev: str):
+    # the tls module as of git revision `rev`, for comparing against
+    top = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))))
+    src = subprocess.run(['git', 'show', f'{rev}:tests/testenv/tls.py'],
+                         cwd=top, stdout=subprocess.PIPE, check=True).stdout
+    with tempfile.NamedTemporaryFile(suffix='.py') as fd:
+        fd.write(src)
+        fd.flush()
+        spec = importlib.util.spec_from_file_location(f'tls_{rev}', fd.name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+def _handshake_memory(handshake_cls, records: List[bytes],
+                      handshakes: int) -> Tuple[float, float]:
+    # bytes per handshake, parsed and with all extensions decoded
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    parsed = [list(handshake_cls(source=records)) for _ in range(handshakes)]
+    size_parsed, _ = tracemalloc.get_traced_memory()
+    for hs in parsed:
+        for hrec in hs:
+            for ext in (getattr(hrec, 'extensions', None) or []):
+                pass
+    size_decoded, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (size_parsed - start) / handshakes, \
+        (size_decoded - start) / handshakes
+
+
+def bench_memory(handshakes: int = 500, baseline: str = None):
+    records = quic_handshake_records()
+    print(f'{handshakes} handshakes of {len(records)} records, '
+          f'{sum([len(r) for r in records])} bytes each')
+    parsed, decoded = _handshake_memory(HandShake, records, handshakes)
+    if baseline is not None:
+        module = _load_tls_module(baseline)
+        b_parsed, b_decoded = _handshake_memory(module.HandShake, records,
+                                                handshakes)
+        print(f'  parsed:  {b_parsed:10.0f} -> {parsed:10.0f} '
+              f'bytes/handshake (at {baseline} -> now)')
+        print(f'  decoded: {b_decoded:10.0f} -> {decoded:10.0f} '
+              f'bytes/handshake')
+    else:
+        print(f'  parsed:  {parsed:10.0f} bytes/handshake')
+        print(f'  decoded: {decoded:10.0f} bytes/handshake')
+
+
+def bench_diff(pairs: int = 5000):
+    # each pair differs in keys, ids and randoms only, as two runs of
+    # the same client against the same server do
+    hs_a = [list(HandShake(source=quic_handshake_records()))
+            for _ in range(100)]
+    hs_b = [list(HandShake(source=quic_handshake_records()))
+            for _ in range(100)]
+    start = time.perf_counter()
+    changes = 0
+    for i in range(pairs):
+        changes += len(HandshakeDiff(hs_a[i % 100], hs_b[i % 100]))
+    duration = time.perf_counter() - start
+    print(f'{pairs} handshake pairs diffed, {changes} changes')
+    print(f'  {pairs / duration:10.0f} pairs/s')
+
+
+def _ngtcp2_dump(data: bytes) -> List[str]:
+    lines = []
+    for off in range(0, len(data), 16):
+        chunk = data[off:off + 16]
+        hx = ' '.join([f'{b:02x}' for b in chunk[:8]])
+        if len(chunk) > 8:
+            hx += '  ' + ' '.join([f'{b:02x}' for b in chunk[8:]])
+        asc = ''.join([chr(b) if 32 <= b < 127 else '.' for b in chunk])
+        lines.append(f'{off:08x}  {hx:<48}  |{asc}|\n')
+    lines.append(f'{len(data):08x}\n')
+    return lines
+
+
+def _openssl_dump(data: bytes) -> List[str]:
+    lines = []
+    for off in range(0, len(data), 16):
+        chunk = data[off:off + 16]
+        hx = ''.join([f'{b:02x}' + ('-' if i == 7 and len(chunk) > 8 else ' ')
+                      for i, b in enumerate(chunk)])
+        asc = ''.join([chr(b) if 32 <= b < 127 else '.' for b in chunk])
+        lines.append(f'{off:04x} - {hx:<48}  {asc}\n')
+    return lines
+
+
+def synthetic_client_log(size: int) -> List[str]:
+    # ngtcp2 client log lines of at least `size` bytes: CRYPTO data
+    # dumps between packet and frame log lines, as with developer
+    # verbosity
+    records = quic_handshake_records()
+    lines = []
+    total = 0
+    n = 0
+    while total < size:
+        for rec in records:
+            chunk = [f'I{n:08d} 0x1234 pkt rx pkn={n} dcid=0x0102 type=Handshake\n',
+                     f'I{n:08d} 0x1234 frm rx {n} Handshake CRYPTO(0x06) '
+                     f'offset=0 length={len(rec)}\n',
+                     f'I{n:08d} 0x1234 con recv_crypto_data\n',
+                     'Ordered CRYPTO data in Handshake crypto level\n']
+            chunk.extend(_ngtcp2_dump(rec))
+            chunk.append(f'I{n:08d} 0x1234 ldc loss_detection_timer=0\n')
+            total += sum([len(line) for line in chunk])
+            lines.extend(chunk)
+            n += 1
+    return lines
+
+
+def _regex_hexdumps(source, leading_regex=None):
+    # the hexdump scan with regex matching on every line, as
+    # `HexDumpScanner` did before its fixed layout parsing
+    data = b''
+    offset = 0 if leading_regex is None else -1
+    idx = 0
+    for l in source:
+        if offset == 0:
+            m = re.match(r'^\s*0+(\s+-)?(([\s-]+[0-9a-f]{2}){1,16})(\s+.*)$',
+                         l, re.IGNORECASE)
+            if m:
+                data = binascii.unhexlify(re.sub(r'[\s-]+', '', m.group(2)))
+                offset = 16
+                idx = 1
+                continue
+        elif offset > 0:
+            m = re.match(r'^\s*([0-9a-f]+)(\s+-)?(([\s-]+[0-9a-f]{2}){1,16})'
+                         r'(\s+.*)$', l, re.IGNORECASE)
+            if m:
+                loffset = int(m.group(1), 16)
+                if loffset == offset or loffset == idx:
+                    data += binascii.unhexlify(re.sub(r'[\s-]+', '',
+                                                      m.group(3)))
+                    offset += 16
+                    idx += 1
+                    continue
+        if len(data) > 0:
+            yield data
+            data = b''
+        offset = 0 if leading_regex is None \
+            or leading_regex.match(l) else -1
+    if len(data) > 0:
+        yield data
+
+
+def bench_hexdump(size_mb: int = 8, rounds: int = 3):
+    lines = synthetic_client_log(size_mb * 1024 * 1024)
+    ossl_lines = []
+    for rec in quic_handshake_records(cert_entries=20):
+        ossl_lines.append('write to 0x55d4 [0x55d5]\n')
+        ossl_lines.extend(_openssl_dump(rec))
+    leading = re.compile(r'Ordered CRYPTO data in \S+ crypto level')
+    print(f'{len(lines)} log lines, '
+          f'{sum([len(line) for line in lines]) / 1024 / 1024:.1f} MB')
+    for name, source, regex in [
+        ('ngtcp2, leading line', lines, leading),
+        ('ngtcp2, all lines', lines, None),
+        ('openssl -debug', ossl_lines * 200, None),
+    ]:
+        expected = list(_regex_hexdumps(source, leading_regex=regex))
+        found = list(HexDumpScanner(source=source, leading_regex=regex))
+        if found != expected:
+            raise Exception(f'{name}: HexDumpScanner differs from regex scan')
+        t_regex = _timed(lambda: list(_regex_hexdumps(
+            source, leading_regex=regex)), rounds)
+        t_scan = _timed(lambda: list(HexDumpScanner(
+            source=source, leading_regex=regex)), rounds)
+        print(f'  {name}: {len(found)} dumps')
+        print(f'    regex scan:     {t_regex * 1000:10.1f} ms')
+        print(f'    HexDumpScanner: {t_scan * 1000:10.1f} ms '
+              f'({t_regex / t_scan:.1f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench', description="""
+        micro benchmarks for the testenv parsers
+        """)
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+    p = subparsers.add_parser('certificate',
+                              help='decoding of large Certificate records')
+    p.add_argument('--entries', type=int, default=200)
+    p.add_argument('--size', type=int, default=4096)
+    p.add_argument('--rounds', type=int, default=20)
+    p = subparsers.add_parser('memory',
+                              help='memory used by parsed handshakes')
+    p.add_argument('--handshakes', type=int, default=500)
+    p.add_argument('--baseline', default=None,
+                   help='git revision whose tls module to compare against')
+    p = subparsers.add_parser('diff', help='structural handshake diffs')
+    p.add_argument('--pairs', type=int, default=5000)
+    p = subparsers.add_parser('hexdump',
+                              help='scanning logs for hexdumps')
+    p.add_argument('--size', type=int, default=8, help='log size in MB')
+    p.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    if args.bench == 'certificate':
+        bench_certificate(entries=args.entries, cert_size=args.size,
+                          rounds=args.rounds)
+    elif args.bench == 'memory':
+        bench_memory(handshakes=args.handshakes, baseline=args.baseline)
+    elif args.bench == 'diff':
+        bench_diff(pairs=args.pairs)
+    elif args.bench == 'hexdump':
+        bench_hexdump(size_mb=args.size, rounds=args.rounds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
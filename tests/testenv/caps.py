@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+from typing import Any, Dict, Iterable, List, Optional
+
+
+log = logging.getLogger(__name__)
+
+
+class ClientCapabilities:
+    """What an ngtcp2 example client supports, from the options listed
+       in its `--help` output."""
+
+    # features tests ask for and the client options they need
+    FEATURES = {
+        'session': ['session-file', 'tp-file'],
+        'early-data': ['session-file', 'tp-file', 'data',
+                       'disable-early-data'],
+        'ciphers': ['ciphers'],
+        'groups': ['groups'],
+        'key-update': ['key-update'],
+        'client-cert': ['key', 'cert'],
+        'qlog': ['qlog-file'],
+    }
+    RE_OPTION = re.compile(r'(?:^|[\s,])--([a-z0-9][a-z0-9-]*)')
+
+    def __init__(self, options: Iterable[str], version: Optional[str] = None,
+                 error: Optional[str] = None):
+        self.options = set(options)
+        self.version = version
+        self.error = error
+
+    @classmethod
+    def from_help(cls, text: str, version: Optional[str] = None):
+        return cls(options=cls.RE_OPTION.findall(text), version=version)
+
+    def has_option(self, option: str) -> bool:
+        return option.lstrip('-') in self.options
+
+    def supports(self, feature: str) -> bool:
+        if feature not in self.FEATURES:
+            raise Exception(f'unknown client feature: {feature}')
+        return all([opt in self.options for opt in self.FEATURES[feature]])
+
+    @property
+    def features(self) -> List[str]:
+        return [f for f in self.FEATURES if self.supports(f)]
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'options': sorted(self.options),
+            'version': self.version,
+            'error': self.error,
+        }
+
+    @classmethod
+    def from_json(cls, j: Dict[str, Any]):
+        return cls(options=j['options'], version=j.get('version'),
+                   error=j.get('error'))
+
+
+def probe_client(path: str, timeout: float = 10) -> ClientCapabilities:
+    """Run the client with `--help` and `--version` to see what it
+       supports. A client that cannot be run supports nothing."""
+    try:
+        p = subprocess.run([path, '--help'], stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT, timeout=timeout)
+        caps = ClientCapabilities.from_help(p.stdout.decode(errors='replace'))
+        if caps.has_option('version'):
+            p = subprocess.run([path, '--version'], stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, timeout=timeout)
+            lines = p.stdout.decode(errors='replace').strip().splitlines()
+            if p.returncode == 0 and len(lines) > 0:
+                caps.version = lines[0]
+        return caps
+    except (OSError, subprocess.SubprocessError) as ex:
+        log.warning(f'unable to probe client {path}: {ex}')
+        return ClientCapabilities(options=[], error=str(ex))
+
+
+class CapabilityCache:
+    """Probed client capabilities, kept in a JSON file.
+
+    An entry is used as long as the binary has the same mtime and size,
+    so a client is probed again after it has been rebuilt.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._entries = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _load(self) -> Dict[str, Any]:
+        if self._entries is None:
+            try:
+                with open(self._path) as fd:
+                    self._entries = json.load(fd)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        # write and rename, so that concurrent readers never see half
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._path),
+                                        suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._path)
+
+    def get(self, path: str) -> ClientCapabilities:
+        """The capabilities of the client at `path`, probed if not cached."""
+        st = os.stat(path)
+        entries = self._load()
+        entry = entries.get(path)
+        if entry is not None and entry.get('mtime_ns') == st.st_mtime_ns \
+                and entry.get('size') == st.st_size:
+            return ClientCapabilities.from_json(entry['caps'])
+        caps = probe_client(path)
+        entries[path] = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'caps': caps.to_json(),
+        }
+        self._save()
+        return caps
+
+    def clear(self):
+        self._entries = {}
+        if os.path.exists(self._path):
+            os.remove(self._path)
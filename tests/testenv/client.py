@@ -2,59 +2,184 @@ import logging
 import os
 import re
 import subprocess
-from typing import List
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import pytest
 
 from .certs import Credentials
 from .env import Env
 from .log import HexDumpScanner, LogFile
+from .qlog import QlogConnection, QlogReader
 from .tls import HSRecord, HandShake
 
 log = logging.getLogger(__name__)
 
 
 class QuicClientRun:
+    """The result of an `ExampleClient` request.
 
-    def __init__(self, env: Env, returncode, logfile: LogFile):
+    The client log is read as a stream, in one pass that collects the
+    received handshake records, the client's connection id and whether
+    early data was rejected. The pass ends once the handshake has been
+    confirmed, so the response data logged after that is never read.
+    The handshake therefore ends with the server's Finished, records
+    sent after it, like NewSessionTicket, are not part of it.
+
+    `duration` is how many seconds the client process ran.
+
+    Runs that write into a directory of their own are read on first use.
+    Runs sharing the client's log are read when the request finishes,
+    before the next request overwrites the log. Their `log_lines` must
+    be read before that as well.
+    """
+
+    CRYPTO_LINE = re.compile(r'Ordered CRYPTO data in \S+ crypto level')
+    SCID_LINE = re.compile(r'^I\d+ 0x([0-9a-f]+) ')
+    EARLY_DATA_REJECTED = 'Early data was rejected by server'
+
+    def __init__(self, env: Env, returncode, logfile: LogFile,
+                 qlog_path: Optional[str] = None,
+                 run_dir: Optional[str] = None,
+                 duration: Optional[float] = None):
         self.env = env
         self.returncode = returncode
+        self.duration = duration
         self.logfile = logfile
-        self.log_lines = logfile.get_recent()
-        self._data_recs = None
+        self.run_dir = run_dir
+        # the part of the log written by this run, read on demand
+        self._log_range = logfile.recent_range()
+        self._log_mtime = self._mtime()
+        self.qlog_path = qlog_path
         self._hs_recs = None
+        self._scid = None
+        self._early_data_rejected = False
+        self._qlog = None
+
+    def _mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.logfile.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @property
+    def log_lines(self) -> List[str]:
+        return list(self.iter_log_lines())
+
+    def iter_log_lines(self) -> Iterator[str]:
+        """All lines of the log of this run, read lazily."""
+        return self.logfile.iter_range(*self._log_range)
+
+    def _scanned_lines(self, lines: Iterator[str],
+                       hs_finished: List[bool]) -> Iterator[str]:
+        # pass on the lines, noting what is needed besides the hexdumps,
+        # until a HANDSHAKE_DONE frame arrives after the server Finished
+        for line in lines:
+            if self._scid is None:
+                m = self.SCID_LINE.match(line)
+                if m:
+                    self._scid = m.group(1)
+            if line.startswith(self.EARLY_DATA_REJECTED):
+                self._early_data_rejected = True
+            if hs_finished[0] and 'HANDSHAKE_DONE' in line:
+                return
+            yield line
+
+    def _scan(self):
+        if self._hs_recs is None:
+            for _ in self._iter_scan():
+                pass
+
+    def _iter_scan(self) -> Iterator[HSRecord]:
+        # produce the records as they are found, keep them once all are
+        if self._mtime() != self._log_mtime:
+            log.warning(f'{self.logfile.path} was changed after the run, '
+                        f'the handshake is read from the new content')
+        hs_recs = []
+        hs_finished = [False]
+        lines = self.iter_log_lines()
+        try:
+            scanner = HexDumpScanner(
+                source=self._scanned_lines(lines, hs_finished),
+                leading_regex=self.CRYPTO_LINE)
+            for hrec in HandShake(source=scanner, verbose=self.env.verbose):
+                hs_recs.append(hrec)
+                if hrec.name == 'Finished':
+                    hs_finished[0] = True
+                yield hrec
+        finally:
+            if hasattr(lines, 'close'):
+                lines.close()
+            self.logfile.close()
         if self.env.verbose > 1:
-            log.debug(f'read {len(self.log_lines)} lines from {logfile.path}')
+            log.debug(f'detected {len(hs_recs)} crypto '
+                      f'records in {self.logfile.path}')
+        self._hs_recs = hs_recs
+
+    @property
+    def scid(self) -> Optional[str]:
+        """The source connection id of the client, as hex."""
+        self._scan()
+        return self._scid
+
+    def iter_handshake(self) -> Iterator[HSRecord]:
+        """Produce the handshake records as they are found in the log."""
+        if self._hs_recs is not None:
+            yield from self._hs_recs
+        else:
+            yield from self._iter_scan()
+
+    def find_record(self, name: str) -> Optional[HSRecord]:
+        """Get the first handshake record with `name`."""
+        for hrec in self.iter_handshake():
+            if hrec.name == name:
+                return hrec
+        return None
 
     @property
     def handshake(self) -> List[HSRecord]:
-        if self._data_recs is None:
-            crypto_line =  re.compile(r'Ordered CRYPTO data in \S+ crypto level')
-            scanner = HexDumpScanner(source=self.log_lines,
-                                     leading_regex=crypto_line)
-            self._data_recs = [data for data in scanner]
-            if self.env.verbose > 1:
-                log.debug(f'detected {len(self._data_recs)} crypto hexdumps '
-                          f'in {self.logfile.path}')
-        if self._hs_recs is None:
-            self._hs_recs = [hrec for hrec in HandShake(source=self._data_recs,
-                                                        verbose=self.env.verbose)]
-            if self.env.verbose > 1:
-                log.debug(f'detected {len(self._hs_recs)} crypto '
-                          f'records in {self.logfile.path}')
+        self._scan()
         return self._hs_recs
 
+    @property
+    def qlog(self) -> Optional[QlogConnection]:
+        """Timing and packet counts from the client's qlog, read on
+           first access. None if the client wrote no qlog."""
+        if self._qlog is None and self.qlog_path is not None \
+                and os.path.isfile(self.qlog_path):
+            conns = QlogReader(self.qlog_path).connections()
+            if len(conns) > 0:
+                self._qlog = conns[0]
+        return self._qlog
+
     @property
     def hs_stripe(self) -> str:
         return ":".join([hrec.name for hrec in self.handshake])
 
     @property
-    def early_data_rejected(self) -> bool:
-        for l in self.log_lines:
-            if re.match(r'^Early data was rejected by server.*', l):
+    def resumed(self) -> bool:
+        """If the server's flight had no Certificate."""
+        for hrec in self.iter_handshake():
+            if hrec.name == 'Certificate':
+                return False
+            elif hrec.name == 'Finished':
                 return True
         return False
 
+    @property
+    def early_data_rejected(self) -> bool:
+        self._scan()
+        return self._early_data_rejected
+
+    @property
+    def early_data_accepted(self) -> bool:
+        """If the server's EncryptedExtensions had the early_data
+           extension, its acceptance of the early data."""
+        hrec = self.find_record('EncryptedExtensions')
+        return hrec is not None and hrec.get_extension(0x2a) is not None
+
     def norm_exp(self, c_hs, allow_hello_retry=True):
         if allow_hello_retry and self.hs_stripe.startswith('HelloRetryRequest:'):
             c_hs = "HelloRetryRequest:" + c_hs
@@ -89,9 +214,12 @@ class QuicClientRun:
 
 class ExampleClient:
 
-    def __init__(self, env: Env, crypto_lib: str):
+    def __init__(self, env: Env, crypto_lib: str, isolate_runs: bool = False):
+        """With `isolate_runs`, each request writes its log, qlog and data
+           into a new directory below gen/runs, so requests may overlap."""
         self.env = env
         self._crypto_lib = crypto_lib
+        self._isolate_runs = isolate_runs
         self._path = env.client_path(self._crypto_lib)
         self._log_path = f'{self.env.gen_dir}/{self._crypto_lib}-client.log'
         self._qlog_path = f'{self.env.gen_dir}/{self._crypto_lib}-client.qlog'
@@ -112,6 +240,21 @@ class ExampleClient:
     def exists(self):
         return os.path.isfile(self.path)
 
+    def new_run_dir(self) -> str:
+        """Create a new, unique directory for the artifacts of one request.
+           The directories are removed by the next `Env.setup()`."""
+        os.makedirs(self.env.runs_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=f'{self._crypto_lib}-',
+                                dir=self.env.runs_dir)
+
+    def _run_paths(self, run_dir: Optional[str]) -> Tuple[str, str, str]:
+        # the log, qlog and data file for a request
+        if run_dir is None:
+            return self._log_path, self._qlog_path, self._data_path
+        os.makedirs(run_dir, exist_ok=True)
+        return tuple([os.path.join(run_dir, f'{self._crypto_lib}-client.{ext}')
+                      for ext in ['log', 'qlog', 'data']])
+
     def clear_session(self):
         if os.path.isfile(self._session_path):
             os.remove(self._session_path)
@@ -121,18 +264,41 @@ class ExampleClient:
     def http_get(self, url: str, extra_args: List[str] = None,
                  use_session=False, data=None,
                  credentials: Credentials = None,
-                 ciphers: str = None):
+                 ciphers: str = None, run_dir: str = None):
+        args, log_path, qlog_path, run_dir = self._prepare_get(
+            url=url, extra_args=extra_args, use_session=use_session,
+            data=data, credentials=credentials, run_dir=run_dir)
+        with open(log_path, 'w') as log_file:
+            logfile = LogFile(path=log_path)
+            log_file.write(self._log_header(args))
+            log_file.flush()
+            start = time.monotonic()
+            process = subprocess.Popen(args=args, text=True,
+                                       stdout=log_file, stderr=log_file)
+            process.wait()
+            return self._finish_get(process.returncode, logfile,
+                                    qlog_path=qlog_path, run_dir=run_dir,
+                                    duration=time.monotonic() - start)
+
+    def _prepare_get(self, url: str, extra_args: List[str] = None,
+                     use_session=False, data=None,
+                     credentials: Credentials = None,
+                     run_dir: str = None) -> Tuple[List[str], str, str, str]:
+        # the client arguments, log and qlog path and run dir of a GET
+        if run_dir is None and self._isolate_runs:
+            run_dir = self.new_run_dir()
+        log_path, qlog_path, data_path = self._run_paths(run_dir)
         args = [
             self.path, '--exit-on-all-streams-close',
-            f'--qlog-file={self._qlog_path}'
+            f'--qlog-file={qlog_path}'
         ]
         if use_session:
             args.append(f'--session-file={self._session_path}')
             args.append(f'--tp-file={self._tp_path}')
         if data is not None:
-            with open(self._data_path, 'w') as fd:
+            with open(data_path, 'w') as fd:
                 fd.write(data)
-            args.append(f'--data={self._data_path}')
+            args.append(f'--data={data_path}')
         if credentials is not None:
             args.append(f'--key={credentials.pkey_file}')
             args.append(f'--cert={credentials.cert_file}')
@@ -142,15 +308,69 @@ class ExampleClient:
             'localhost', str(self.env.haproxy_port),
             url
         ])
-        if os.path.isfile(self._qlog_path):
-            os.remove(self._qlog_path)
-        with open(self._log_path, 'w') as log_file:
-            logfile = LogFile(path=self._log_path)
-            log_file.write(f'*******\n******* {" ".join(args)}\n*******\n')
-            log_file.flush()
-            process = subprocess.Popen(args=args, text=True,
-                                       stdout=log_file, stderr=log_file)
-            process.wait()
-            return QuicClientRun(env=self.env, returncode=process.returncode,
-                                 logfile=logfile)
+        if os.path.isfile(qlog_path):
+            os.remove(qlog_path)
+        return args, log_path, qlog_path, run_dir
+
+    @staticmethod
+    def _log_header(args: List[str]) -> str:
+        return f'*******\n******* {" ".join(args)}\n*******\n'
+
+    def _finish_get(self, returncode: int, logfile: LogFile,
+                    qlog_path: str, run_dir: Optional[str],
+                    duration: Optional[float] = None) -> QuicClientRun:
+        run = QuicClientRun(env=self.env, returncode=returncode,
+                            logfile=logfile, qlog_path=qlog_path,
+                            run_dir=run_dir, duration=duration)
+        if run_dir is None:
+            # the next request overwrites the log
+            run._scan()
+        logfile.close()
+        return run
+
+
+class ClientRunner:
+    """Runs requests of `ExampleClient`s concurrently.
+
+    Each request runs in a thread of a pool and writes its artifacts
+    into a directory of its own. Requests using the session file of the
+    same client should not run at the same time.
+    """
+
+    def __init__(self, env: Env, max_workers: int = None):
+        self.env = env
+        self._max_workers = max_workers
+
+    @staticmethod
+    def _run(client: ExampleClient, kwargs: Dict[str, Any]) -> QuicClientRun:
+        kwargs = dict(kwargs)
+        if kwargs.get('run_dir') is None:
+            kwargs['run_dir'] = client.new_run_dir()
+        return client.http_get(**kwargs)
+
+    def run(self, requests: List[Tuple[ExampleClient, Dict[str, Any]]]
+            ) -> List[QuicClientRun]:
+        """Run the (client, http_get arguments) requests, the results
+           are in the same order."""
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            futures = [pool.submit(self._run, client, kwargs)
+                       for client, kwargs in requests]
+            return [f.result() for f in futures]
+
+    def run_matrix(self, url: str, crypto_libs: List[str] = None,
+                   count: int = 1, **kwargs) -> Dict[str, List[QuicClientRun]]:
+        """GET `url` `count` times with the client of each crypto lib,
+           all at the same time."""
+        if crypto_libs is None:
+            crypto_libs = self.env.crypto_libs()
+        requests = []
+        for lib in crypto_libs:
+            client = ExampleClient(env=self.env, crypto_lib=lib)
+            requests.extend([(client, dict(url=url, **kwargs))
+                             for _ in range(count)])
+        runs = self.run(requests)
+        results = {lib: [] for lib in crypto_libs}
+        for (client, _), run in zip(requests, runs):
+            results[client.crypto_lib].append(run)
+        return results
 
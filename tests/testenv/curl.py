@@ -130,13 +130,15 @@ class CurlClient:
         return r
 
     def _complete_args(self, urls, timeout=None, options=None,
-                       insecure=False, force_resolve=True):
+                       insecure=False, force_resolve=True, headerfile=None):
         if not isinstance(urls, list):
             urls = [urls]
         u = urlparse(urls[0])
+        if headerfile is None:
+            headerfile = self._headerfile
 
         args = [
-            self._curl, "-s", "--path-as-is", "-D", self._headerfile,
+            self._curl, "-s", "--path-as-is", "-D", headerfile,
         ]
         if u.scheme == 'http':
             pass
@@ -156,7 +158,7 @@ class CurlClient:
         if options:
             args.extend(options)
         args += urls
-        return args, self._headerfile
+        return args, headerfile
 
     def _parse_headerfile(self, headerfile: str, r: ExecResult = None) -> ExecResult:
         lines = open(headerfile).readlines()
@@ -1,11 +1,13 @@
 import logging
 import os
 import re
+import shutil
 import subprocess
 import sys
 from configparser import ConfigParser, ExtendedInterpolation
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
+from .caps import CapabilityCache, ClientCapabilities
 from .certs import CertificateSpec, TestCA, Credentials
 
 log = logging.getLogger(__name__)
@@ -42,13 +44,29 @@ def init_clients(config):
 
 
 AVAILABLE_CLIENTS = init_clients(DEF_CONFIG)
+CLIENT_CAPS = CapabilityCache(os.path.join(TESTS_PATH, 'gen', 'client-caps.json'))
 
 
 class Env:
 
     @staticmethod
-    def crypto_libs():
-        return sorted(AVAILABLE_CLIENTS.keys())
+    def crypto_libs(requires: List[str] = None):
+        """The crypto libs with an example client, only those whose
+           client supports all features in `requires`, if given."""
+        libs = sorted(AVAILABLE_CLIENTS.keys())
+        if requires:
+            libs = [lib for lib in libs
+                    if all([Env.client_caps(lib).supports(feature)
+                            for feature in requires])]
+        return libs
+
+    @staticmethod
+    def client_caps(libname) -> Optional[ClientCapabilities]:
+        """What the example client of `libname` supports, probed once
+           per build of the client."""
+        if libname in AVAILABLE_CLIENTS:
+            return CLIENT_CAPS.get(AVAILABLE_CLIENTS[libname])
+        return None
 
     @staticmethod
     def client_path(libname):
@@ -103,6 +121,8 @@ class Env:
 
     def setup(self):
         os.makedirs(self._gen_dir, exist_ok=True)
+        # the artifacts of isolated client runs are kept until the next setup
+        shutil.rmtree(self.runs_dir, ignore_errors=True)
         os.makedirs(self._htdocs_dir, exist_ok=True)
         self.issue_certs()
 
@@ -146,6 +166,10 @@ class Env:
     def gen_dir(self) -> str:
         return self._gen_dir
 
+    @property
+    def runs_dir(self) -> str:
+        return os.path.join(self._gen_dir, 'runs')
+
     @property
     def ca(self):
         return self._ca
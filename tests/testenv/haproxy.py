@@ -4,8 +4,12 @@ import os
 import socket
 import subprocess
 import time
+from typing import List
 
 from .env import Env
+from .log import LogFile
+from .logrotate import LogRotator, LogSegments
+from .trace import TraceIndex
 
 
 log = logging.getLogger(__name__)
@@ -13,16 +17,35 @@ log = logging.getLogger(__name__)
 
 class HAProxy:
 
-    def __init__(self, env: Env, https_opts=None):
+    TRACE_RING = 'quic_traces'
+
+    def __init__(self, env: Env, https_opts=None, trace_ring_size: int = 0,
+                 log_max_size: int = 0, trace: bool = True, quic_opts=None):
+        """With a `trace_ring_size`, QUIC traces go into a ring buffer of
+           that many bytes instead of haproxy.log and are fetched over the
+           stats socket when needed. With a `log_max_size`, haproxy.log
+           is rotated into compressed segments when it gets larger.
+           Without `trace`, QUIC traces are not started at all.
+           `quic_opts` are the options of the QUIC bind, like `https_opts`
+           for the TCP one."""
         self.env = env
+        self._trace = trace
+        self._trace_ring_size = trace_ring_size
+        self._ring_last = None
         self._cmd = env.haproxy
         self._https_opts = https_opts if https_opts else 'alpn h2,http/1.1'
+        self._quic_opts = quic_opts if quic_opts else 'alpn h3'
         self._conf_file = os.path.join(env.gen_dir, 'haproxy.cfg')
         self._process = None
         self._logpath = f'{self.env.gen_dir}/haproxy.log'
         self._rmf(self._logpath)
+        LogSegments(self._logpath).clear()
         self._logfile = None
+        self._rotator = LogRotator(self._logpath, max_size=log_max_size) \
+            if log_max_size > 0 else None
         self._stats_sock = os.path.join(env.gen_dir, 'haproxy.sock')
+        self._trace_log = None
+        self._trace_index = None
 
     def exists(self):
         return os.path.exists(self._cmd)
@@ -30,7 +53,15 @@ class HAProxy:
     def start(self):
         if self._process:
             self.stop()
-        self._logfile = open(self._logpath, 'w')
+        # truncate, then append so that the log can be rotated
+        open(self._logpath, 'w').close()
+        self._logfile = open(self._logpath, 'a')
+        if self._rotator is not None:
+            self._rotator.clear()
+            self._rotator.start()
+        self._trace_log = LogFile(self._logpath)
+        self._trace_index = TraceIndex()
+        self._ring_last = None
         self._write_config()
         self._rmf(self._stats_sock)
         try:
@@ -49,14 +80,11 @@ class HAProxy:
                 and not os.path.exists(self._stats_sock)\
                 and datetime.datetime.now() < end:
             time.sleep(.1)
-        if os.path.exists(self._stats_sock):
-            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            sock.connect(self._stats_sock)
-            msg = 'trace quic event +any; trace quic lock listener; '\
-                  'trace quic sink stderr; trace quic level developer; '\
-                  'trace quic start now; show trace'
-            sock.sendall(msg.encode())
-            sock.close()
+        if self._trace and os.path.exists(self._stats_sock):
+            sink = self.TRACE_RING if self._trace_ring_size > 0 else 'stderr'
+            self._stats_cmd(f'trace quic event +any; trace quic lock listener; '
+                            f'trace quic sink {sink}; trace quic level developer; '
+                            f'trace quic start now; show trace')
         sock = socket.create_connection(('127.0.0.1', self.env.haproxy_port))
         sock.close()
         return self._process.returncode is None
@@ -69,11 +97,67 @@ class HAProxy:
                     and datetime.datetime.now() < end:
                 time.sleep(.1)
             self._process = None
+        if self._rotator is not None:
+            self._rotator.stop()
         if self._logfile:
             self._logfile.close()
             self._logfile = None
         return True
 
+    @property
+    def trace_mode(self) -> str:
+        """Where QUIC traces go: 'off', 'ring' or 'log'."""
+        if not self._trace:
+            return 'off'
+        return 'ring' if self._trace_ring_size > 0 else 'log'
+
+    def _stats_cmd(self, cmd: str) -> str:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._stats_sock)
+            sock.sendall(f'{cmd}\n'.encode())
+            chunks = []
+            while True:
+                chunk = sock.recv(64 * 1024)
+                if len(chunk) == 0:
+                    break
+                chunks.append(chunk)
+            return b''.join(chunks).decode(errors='replace')
+        finally:
+            sock.close()
+
+    def show_events(self, new_only: bool = True) -> List[str]:
+        """The trace lines in the ring buffer. With `new_only`, only the
+           ones added since the last call."""
+        if self._trace_ring_size <= 0:
+            raise Exception('haproxy not configured with a trace ring')
+        lines = self._stats_cmd(f'show events {self.TRACE_RING}')\
+            .splitlines(keepends=True)
+        lines = [line for line in lines if len(line.strip()) > 0]
+        last = self._ring_last
+        if len(lines) > 0:
+            self._ring_last = lines[-1]
+        if new_only and last is not None:
+            # the ring is oldest first, skip what we have seen. If the last
+            # line we saw has been overwritten, all lines are new.
+            for idx in range(len(lines) - 1, -1, -1):
+                if lines[idx] == last:
+                    return lines[idx + 1:]
+        return lines
+
+    def trace_index(self) -> TraceIndex:
+        """The QUIC trace events since start, by connection. Each call
+           adds the events traced since the previous one."""
+        if self._trace_log is None:
+            self._trace_log = LogFile(self._logpath)
+            self._trace_index = TraceIndex()
+        if self._trace_ring_size > 0:
+            lines = self.show_events(new_only=True)
+        else:
+            lines = self._trace_log.iter_recent()
+        self._trace_index.add_lines(lines)
+        return self._trace_index
+
     def restart(self):
         self.stop()
         return self.start()
@@ -82,6 +166,18 @@ class HAProxy:
         if os.path.exists(path):
             return os.remove(path)
 
+    def _ring_config(self) -> List[str]:
+        if self._trace_ring_size <= 0:
+            return []
+        return [
+            f"ring {self.TRACE_RING}",
+            f"    description \"QUIC traces\"",
+            f"    format timed",
+            f"    maxlen 4096",
+            f"    size {self._trace_ring_size}",
+            f"",
+        ]
+
     def _write_config(self):
         with open(self._conf_file, 'w') as fd:
             fd.write("\n".join([
@@ -92,6 +188,7 @@ class HAProxy:
                 f"",
                 f"httpclient.ssl.ca-file {self.env.ca.cert_file}",
                 f"",
+            ] + self._ring_config() + [
                 f"defaults",
                 f"    mode http",
                 f"    balance random",
@@ -114,7 +211,7 @@ class HAProxy:
                 f"",
                 f"frontend front2",
                 f"    mode http",
-                f"    bind quic4@:{self.env.haproxy_port} ssl crt {self.env.get_server_credentials().combined_file} alpn h3",
+                f"    bind quic4@:{self.env.haproxy_port} ssl crt {self.env.get_server_credentials().combined_file} {self._quic_opts}",
                 f'    error-log-format "%ci:%cp [%tr] %ft %ac/%fc %[fc_err]/%[ssl_fc_err_str]/%[ssl_c_err]/%[ssl_c_ca_err]/%[ssl_fc_is_resumed] %[ssl_fc_sni]/%sslv/%sslc"',
                 f"    log stderr format iso local7",
                 f"    option httplog",
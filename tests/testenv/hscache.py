@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Iterable, List, Optional, Tuple, Union
+
+from .tls import PARSER_VERSION, HandShake, HSRecord, ParseError
+
+
+log = logging.getLogger(__name__)
+
+
+class HandshakeCache:
+    """Parsed handshake records on disk, addressed by a hash of the
+       log data they were parsed from.
+
+    An entry holds one or more lists of records, e.g. those sent and
+    received. The records are stored as their handshake messages, one
+    list after the other, each preceded by its length. Reading an entry
+    creates the records again without scanning any hexdumps.
+
+    Entries only hit when the very same log is parsed again, as when
+    archived gen/ directories are analyzed repeatedly. Logs of live runs
+    differ every time in randoms, keys and tickets, so the test clients
+    do not use the cache.
+
+    When the total size exceeds `max_size` bytes, the least recently
+    used entries are removed. The total is counted once from the cache
+    directory and then kept up to date on `put`, so other processes
+    writing to the same directory are only noticed on the next eviction.
+    """
+
+    MAGIC = b'HSC1'
+
+    def __init__(self, cache_dir: str, max_size: int = 64 * 1024 * 1024):
+        self._dir = cache_dir
+        self._max_size = max_size
+        self._total = None
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def cache_dir(self) -> str:
+        return self._dir
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @staticmethod
+    def key(kind: str, lines: Iterable[Union[str, bytes]]) -> str:
+        """The cache key for data of `kind`, e.g. the parser used on it,
+           in the given log lines."""
+        h = hashlib.sha256(f'{PARSER_VERSION}:{kind}\n'.encode())
+        for line in lines:
+            h.update(line.encode() if isinstance(line, str) else line)
+            h.update(b'\n')
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._dir, key[0:2], f'{key}.hsc')
+
+    def get(self, key: str) -> Optional[List[List[HSRecord]]]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+            os.utime(path)
+            rec_lists = self._decode(data)
+        except (OSError, ParseError) as ex:
+            if os.path.exists(path):
+                log.debug(f'dropping hs cache entry {key}: {ex}')
+                self._remove(path)
+            self._misses += 1
+            return None
+        self._hits += 1
+        return rec_lists
+
+    def put(self, key: str, rec_lists: List[List[HSRecord]]):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write and rename, so that concurrent readers never see half
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        data = self._encode(rec_lists)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        if self._total is None:
+            self._total = sum([size for _, size, _ in self._entries()])
+        else:
+            self._total += len(data) - replaced
+        if self._total > self._max_size:
+            # make some room, so that the next puts do not evict again
+            self.evict(target=self._max_size * 9 // 10)
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        # (mtime, size, path) of all entries
+        entries = []
+        for dirpath, _, fnames in os.walk(self._dir):
+            for fname in fnames:
+                if not fname.endswith('.hsc'):
+                    continue
+                path = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, target: Optional[int] = None):
+        """Remove least recently used entries until the cache holds at
+           most `target` bytes, `max_size` by default."""
+        if target is None:
+            target = self._max_size
+        entries = self._entries()
+        total = sum([size for _, size, _ in entries])
+        self._total = total
+        if total <= target:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._total = total
+
+    def clear(self):
+        self._total = 0
+        for dirpath, _, fnames in os.walk(self._dir):
+            for fname in fnames:
+                if fname.endswith('.hsc'):
+                    self._remove(os.path.join(dirpath, fname))
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @classmethod
+    def _encode(cls, rec_lists: List[List[HSRecord]]) -> bytes:
+        out = [cls.MAGIC, len(rec_lists).to_bytes(2, byteorder='big')]
+        for recs in rec_lists:
+            msgs = b''.join([bytes([hrec.hsid])
+                             + len(hrec.data).to_bytes(3, byteorder='big')
+                             + hrec.data for hrec in recs])
+            out.append(len(msgs).to_bytes(4, byteorder='big'))
+            out.append(msgs)
+        return b''.join(out)
+
+    @classmethod
+    def _decode(cls, data: bytes) -> List[List[HSRecord]]:
+        if data[0:4] != cls.MAGIC or len(data) < 6:
+            raise ParseError('not a handshake cache entry')
+        count = int.from_bytes(data[4:6], byteorder='big')
+        pos = 6
+        rec_lists = []
+        for _ in range(count):
+            mlen = int.from_bytes(data[pos:pos + 4], byteorder='big')
+            pos += 4
+            if pos + mlen > len(data):
+                raise ParseError('truncated handshake cache entry')
+            rec_lists.append(list(HandShake(source=[data[pos:pos + mlen]],
+                                            strict=True)))
+            pos += mlen
+        return rec_lists
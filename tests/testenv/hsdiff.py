@@ -0,0 +1,198 @@
+import binascii
+import logging
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .tls import Certificate, ClientHello, Extension, ExtKeyShare, \
+    ExtQuicTP, HSRecord, QuicTransportParam, ServerHello, TlsCipherSuites, \
+    TlsExtensions, TlsSupportedGroups, _is_grease
+
+
+log = logging.getLogger(__name__)
+
+
+class HandshakeDiff:
+    """The structural differences between two handshakes.
+
+    Records are aligned by their name and position among records of the
+    same name, so a second ClientHello after a HelloRetryRequest is
+    compared with the second one of the other handshake. For aligned
+    records, the extensions present, key share groups, QUIC transport
+    parameters, cipher suites and certificate chain lengths are compared.
+    Values that differ on every connection, like random data, keys,
+    connection ids, tickets and cookies, are not reported. GREASE
+    values are ignored in cipher suites, extension ids, supported groups
+    and versions, signature algorithms, ALPN, key shares and transport
+    parameters.
+
+    Each change is a tuple (record, field, value in a, value in b) where
+    a value is None if it is absent on that side.
+    """
+
+    # extensions whose data differs on every connection
+    VOLATILE_EXTENSIONS = {
+        0x15,  # PADDING
+        0x23,  # SESSION_TICKET
+        0x29,  # PRE_SHARED_KEY
+        0x2c,  # COOKIE
+    }
+    # extensions compared as lists of values, without GREASE, and the
+    # property holding the values
+    GREASE_LISTS = {
+        0x0a: 'groups',
+        0x0d: 'algorithms',
+        0x10: 'protocols',
+        0x2b: 'versions',
+    }
+    # transport parameters that differ on every connection
+    VOLATILE_TPS = {
+        0x00,  # original_destination_connection_id
+        0x02,  # stateless_reset_token
+        0x0f,  # initial_source_connection_id
+        0x10,  # retry_source_connection_id
+    }
+
+    def __init__(self, a: Iterable[HSRecord], b: Iterable[HSRecord]):
+        self._changes = []
+        recs_a = self._aligned(a)
+        recs_b = self._aligned(b)
+        for key, rec_a in recs_a.items():
+            rec_b = recs_b.get(key)
+            if rec_b is None:
+                self._add(key, 'record', rec_a.name, None)
+            else:
+                self._diff_records(key, rec_a, rec_b)
+        for key, rec_b in recs_b.items():
+            if key not in recs_a:
+                self._add(key, 'record', None, rec_b.name)
+
+    def __len__(self):
+        return len(self._changes)
+
+    def __bool__(self):
+        return len(self._changes) > 0
+
+    def __iter__(self):
+        return iter(self._changes)
+
+    @property
+    def changes(self) -> List[Tuple[str, str, Any, Any]]:
+        return self._changes
+
+    @staticmethod
+    def _aligned(recs: Iterable[HSRecord]) -> Dict[str, HSRecord]:
+        aligned = {}
+        counts = {}
+        for hrec in recs:
+            n = counts.get(hrec.name, 0)
+            counts[hrec.name] = n + 1
+            aligned[hrec.name if n == 0 else f'{hrec.name}[{n}]'] = hrec
+        return aligned
+
+    def _add(self, record: str, field: str, a, b):
+        self._changes.append((record, field, a, b))
+
+    def _diff_records(self, key: str, a: HSRecord, b: HSRecord):
+        if isinstance(a, ClientHello):
+            ciphers_a = [c for c in a.ciphers if not _is_grease(c)]
+            ciphers_b = [c for c in b.ciphers if not _is_grease(c)]
+            if ciphers_a != ciphers_b:
+                self._add(key, 'ciphers',
+                          [TlsCipherSuites.name(c) for c in ciphers_a],
+                          [TlsCipherSuites.name(c) for c in ciphers_b])
+        elif isinstance(a, ServerHello):
+            if a.cipher != b.cipher:
+                self._add(key, 'cipher', TlsCipherSuites.name(a.cipher),
+                          TlsCipherSuites.name(b.cipher))
+        elif isinstance(a, Certificate):
+            if a.chain_length != b.chain_length:
+                self._add(key, 'chain_length', a.chain_length,
+                          b.chain_length)
+        self._diff_extensions(key, a, b)
+
+    def _diff_extensions(self, key: str, a: HSRecord, b: HSRecord):
+        ids_a = [eid for eid in a.extension_ids if not _is_grease(eid)]
+        ids_b = [eid for eid in b.extension_ids if not _is_grease(eid)]
+        for eid in ids_a:
+            if eid not in ids_b:
+                self._add(key, TlsExtensions.name(eid), 'present', None)
+        for eid in ids_b:
+            if eid not in ids_a:
+                self._add(key, TlsExtensions.name(eid), None, 'present')
+        for eid in ids_a:
+            if eid not in ids_b or eid in self.VOLATILE_EXTENSIONS:
+                continue
+            ext_a = a.get_extension(eid)
+            ext_b = b.get_extension(eid)
+            if isinstance(ext_a, ExtKeyShare):
+                self._diff_key_shares(key, ext_a, ext_b)
+            elif isinstance(ext_a, ExtQuicTP):
+                self._diff_quic_tps(key, ext_a, ext_b)
+            elif eid in self.GREASE_LISTS \
+                    and hasattr(ext_a, self.GREASE_LISTS[eid]) \
+                    and hasattr(ext_b, self.GREASE_LISTS[eid]):
+                self._diff_values(key, ext_a, ext_b, self.GREASE_LISTS[eid])
+            elif ext_a.data != ext_b.data:
+                self._add(key, ext_a.name,
+                          binascii.hexlify(ext_a.data).decode(),
+                          binascii.hexlify(ext_b.data).decode())
+
+    def _diff_key_shares(self, key: str, a: ExtKeyShare, b: ExtKeyShare):
+        groups_a = [g for g in a.groups if not _is_grease(g)]
+        groups_b = [g for g in b.groups if not _is_grease(g)]
+        if groups_a != groups_b:
+            self._add(key, f'{a.name}.groups',
+                      [TlsSupportedGroups.name(g) for g in groups_a],
+                      [TlsSupportedGroups.name(g) for g in groups_b])
+
+    def _diff_values(self, key: str, a: Extension, b: Extension, prop: str):
+        values_a = [v for v in getattr(a, prop) if not _is_grease_value(v)]
+        values_b = [v for v in getattr(b, prop) if not _is_grease_value(v)]
+        if values_a != values_b:
+            if prop == 'groups':
+                values_a = [TlsSupportedGroups.name(g) for g in values_a]
+                values_b = [TlsSupportedGroups.name(g) for g in values_b]
+            self._add(key, a.name, values_a, values_b)
+
+    def _diff_quic_tps(self, key: str, a: ExtQuicTP, b: ExtQuicTP):
+        params_a = self._tp_values(a)
+        params_b = self._tp_values(b)
+        if params_a == params_b:
+            return
+        for ptype in sorted(set(params_a) | set(params_b)):
+            val_a = params_a.get(ptype)
+            val_b = params_b.get(ptype)
+            if val_a != val_b:
+                self._add(key, f'{a.name}.{QuicTransportParam.name(ptype)}',
+                          _tp_value(val_a), _tp_value(val_b))
+
+    def _tp_values(self, ext: ExtQuicTP) -> Dict[int, Any]:
+        # GREASE transport parameters are 31 * N + 27
+        return {ptype: pvalue for ptype, pvalue in ext.params
+                if ptype not in self.VOLATILE_TPS
+                and (ptype - 27) % 31 != 0}
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return [{
+            'record': record,
+            'field': field,
+            'a': a,
+            'b': b,
+        } for record, field, a, b in self._changes]
+
+    def to_text(self) -> str:
+        return '\n'.join([f'{record}.{field}: {a} -> {b}'
+                          for record, field, a, b in self._changes])
+
+
+def _is_grease_value(value) -> bool:
+    # ALPN protocols are strings, GREASE ones have two chars like '\x0a\x0a'
+    if isinstance(value, str):
+        return len(value) == 2 and _is_grease((ord(value[0]) << 8)
+                                              | ord(value[1]))
+    return _is_grease(value)
+
+
+def _tp_value(value) -> Any:
+    if isinstance(value, bytes):
+        return binascii.hexlify(value).decode()
+    return value
@@ -4,6 +4,7 @@ import subprocess
 from json import JSONEncoder
 
 from .env import Env
+from .logrotate import LogRotator, LogSegments
 
 
 log = logging.getLogger(__name__)
@@ -22,7 +23,7 @@ class Httpd:
         '/usr/lib/apache2/modules',  # debian
         '/usr/libexec/apache2/',     # macos
     ]
-    def __init__(self, env: Env):
+    def __init__(self, env: Env, log_max_size: int = 0):
         self.env = env
         self._cmd = env.apachectl
         self._apache_dir = os.path.join(env.gen_dir, 'apache')
@@ -46,6 +47,11 @@ class Httpd:
             raise Exception(f'apache modules dir cannot be found')
         self._process = None
         self._rmf(self._error_log)
+        LogSegments(self._error_log).clear()
+        self._rotator = None
+        if log_max_size > 0:
+            self._mkpath(self._logs_dir)
+            self._rotator = LogRotator(self._error_log, max_size=log_max_size)
 
     def exists(self):
         return os.path.exists(self._cmd)
@@ -65,10 +71,14 @@ class Httpd:
         r = self._apachectl('start')
         if r.returncode != 0:
             log.error(f'failed to start httpd: {r}')
+        elif self._rotator is not None:
+            self._rotator.start()
         return r.returncode == 0
 
     def stop(self):
         self._apachectl('stop')
+        if self._rotator is not None:
+            self._rotator.stop()
         return True
 
     def restart(self):
@@ -0,0 +1,212 @@
+import argparse
+import json
+import logging
+import statistics
+import sys
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from .client import ExampleClient, QuicClientRun
+from .env import Env
+from .load import percentile, running_target
+
+
+log = logging.getLogger(__name__)
+
+
+MODES = ['full', 'resumed', '0rtt']
+# HAProxy rejects early data unless its QUIC bind allows it
+QUIC_OPTS = 'alpn h3 allow-0rtt'
+
+
+def _stats(values: List[float]) -> Dict[str, Optional[float]]:
+    n = len(values)
+    return {
+        'mean': statistics.mean(values) if n > 0 else None,
+        'p50': percentile(values, 50),
+        'stdev': statistics.stdev(values) if n > 1 else None,
+        'variance': statistics.variance(values) if n > 1 else None,
+    }
+
+
+class ModeSamples:
+    """The latencies of one connection mode, in milliseconds.
+
+    `wall` is how long the client process ran, `handshake` and
+    `response` come from the client's qlog: from the first Initial
+    until the handshake was confirmed and until response data arrived.
+    Early data counts as sent for each resumed 0-RTT run and as
+    accepted when the server's EncryptedExtensions acknowledged it.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.wall = []
+        self.handshake = []
+        self.response = []
+        self.failures = Counter()
+        self.early_data_sent = 0
+        self.early_data_accepted = 0
+
+    def add(self, run: QuicClientRun, wall_ms: float):
+        self.wall.append(wall_ms)
+        qlog = run.qlog
+        if qlog is not None:
+            if qlog.handshake_time is not None:
+                self.handshake.append(qlog.handshake_time)
+            if qlog.response_time is not None:
+                self.response.append(qlog.response_time)
+
+    @property
+    def acceptance_rate(self) -> Optional[float]:
+        if self.early_data_sent == 0:
+            return None
+        return self.early_data_accepted / self.early_data_sent
+
+    def to_json(self) -> Dict[str, Any]:
+        j = {
+            'mode': self.mode,
+            'count': len(self.wall),
+            'wall': _stats(self.wall),
+            'handshake': _stats(self.handshake),
+            'response': _stats(self.response),
+            'failures': dict(self.failures),
+        }
+        if self.mode == '0rtt':
+            j['early_data_acceptance'] = self.acceptance_rate
+        return j
+
+
+class LatencyResult:
+    """Full, resumed and 0-RTT latencies of one crypto lib, with the
+       speedup of the mean latencies against full handshakes."""
+
+    def __init__(self, crypto_lib: str):
+        self.crypto_lib = crypto_lib
+        self.modes = {mode: ModeSamples(mode) for mode in MODES}
+
+    def speedup(self, mode: str, metric: str = 'wall') -> Optional[float]:
+        full = getattr(self.modes['full'], metric)
+        other = getattr(self.modes[mode], metric)
+        if len(full) == 0 or len(other) == 0:
+            return None
+        mean = statistics.mean(other)
+        return statistics.mean(full) / mean if mean > 0 else None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'crypto_lib': self.crypto_lib,
+            'modes': {mode: s.to_json() for mode, s in self.modes.items()},
+            'speedup': {mode: {
+                'wall': self.speedup(mode, 'wall'),
+                'handshake': self.speedup(mode, 'handshake'),
+                'response': self.speedup(mode, 'response'),
+            } for mode in MODES[1:]},
+        }
+
+    def to_text(self) -> str:
+        lines = [f'{self.crypto_lib}:']
+        for mode, samples in self.modes.items():
+            line = f'  {mode:8s} n={len(samples.wall):3d}'
+            for metric in ['wall', 'handshake', 'response']:
+                st = _stats(getattr(samples, metric))
+                if st['mean'] is None:
+                    continue
+                line += f'  {metric} {st["mean"]:7.1f} ms'
+                if st['stdev'] is not None:
+                    line += f' ±{st["stdev"]:.1f}'
+                if mode != 'full':
+                    speedup = self.speedup(mode, metric)
+                    if speedup is not None:
+                        line += f' ({speedup:.2f}x)'
+            lines.append(line)
+            if samples.acceptance_rate is not None:
+                lines.append(f'           early data accepted: '
+                             f'{samples.early_data_accepted}/'
+                             f'{samples.early_data_sent} '
+                             f'({samples.acceptance_rate * 100:.0f}%)')
+            for failure, count in samples.failures.most_common():
+                lines.append(f'           failed: {failure}: {count}')
+        return '\n'.join(lines)
+
+
+class LatencyBenchmark:
+    """Measures full, resumed and 0-RTT connections of one crypto lib.
+
+    Each round makes a full handshake with a cleared session, which
+    stores a new ticket, then resumes it without and with early data.
+    Rounds interleave the modes, so that drift on the host affects
+    them alike. Runs that do not get the handshake of their mode are
+    counted as failures and not in the latencies.
+    """
+
+    EARLY_DATA = 'This is the early data. It is not much.'
+
+    def __init__(self, env: Env, crypto_lib: str, rounds: int = 20,
+                 url: str = None):
+        self.env = env
+        self._client = ExampleClient(env=env, crypto_lib=crypto_lib)
+        self._rounds = rounds
+        self._url = url if url is not None \
+            else f'https://{env.example_domain}/data.json'
+
+    def _get(self, samples: ModeSamples, **kwargs) -> Optional[QuicClientRun]:
+        run = self._client.http_get(url=self._url, use_session=True, **kwargs)
+        if run.returncode != 0:
+            samples.failures[f'exit code {run.returncode}'] += 1
+            return None
+        resumed = run.resumed
+        if resumed != (samples.mode != 'full'):
+            samples.failures['resumed' if resumed else 'not resumed'] += 1
+            return None
+        samples.add(run, run.duration * 1000)
+        return run
+
+    def run(self) -> LatencyResult:
+        if not self._client.exists():
+            raise Exception(f'client not found: {self._client.path}')
+        result = LatencyResult(self._client.crypto_lib)
+        modes = result.modes
+        for _ in range(self._rounds):
+            self._client.clear_session()
+            if self._get(modes['full'],
+                         extra_args=['--disable-early-data']) is None:
+                continue
+            self._get(modes['resumed'], extra_args=['--disable-early-data'])
+            samples = modes['0rtt']
+            run = self._get(samples, data=self.EARLY_DATA)
+            if run is not None:
+                samples.early_data_sent += 1
+                if run.early_data_accepted:
+                    samples.early_data_accepted += 1
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='latency', description="""
+        latency of full, resumed and 0-RTT QUIC connections to HAProxy,
+        per crypto lib of the ngtcp2 example clients
+        """)
+    parser.add_argument('-n', '--rounds', type=int, default=20,
+                        help='connections per mode and crypto lib')
+    parser.add_argument('--crypto-lib', action='append', default=None,
+                        help='crypto lib to use, default: all available')
+    parser.add_argument('--json', action='store_true',
+                        help='write results as JSON lines')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    env = Env()
+    crypto_libs = args.crypto_lib if args.crypto_lib else env.crypto_libs()
+    with running_target(env, quic_opts=QUIC_OPTS):
+        for lib in crypto_libs:
+            result = LatencyBenchmark(env=env, crypto_lib=lib,
+                                      rounds=args.rounds).run()
+            if args.json:
+                print(json.dumps(result.to_json()))
+            else:
+                print(result.to_text())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
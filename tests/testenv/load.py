@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from .aio import AsyncExampleClient
+from .env import Env
+from .haproxy import HAProxy
+from .httpd import Httpd
+
+
+log = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """The `p` percentile (0-100) of `values`, by nearest rank."""
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+TRACE_MODES = ['off', 'ring', 'log']
+
+
+@contextmanager
+def running_target(env: Env, trace: str = 'off', quic_opts: str = None):
+    """Start httpd and HAProxy in front of it, like the test fixtures.
+
+    With `trace` 'off', HAProxy does not trace QUIC, so that tracing
+    does not add to what is measured. With 'ring', traces go into a
+    ring buffer and with 'log' into haproxy.log, as in the tests.
+    `quic_opts` replace the options of HAProxy's QUIC bind.
+    """
+    if trace not in TRACE_MODES:
+        raise Exception(f'unknown trace mode: {trace}')
+    env.setup()
+    httpd = Httpd(env=env)
+    if not httpd.exists() or not httpd.start():
+        raise Exception(f'unable to start httpd: {env.apachectl}')
+    try:
+        ha = HAProxy(env=env, trace=trace != 'off', quic_opts=quic_opts,
+                     trace_ring_size=1024 * 1024 if trace == 'ring' else 0)
+        if not ha.exists() or not ha.start():
+            raise Exception(f'unable to start haproxy: {env.haproxy}')
+        try:
+            yield ha
+        finally:
+            ha.stop()
+    finally:
+        httpd.stop()
+
+
+class LoadResult:
+    """The handshakes made against HAProxy with one crypto lib.
+
+    A handshake counts when the client exited successfully and received
+    the server's Finished. Latencies are wall-clock seconds per client process, from start to
+    exit, so they include process startup and the GET request. `trace`
+    is how HAProxy traced QUIC meanwhile, see `running_target`.
+    """
+
+    def __init__(self, crypto_lib: str, concurrency: int,
+                 trace: Optional[str] = None):
+        self.crypto_lib = crypto_lib
+        self.concurrency = concurrency
+        self.trace = trace
+        self.duration = 0.0
+        self.latencies = []
+        self.failures = Counter()
+
+    def add(self, latency: Optional[float], failure: Optional[str] = None):
+        if failure is None:
+            self.latencies.append(latency)
+        else:
+            self.failures[failure] += 1
+
+    @property
+    def handshakes(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def attempts(self) -> int:
+        return self.handshakes + sum(self.failures.values())
+
+    @property
+    def handshakes_per_sec(self) -> float:
+        return self.handshakes / self.duration if self.duration > 0 else 0.0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'crypto_lib': self.crypto_lib,
+            'concurrency': self.concurrency,
+            'trace': self.trace,
+            'duration': self.duration,
+            'attempts': self.attempts,
+            'handshakes': self.handshakes,
+            'handshakes_per_sec': self.handshakes_per_sec,
+            'p50': percentile(self.latencies, 50),
+            'p95': percentile(self.latencies, 95),
+            'p99': percentile(self.latencies, 99),
+            'failures': dict(self.failures),
+        }
+
+    def to_text(self) -> str:
+        j = self.to_json()
+        lines = [
+            f'{self.crypto_lib}: {j["handshakes"]}/{j["attempts"]} handshakes '
+            f'in {self.duration:.1f}s with {self.concurrency} clients, '
+            f'{j["handshakes_per_sec"]:.1f}/s'
+            + (f', haproxy trace {self.trace}' if self.trace else ''),
+        ]
+        if self.handshakes > 0:
+            lines.append('  latency p50 {:.1f} ms, p95 {:.1f} ms, '
+                         'p99 {:.1f} ms'.format(*[j[p] * 1000 for p in
+                                                  ['p50', 'p95', 'p99']]))
+        for failure, count in self.failures.most_common():
+            lines.append(f'  failed: {failure}: {count}')
+        return '\n'.join(lines)
+
+
+class LoadGenerator:
+    """Runs `concurrency` example clients of a crypto lib against HAProxy,
+       each starting a new connection as soon as its last one ended.
+
+    The load stops after `duration` seconds or when `count` handshakes
+    were attempted, whichever comes first. Each client reuses one
+    artifact directory, so only the last run of a client is kept.
+    """
+
+    def __init__(self, env: Env, crypto_lib: str, concurrency: int = 8,
+                 url: str = None, duration: Optional[float] = 10.0,
+                 count: Optional[int] = None, timeout: float = 10.0,
+                 extra_args: List[str] = None, trace: Optional[str] = None):
+        if duration is None and count is None:
+            raise Exception('load needs a duration or a count')
+        self.env = env
+        self._crypto_lib = crypto_lib
+        self._concurrency = concurrency
+        self._url = url if url is not None \
+            else f'https://{env.example_domain}/data.json'
+        self._duration = duration
+        self._count = count
+        self._timeout = timeout
+        self._extra_args = extra_args
+        self._trace = trace
+        self._started = 0
+
+    def _more(self, end: Optional[float]) -> bool:
+        if end is not None and time.monotonic() >= end:
+            return False
+        if self._count is not None and self._started >= self._count:
+            return False
+        self._started += 1
+        return True
+
+    async def _worker(self, client: AsyncExampleClient, run_dir: str,
+                      end: Optional[float], result: LoadResult):
+        while self._more(end):
+            start = time.monotonic()
+            latency, failure = None, None
+            try:
+                run = await client.http_get(url=self._url, run_dir=run_dir,
+                                            extra_args=self._extra_args,
+                                            timeout=self._timeout)
+                latency = time.monotonic() - start
+                if run.returncode != 0:
+                    failure = f'exit code {run.returncode}'
+                else:
+                    # scanning the log blocks, keep it off the loop
+                    finished = await asyncio.get_running_loop()\
+                        .run_in_executor(None, run.find_record, 'Finished')
+                    if finished is None:
+                        failure = 'no handshake'
+            except asyncio.TimeoutError:
+                failure = 'timeout'
+            except OSError as ex:
+                failure = f'{type(ex).__name__}: {ex.strerror}'
+            result.add(latency, failure)
+
+    async def run(self) -> LoadResult:
+        client = AsyncExampleClient(env=self.env, crypto_lib=self._crypto_lib)
+        if not client.exists():
+            raise Exception(f'client not found: {client.path}')
+        result = LoadResult(self._crypto_lib, self._concurrency,
+                            trace=self._trace)
+        self._started = 0
+        start = time.monotonic()
+        end = start + self._duration if self._duration is not None else None
+        await asyncio.gather(*[
+            self._worker(client, client.new_run_dir(), end, result)
+            for _ in range(self._concurrency)
+        ])
+        result.duration = time.monotonic() - start
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='load', description="""
+        QUIC handshakes per second against HAProxy, using the ngtcp2
+        example clients
+        """)
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help='clients running at the same time, per crypto lib')
+    parser.add_argument('-d', '--duration', type=float, default=None,
+                        help='seconds to run, default: 10 unless --count given')
+    parser.add_argument('-n', '--count', type=int, default=None,
+                        help='number of handshakes to attempt')
+    parser.add_argument('--crypto-lib', action='append', default=None,
+                        help='crypto lib to use, default: all available')
+    parser.add_argument('--timeout', type=float, default=10.0,
+                        help='seconds before a client is killed')
+    parser.add_argument('--trace', choices=TRACE_MODES, default='off',
+                        help='where HAProxy traces QUIC, default: off')
+    parser.add_argument('--json', action='store_true',
+                        help='write results as JSON lines')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    duration = args.duration
+    if duration is None and args.count is None:
+        duration = 10.0
+    env = Env()
+    crypto_libs = args.crypto_lib if args.crypto_lib else env.crypto_libs()
+    with running_target(env, trace=args.trace) as ha:
+        for lib in crypto_libs:
+            gen = LoadGenerator(env=env, crypto_lib=lib,
+                                concurrency=args.concurrency,
+                                duration=duration, count=args.count,
+                                timeout=args.timeout, trace=ha.trace_mode)
+            result = asyncio.run(gen.run())
+            if args.json:
+                print(json.dumps(result.to_json()))
+            else:
+                print(result.to_text())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,66 @@
-import binascii
+import ctypes
+import ctypes.util
 import logging
+import mmap
 import os
 import re
+import select
 import sys
 import time
 from datetime import timedelta, datetime
-from io import SEEK_END
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .logrotate import LogSegments
 
 
 log = logging.getLogger(__name__)
 
 
+def _decode_line(line: bytes) -> str:
+    # '\r\n' line ends become '\n', as when reading in text mode
+    if line.endswith(b'\r\n'):
+        line = line[:-2] + b'\n'
+    return line.decode(errors='replace')
+
+
+def iter_lines(data, pos: int = 0) -> Iterator[str]:
+    """The lines in `data` (bytes or a mmap) from `pos` on, decoded one
+       at a time."""
+    end = len(data)
+    while pos < end:
+        nl = data.find(b'\n', pos, end)
+        nxt = end if nl < 0 else nl + 1
+        yield _decode_line(data[pos:nxt])
+        pos = nxt
+
+
+def iter_chunk_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """The lines in a sequence of data chunks, decoded one at a time."""
+    partial = b''
+    for chunk in chunks:
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            yield _decode_line(line + b'\n')
+    if len(partial) > 0:
+        yield _decode_line(partial)
+
+
 class LogFile:
+    """Reads what has been added to a log file.
+
+    Positions are offsets into all data written to the file. When the
+    file is rotated by a `LogRotator`, they continue through the archived
+    segments and the data of these is read as if it were still in the
+    file.
+    """
 
     def __init__(self, path: str):
         self._path = path
         self._start_pos = 0
         self._last_pos = self._start_pos
+        self._fd = None
+        self._segments = LogSegments(path)
 
     @property
     def path(self) -> str:
@@ -29,44 +72,375 @@ class LogFile:
 
     def advance(self) -> None:
         if os.path.isfile(self._path):
-            with open(self._path) as fd:
-                self._start_pos = fd.seek(0, SEEK_END)
+            with self._segments.locked():
+                self._start_pos = self._segments.base \
+                    + os.path.getsize(self._path)
+
+    def _open(self):
+        # the file stays open between calls, unless it has been
+        # removed or replaced
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            self.close()
+            return None
+        if self._fd is not None \
+                and os.fstat(self._fd.fileno()).st_ino != st.st_ino:
+            self.close()
+        if self._fd is None:
+            self._fd = open(self._path, 'rb')
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def _end(self, fd):
+        # the position at the end of the file and where the file
+        # starts, after any rotated segments
+        with self._segments.locked():
+            base = self._segments.base
+            return base, base + os.fstat(fd.fileno()).st_size
+
+    def _recent_range(self, advance: bool):
+        fd = self._open()
+        if fd is None:
+            return None, 0, 0, 0
+        start = self._last_pos
+        base, end = self._end(fd)
+        if end < start:
+            # truncated, start again from the beginning
+            start = 0
+        if advance:
+            self._last_pos = end
+        return fd, base, start, end
+
+    def _iter_chunks(self, fd, base: int, start: int, end: int):
+        # the data from `start` to `end` as (position after, chunk), from
+        # rotated segments and the file, ending with (position, b'') at
+        # the position reached. Each chunk is read from the file under
+        # the segments lock. When the file was rotated since the last
+        # one, reading continues in the new segment. It stops early when
+        # the file was truncated without rotation, that data is gone.
+        pos = start
+        while pos < end:
+            if pos < base:
+                for chunk in self._segments.iter_data(pos, min(base, end)):
+                    pos += len(chunk)
+                    yield pos, chunk
+                # data of removed segments is skipped
+                pos = min(base, end)
+                continue
+            with self._segments.locked():
+                cur_base = self._segments.base
+                if cur_base == base:
+                    fd.seek(pos - base, os.SEEK_SET)
+                    chunk = fd.read(min(64 * 1024, end - pos))
+            if cur_base != base:
+                base = cur_base
+                continue
+            if len(chunk) == 0:
+                break
+            pos += len(chunk)
+            yield pos, chunk
+        yield pos, b''
+
+    def _iter_data(self, fd, base: int, start: int, end: int):
+        # the data from `start` to `end` in chunks
+        for _, chunk in self._iter_chunks(fd, base, start, end):
+            if len(chunk) > 0:
+                yield chunk
+
+    def iter_recent(self, advance=True) -> Iterator[str]:
+        """The lines added since the last call, produced lazily from a
+           memory map of the file. The range is clamped to the file's
+           size when mapping starts, and read in chunks if it cannot be
+           mapped, but a file truncated while the lines are iterated
+           makes the process fault (SIGBUS). Files that are rotated, and
+           may be truncated at any time, are always read in chunks.
+           '\r\n' line ends are returned as '\n'."""
+        fd, base, start, end = self._recent_range(advance=advance)
+        return self._iter_lines(fd, base, start, end)
+
+    def recent_range(self, advance=True) -> Tuple[int, int]:
+        """The (start, end) offsets of the data added since the last
+           call, for reading it later with `iter_range`."""
+        _, _, start, end = self._recent_range(advance=advance)
+        return start, end
+
+    def iter_range(self, start: int, end: int) -> Iterator[str]:
+        """The lines from offset `start` to `end`, produced lazily like
+           in `iter_recent`."""
+        fd = self._open()
+        if fd is None:
+            return iter([])
+        base, _ = self._end(fd)
+        return self._iter_lines(fd, base, start, end)
+
+    def _iter_lines(self, fd, base: int, start: int,
+                    end: int) -> Iterator[str]:
+        if fd is not None and self._segments.rotating:
+            return iter_chunk_lines(self._iter_data(fd, base, start, end))
+        return self._iter_mapped(fd, base, start, end)
+
+    def _iter_mapped(self, fd, base: int, start: int,
+                     end: int) -> Iterator[str]:
+        if fd is None:
+            return
+        # the file may have been truncated since `end` was determined
+        end = min(end, os.fstat(fd.fileno()).st_size)
+        if end <= start:
+            return
+        # map offsets need to be aligned to the allocation granularity
+        offset = start - (start % mmap.ALLOCATIONGRANULARITY)
+        try:
+            mm = mmap.mmap(fd.fileno(), end - offset, access=mmap.ACCESS_READ,
+                           offset=offset)
+        except (ValueError, OSError) as ex:
+            log.debug(f'unable to map {self._path}, reading it: {ex}')
+            yield from iter_chunk_lines(self._iter_data(fd, base, start, end))
+            return
+        with mm:
+            yield from iter_lines(mm, start - offset)
+
+    def read_recent(self, advance=True) -> bytes:
+        """The data added since the last call. The position only moves
+           as far as the data could be read."""
+        fd, base, start, end = self._recent_range(advance=False)
+        if fd is None or end <= start:
+            return b''
+        chunks = []
+        pos = start
+        for pos, chunk in self._iter_chunks(fd, base, start, end):
+            chunks.append(chunk)
+        if advance:
+            self._last_pos = pos
+        return b''.join(chunks)
 
     def get_recent(self, advance=True) -> List[str]:
-        lines = []
-        if os.path.isfile(self._path):
-            with open(self._path) as fd:
-                fd.seek(self._last_pos, os.SEEK_SET)
-                for line in fd:
-                    lines.append(line)
-                if advance:
-                    self._last_pos = fd.tell()
-        return lines
+        return list(self.iter_recent(advance=advance))
 
     def scan_recent(self, pattern: re, timeout=10) -> bool:
         if not os.path.isfile(self.path):
             return False
-        with open(self.path) as fd:
-            end = datetime.now() + timedelta(seconds=timeout)
-            while True:
-                fd.seek(self._last_pos, os.SEEK_SET)
-                for line in fd:
-                    if pattern.match(line):
-                        return True
-                if datetime.now() > end:
-                    raise TimeoutError(f"pattern not found in error log after {timeout} seconds")
-                time.sleep(.1)
-        return False
+        self._scan(lambda line, pos: pattern.match(line), timeout=timeout)
+        return True
+
+    def scan_any(self, patterns, timeout=10) -> Optional['LogMatch']:
+        """Wait for a line matching any of the `patterns`, given as list
+           or as dict by name. Returns the first match found, or None if
+           the file does not exist."""
+        if not os.path.isfile(self.path):
+            return None
+        matcher = MultiMatcher(patterns)
+        return self._scan(matcher.match, timeout=timeout)
+
+    def _scan(self, match, timeout):
+        # calls `match(line, pos)` on lines as they are appended to the
+        # file, until it returns something
+        watch = FileWatch(self.path)
+        try:
+            with open(self.path, 'rb') as fd:
+                end = datetime.now() + timedelta(seconds=timeout)
+                pos = self._last_pos
+                partial = b''
+                while True:
+                    # only look at what has been appended since last time
+                    base, fend = self._end(fd)
+                    if fend < pos:
+                        pos = 0
+                        partial = b''
+                    line_pos = pos - len(partial)
+                    chunks = []
+                    for pos, chunk in self._iter_chunks(fd, base, pos, fend):
+                        chunks.append(chunk)
+                    data = b''.join(chunks)
+                    lines = (partial + data).split(b'\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        m = match(line.decode(errors='replace') + '\n',
+                                  line_pos)
+                        if m:
+                            return m
+                        line_pos += len(line) + 1
+                    remain = (end - datetime.now()).total_seconds()
+                    if remain < 0:
+                        raise TimeoutError(f"pattern not found in error log after {timeout} seconds")
+                    watch.wait(min(remain, 1))
+        finally:
+            watch.close()
+
+
+class LogMatch:
+    """A line matched by one of several patterns."""
+
+    def __init__(self, name, match, line: str, pos: int):
+        self.name = name
+        self.match = match
+        self.line = line
+        self.pos = pos
+
+    def __repr__(self):
+        return f'LogMatch[{self.name}, pos={self.pos}, line={self.line!r}]'
+
+
+class MultiMatcher:
+    """Matches lines against several patterns at once.
+
+    The patterns are combined into one alternation of named groups,
+    the group that matched tells which pattern fired. Patterns that
+    cannot be combined, e.g. because of numbered back references, are
+    tried one after the other.
+    """
+
+    def __init__(self, patterns):
+        if isinstance(patterns, dict):
+            self._patterns = [(name, re.compile(p))
+                              for name, p in patterns.items()]
+        else:
+            self._patterns = [(idx, re.compile(p))
+                              for idx, p in enumerate(patterns)]
+        self._combined = None
+        self._single = self._patterns
+        flags = set([p.flags for _, p in self._patterns])
+        backrefs = any([re.search(r'\\[1-9]', p.pattern)
+                        for _, p in self._patterns])
+        if len(flags) == 1 and len(self._patterns) > 1 and not backrefs:
+            try:
+                self._combined = re.compile('|'.join([
+                    f'(?P<_p{idx}>{p.pattern})'
+                    for idx, (_, p) in enumerate(self._patterns)
+                ]), flags.pop())
+                self._single = []
+            except re.error:
+                self._combined = None
+
+    def match(self, line: str, pos: int = 0) -> Optional[LogMatch]:
+        if self._combined is not None:
+            m = self._combined.match(line)
+            if m:
+                name, pattern = self._patterns[int(m.lastgroup[2:])]
+                return LogMatch(name=name, match=pattern.match(line),
+                                line=line, pos=pos)
+            return None
+        for name, pattern in self._single:
+            m = pattern.match(line)
+            if m:
+                return LogMatch(name=name, match=m, line=line, pos=pos)
+        return None
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatch:
+    """Waits for a file to be written to.
+
+    Uses inotify on Linux, elsewhere or when inotify is not available,
+    it falls back to polling every 100ms.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOEXEC = 0x00080000
+    IN_NONBLOCK = 0x00000800
+    LIBC = _load_libc()
+
+    def __init__(self, path: str):
+        self._fd = -1
+        if self.LIBC is not None:
+            fd = self.LIBC.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd >= 0:
+                if self.LIBC.inotify_add_watch(fd, os.fsencode(path),
+                                               self.IN_MODIFY) < 0:
+                    os.close(fd)
+                else:
+                    self._fd = fd
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd >= 0
+
+    def wait(self, timeout: float):
+        """Wait at most `timeout` seconds for the file to be modified."""
+        if self._fd < 0:
+            time.sleep(min(timeout, .1))
+            return
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            # drain the events, we only care that there were some
+            try:
+                while len(os.read(self._fd, 4096)) > 0:
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
 
 
 class HexDumpScanner:
+    """Produces the data of the hexdumps in a sequence of lines.
+
+    The dump layouts of ngtcp2 clients (`hexdump -C` style) and of
+    `openssl s_client -debug` are recognized by their fixed columns.
+    Lines in other layouts are matched by a more general regex.
+    """
+
+    RE_HEX_LINE = re.compile(r'^\s*([0-9a-f]+)(\s+-)?(([\s-]+[0-9a-f]{2}){1,16})'
+                             r'(\s+.*)$', re.IGNORECASE)
+    RE_HEX_SEP = re.compile(r'[\s-]+')
+    HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
 
     def __init__(self, source, leading_regex=None):
         self._source = source
         self._leading_regex = leading_regex
 
+    @staticmethod
+    def _fixed_layout(l: str):
+        # `00000010  0a 0b ... 0f  0a 0b ... 0f  |ascii|`, ngtcp2
+        if l[8:10] == '  ' and l[10:11] != ' ':
+            end = l.find('  |', 10)
+            if end > 0:
+                return l[0:8], l[10:end]
+        # `0010 - 0a 0b ... 0f-0a 0b ... 0f   ascii`, openssl -debug
+        elif l[4:7] == ' - ' and l[55:56] in (' ', '\n', ''):
+            return l[0:4], l[7:55].replace('-', ' ')
+        return None
+
+    def _parse_line(self, l: str):
+        """The (offset, data) of a hexdump line or None."""
+        cols = self._fixed_layout(l)
+        if cols is not None:
+            try:
+                data = bytes.fromhex(cols[1])
+                if 0 < len(data) <= 16:
+                    return int(cols[0], 16), data
+            except ValueError:
+                pass
+        first = l.lstrip()[0:1]
+        if first == '' or first not in self.HEX_DIGITS:
+            return None
+        m = self.RE_HEX_LINE.match(l)
+        if m:
+            return int(m.group(1), 16), \
+                bytes.fromhex(self.RE_HEX_SEP.sub('', m.group(3)))
+        return None
+
     def __iter__(self):
-        data = b''
+        data = []
         offset = 0 if self._leading_regex is None else -1
         idx = 0
         for l in self._source:
@@ -74,22 +448,19 @@ class HexDumpScanner:
                 pass
             elif offset == 0:
                 # possible start of a hex dump
-                m = re.match(r'^\s*0+(\s+-)?(([\s-]+[0-9a-f]{2}){1,16})(\s+.*)$',
-                             l, re.IGNORECASE)
-                if m:
-                    data = binascii.unhexlify(re.sub(r'[\s-]+', '', m.group(2)))
+                hline = self._parse_line(l)
+                if hline is not None and hline[0] == 0:
+                    data = [hline[1]]
                     offset = 16
                     idx = 1
                     continue
             else:
                 # possible continuation of a hexdump
-                m = re.match(r'^\s*([0-9a-f]+)(\s+-)?(([\s-]+[0-9a-f]{2}){1,16})'
-                             r'(\s+.*)$', l, re.IGNORECASE)
-                if m:
-                    loffset = int(m.group(1), 16)
+                hline = self._parse_line(l)
+                if hline is not None:
+                    loffset = hline[0]
                     if loffset == offset or loffset == idx:
-                        data += binascii.unhexlify(re.sub(r'[\s-]+', '',
-                                                          m.group(3)))
+                        data.append(hline[1])
                         offset += 16
                         idx += 1
                         continue
@@ -97,9 +468,9 @@ class HexDumpScanner:
                         log.warning(f'wrong offset {loffset}, expected {offset} or {idx}\n')
             # not a hexdump line, produce any collected data
             if len(data) > 0:
-                yield data
-                data = b''
+                yield b''.join(data)
+                data = []
             offset = 0 if self._leading_regex is None \
                 or self._leading_regex.match(l) else -1
         if len(data) > 0:
-            yield data
+            yield b''.join(data)
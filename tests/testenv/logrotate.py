@@ -0,0 +1,231 @@
+import fcntl
+import gzip
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+log = logging.getLogger(__name__)
+
+
+def _open_segment(path: str):
+    if not os.path.exists(path) and os.path.exists(f'{path}.tmp'):
+        # not compressed yet
+        return open(f'{path}.tmp', 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise Exception(f'zstandard module needed to read {path}')
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                          closefd=True)
+    return gzip.open(path, 'rb')
+
+
+class LogSegments:
+    """The compressed segments archived from a log file.
+
+    A log file and its segments form one stream of data. Offsets into it
+    are counted from the start of the first segment, the current file
+    starts at `base`. The segments are listed in `<path>.segments` with
+    their name, offset and size. Segments removed to save space stay
+    listed, their data is skipped when reading.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._index_path = f'{path}.segments'
+
+    @property
+    def index_path(self) -> str:
+        return self._index_path
+
+    @property
+    def rotating(self) -> bool:
+        """If the log file is rotated, it may be truncated at any time."""
+        return os.path.exists(self._index_path)
+
+    @contextmanager
+    def locked(self, exclusive: bool = False):
+        """Hold the index lock, so that the current file and the segments
+           do not change. The rotator holds it exclusively."""
+        if not exclusive and not self.rotating:
+            yield
+            return
+        with open(self._index_path, 'a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def entries(self) -> List[Tuple[str, int, int]]:
+        """The (path, offset, size) of all segments, oldest first."""
+        entries = []
+        if os.path.isfile(self._index_path):
+            dirname = os.path.dirname(self._path)
+            with open(self._index_path) as fd:
+                for line in fd:
+                    name, offset, size = line.split()
+                    entries.append((os.path.join(dirname, name),
+                                    int(offset), int(size)))
+        return entries
+
+    @property
+    def base(self) -> int:
+        entries = self.entries()
+        if len(entries) == 0:
+            return 0
+        _, offset, size = entries[-1]
+        return offset + size
+
+    def append(self, seg_path: str, size: int):
+        base = self.base
+        with open(self._index_path, 'a') as fd:
+            fd.write(f'{os.path.basename(seg_path)} {base} {size}\n')
+
+    def iter_data(self, start: int, end: int) -> Iterator[bytes]:
+        """The archived data from offset `start` to `end`."""
+        for seg_path, offset, size in self.entries():
+            if offset + size <= start or offset >= end:
+                continue
+            if not os.path.isfile(seg_path) \
+                    and not os.path.isfile(f'{seg_path}.tmp'):
+                log.debug(f'log segment {seg_path} is gone, skipping')
+                continue
+            with _open_segment(seg_path) as fd:
+                pos = offset
+                if start > pos:
+                    fd.read(start - pos)
+                    pos = start
+                while pos < min(end, offset + size):
+                    chunk = fd.read(min(64 * 1024, end - pos))
+                    if len(chunk) == 0:
+                        break
+                    pos += len(chunk)
+                    yield chunk
+
+    def clear(self):
+        for seg_path, offset, size in self.entries():
+            for path in [seg_path, f'{seg_path}.tmp']:
+                if os.path.exists(path):
+                    os.remove(path)
+        if os.path.exists(self._index_path):
+            os.remove(self._index_path)
+
+
+class LogRotator:
+    """Keeps a log file below `max_size` bytes.
+
+    When the file gets larger, its content is moved into a compressed
+    segment and the file is truncated, so the writing process can keep
+    its file open. The writer needs to append (O_APPEND), otherwise it
+    continues at its old offset. Data written between the last copy and
+    the truncation is lost; the copy catches up with the file right
+    before truncating, which keeps that window short, but cannot close
+    it without pausing the writer. Only the `keep` newest segments are
+    kept. Segments are compressed with zstd if the zstandard module is
+    available, gzip otherwise.
+
+    `LogFile` reads through the segments transparently.
+    """
+
+    def __init__(self, path: str, max_size: int, keep: int = 10,
+                 compression: Optional[str] = None):
+        self._path = path
+        self._max_size = max_size
+        self._keep = keep
+        if compression is None:
+            compression = 'zstd' if zstandard is not None else 'gzip'
+        if compression == 'zstd' and zstandard is None:
+            raise Exception('zstd compression needs the zstandard module')
+        self._compression = compression
+        self._segments = LogSegments(path)
+        # readers of the log file notice that it is rotated by the index
+        open(self._segments.index_path, 'a').close()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def rotate_if_needed(self) -> bool:
+        try:
+            if os.path.getsize(self._path) <= self._max_size:
+                return False
+        except FileNotFoundError:
+            return False
+        self.rotate()
+        return True
+
+    def rotate(self):
+        with self._lock:
+            entries = self._segments.entries()
+            seq = len(entries) + 1
+            ext = 'zst' if self._compression == 'zstd' else 'gz'
+            seg_path = f'{self._path}.{seq:06d}.{ext}'
+            tmp_path = f'{seg_path}.tmp'
+            # copy and truncate right away, compress the copy afterwards.
+            # Readers use the copy until then.
+            with self._segments.locked(exclusive=True):
+                shutil.copyfile(self._path, tmp_path)
+                self._catch_up(tmp_path)
+                os.truncate(self._path, 0)
+                size = os.path.getsize(tmp_path)
+                self._segments.append(seg_path, size)
+            part_path = f'{seg_path}.part'
+            with open(tmp_path, 'rb') as src:
+                if self._compression == 'zstd':
+                    with open(part_path, 'wb') as fd:
+                        zstandard.ZstdCompressor().copy_stream(src, fd)
+                else:
+                    with gzip.open(part_path, 'wb') as fd:
+                        shutil.copyfileobj(src, fd)
+            os.replace(part_path, seg_path)
+            os.remove(tmp_path)
+            for old_path, _, _ in entries[:max(0, len(entries) + 1 - self._keep)]:
+                for path in [old_path, f'{old_path}.tmp']:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def _catch_up(self, tmp_path: str):
+        # append what was written to the file while it was copied
+        with open(self._path, 'rb') as src, open(tmp_path, 'ab') as dst:
+            src.seek(dst.tell())
+            shutil.copyfileobj(src, dst)
+
+    def clear(self):
+        """Remove all segments, e.g. when the log file is started anew."""
+        with self._lock:
+            self._segments.clear()
+            open(self._segments.index_path, 'a').close()
+
+    def start(self, interval: float = 1.0):
+        """Check the file size every `interval` seconds in a thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.rotate_if_needed()
+            except Exception as ex:
+                log.error(f'rotating {self._path}: {ex}')
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
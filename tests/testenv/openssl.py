@@ -4,7 +4,7 @@ import re
 import subprocess
 import time
 from datetime import datetime
-from typing import List
+from typing import Iterator, List, Tuple
 from urllib.parse import urlparse
 
 from . import ExecResult, HSRecord, HandShake
@@ -127,27 +127,27 @@ class OpensslClient:
         }
         return r
 
-    def _handshake(self, output) -> List[HSRecord]:
-        write_line = re.compile(r'write to ')
-        scanner = HexDumpScanner(source=output, leading_regex=write_line)
-        out_recs = [data for data in scanner]
-        hs_sent = [hrec for hrec in HandShake(source=out_recs,
-                                              skip_rec_header=True,
-                                              verbose=self.env.verbose)]
+    def _scan_handshake(self, output, leading_regex) -> Iterator[HSRecord]:
+        # handshake records in the hexdumps following `leading_regex` lines
+        scanner = HexDumpScanner(source=output, leading_regex=leading_regex)
+        return iter(HandShake(source=scanner, skip_rec_header=True,
+                              verbose=self.env.verbose))
+
+    def _handshake(self, output) -> Tuple[List[HSRecord], List[HSRecord]]:
+        """The handshake records (sent, received) in the debug output."""
+        if isinstance(output, str):
+            output = output.splitlines(keepends=True)
+        hs_sent = [hrec for hrec in self._scan_handshake(
+            output, re.compile(r'write to '))]
         if self.env.verbose > 1:
             log.debug(f'detected {len(hs_sent)} crypto recs sent')
             for idx, r in enumerate(hs_sent):
                 log.debug(f'rec {idx}: {r.name}')
 
-        write_line = re.compile(r'read from ')
-        scanner = HexDumpScanner(source=output, leading_regex=write_line)
-        in_recs = [data for data in scanner]
-        hs_recvd = [hrec for hrec in HandShake(source=in_recs,
-                                               skip_rec_header=True,
-                                               verbose=self.env.verbose)]
+        hs_recvd = [hrec for hrec in self._scan_handshake(
+            output, re.compile(r'read from '))]
         if self.env.verbose > 1:
             log.debug(f'detected {len(hs_recvd)} crypto recs received')
             for idx, r in enumerate(hs_recvd):
                 log.debug(f'rec {idx}: {r.name}')
         return hs_sent, hs_recvd
-
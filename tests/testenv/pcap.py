@@ -0,0 +1,380 @@
+import logging
+import socket
+import struct
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .tls import DataCursor, HandShake, HSRecord, ParseError
+
+
+log = logging.getLogger(__name__)
+
+
+class PcapPacket:
+    __slots__ = ('ts', 'linktype', 'data')
+
+    def __init__(self, ts: float, linktype: int, data: bytes):
+        self.ts = ts
+        self.linktype = linktype
+        self.data = data
+
+
+class PcapReader:
+    """Reads the packets of a pcap or pcapng file.
+
+    Only the packet records are looked at, the formats are detected
+    from the magic number at the start of the file.
+    """
+
+    PCAPNG_MAGIC = 0x0a0d0d0a
+
+    def __init__(self, path: str):
+        self._path = path
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def __iter__(self) -> Iterator[PcapPacket]:
+        with open(self._path, 'rb') as fd:
+            head = fd.read(4)
+            if len(head) < 4:
+                return
+            if struct.unpack('<I', head)[0] == self.PCAPNG_MAGIC:
+                yield from self._read_pcapng(fd, head)
+            else:
+                yield from self._read_pcap(fd, head)
+
+    def _read_pcap(self, fd: BinaryIO, magic: bytes) -> Iterator[PcapPacket]:
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
+        else:
+            raise ParseError(f'{self._path}: not a pcap file, magic={magic}')
+        ts_scale = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') \
+            else 1e-6
+        hdr = fd.read(20)
+        if len(hdr) < 20:
+            raise ParseError(f'{self._path}: truncated pcap header')
+        linktype = struct.unpack(f'{endian}I', hdr[16:20])[0] & 0xffff
+        rec_hdr = struct.Struct(f'{endian}IIII')
+        while True:
+            hdr = fd.read(rec_hdr.size)
+            if len(hdr) < rec_hdr.size:
+                return
+            ts_sec, ts_frac, caplen, origlen = rec_hdr.unpack(hdr)
+            data = fd.read(caplen)
+            if len(data) < caplen:
+                return
+            yield PcapPacket(ts=ts_sec + ts_frac * ts_scale,
+                             linktype=linktype, data=data)
+
+    def _read_pcapng(self, fd: BinaryIO, head: bytes) -> Iterator[PcapPacket]:
+        endian = '<'
+        interfaces = []  # (linktype, ts_scale)
+        while True:
+            if head is None:
+                head = fd.read(4)
+            if len(head) < 4:
+                return
+            btype = struct.unpack(f'{endian}I', head)[0]
+            if btype == self.PCAPNG_MAGIC:
+                # section header, defines the byte order of all that follows
+                lraw = fd.read(4)
+                bom = fd.read(4)
+                if len(bom) < 4:
+                    return
+                endian = '<' if bom == b'\x4d\x3c\x2b\x1a' else '>'
+                blen = struct.unpack(f'{endian}I', lraw)[0]
+                body = fd.read(blen - 12)
+                interfaces = []
+            else:
+                blen = struct.unpack(f'{endian}I', fd.read(4))[0]
+                body = fd.read(blen - 8)
+            head = None
+            if len(body) < blen - (12 if btype == self.PCAPNG_MAGIC else 8):
+                return
+            if btype == 1:  # interface description
+                linktype = struct.unpack_from(f'{endian}H', body, 0)[0]
+                interfaces.append((linktype, self._if_tsscale(
+                    body[8:len(body) - 4], endian)))
+            elif btype == 6:  # enhanced packet
+                ifid, ts_hi, ts_lo, caplen, origlen = \
+                    struct.unpack_from(f'{endian}IIIII', body, 0)
+                linktype, ts_scale = self._interface(interfaces, ifid)
+                yield PcapPacket(ts=((ts_hi << 32) | ts_lo) * ts_scale,
+                                 linktype=linktype,
+                                 data=body[20:20 + caplen])
+            elif btype == 3:  # simple packet
+                origlen = struct.unpack_from(f'{endian}I', body, 0)[0]
+                linktype, ts_scale = self._interface(interfaces, 0)
+                yield PcapPacket(ts=0.0, linktype=linktype,
+                                 data=body[4:4 + min(origlen, len(body) - 8)])
+            elif btype == 2:  # obsolete packet block
+                ifid, drops, ts_hi, ts_lo, caplen, origlen = \
+                    struct.unpack_from(f'{endian}HHIIII', body, 0)
+                linktype, ts_scale = self._interface(interfaces, ifid)
+                yield PcapPacket(ts=((ts_hi << 32) | ts_lo) * ts_scale,
+                                 linktype=linktype,
+                                 data=body[20:20 + caplen])
+
+    def _interface(self, interfaces: List[Tuple[int, float]],
+                   ifid: int) -> Tuple[int, float]:
+        if ifid >= len(interfaces):
+            raise ParseError(f'{self._path}: packet of undescribed '
+                             f'interface {ifid}')
+        return interfaces[ifid]
+
+    @staticmethod
+    def _if_tsscale(options: bytes, endian: str) -> float:
+        # the if_tsresol option of an interface, microseconds by default
+        pos = 0
+        while pos + 4 <= len(options):
+            code, olen = struct.unpack_from(f'{endian}HH', options, pos)
+            if code == 0:
+                break
+            if code == 9 and olen >= 1:
+                res = options[pos + 4]
+                if res & 0x80:
+                    return 2.0 ** -(res & 0x7f)
+                return 10.0 ** -res
+            pos += 4 + ((olen + 3) & ~3)
+        return 1e-6
+
+
+class PcapWriter:
+    """Writes IP packets to a pcap file, e.g. for synthetic captures."""
+
+    LINKTYPE_RAW = 101
+
+    def __init__(self, path: str):
+        self._fd = open(path, 'wb')
+        self._fd.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0,
+                                   65535, self.LINKTYPE_RAW))
+
+    def close(self):
+        self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data: bytes, ts: float = 0.0):
+        self._fd.write(struct.pack('<IIII', int(ts), int((ts % 1) * 1e6),
+                                   len(data), len(data)))
+        self._fd.write(data)
+
+    @staticmethod
+    def _ipv4(proto: int, src: str, dst: str, payload: bytes) -> bytes:
+        return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 0,
+                           0x4000, 64, proto, 0, socket.inet_aton(src),
+                           socket.inet_aton(dst)) + payload
+
+    def write_tcp(self, src: Tuple[str, int], dst: Tuple[str, int],
+                  seq: int, payload: bytes = b'', flags: int = 0x18,
+                  ack: int = 0, ts: float = 0.0):
+        tcp = struct.pack('!HHIIBBHHH', src[1], dst[1], seq & 0xffffffff,
+                          ack & 0xffffffff, 5 << 4, flags, 65535, 0, 0)
+        self.write(self._ipv4(6, src[0], dst[0], tcp + payload), ts=ts)
+
+    def write_udp(self, src: Tuple[str, int], dst: Tuple[str, int],
+                  payload: bytes, ts: float = 0.0):
+        udp = struct.pack('!HHHH', src[1], dst[1], 8 + len(payload), 0)
+        self.write(self._ipv4(17, src[0], dst[0], udp + payload), ts=ts)
+
+
+class IPPacket:
+    __slots__ = ('ts', 'proto', 'src', 'dst', 'payload')
+
+    def __init__(self, ts: float, proto: int, src: str, dst: str,
+                 payload: memoryview):
+        self.ts = ts
+        self.proto = proto
+        self.src = src
+        self.dst = dst
+        self.payload = payload
+
+
+def _ip_offset(linktype: int, data: bytes) -> Optional[int]:
+    # offset of the IP header in a packet of the link type, None if the
+    # packet does not carry IP
+    if linktype == 1:  # ethernet
+        offset, etype = 14, struct.unpack_from('!H', data, 12)[0]
+        while etype in (0x8100, 0x88a8):  # VLAN tags
+            etype = struct.unpack_from('!H', data, offset + 2)[0]
+            offset += 4
+        return offset if etype in (0x0800, 0x86dd) else None
+    if linktype == 0:  # BSD loopback, family in the host's byte order
+        family = data[0] if data[0] != 0 else data[3]
+        return 4 if family in (2, 24, 28, 30) else None
+    if linktype == 113:  # linux cooked
+        etype = struct.unpack_from('!H', data, 14)[0]
+        return 16 if etype in (0x0800, 0x86dd) else None
+    if linktype == 276:  # linux cooked v2
+        etype = struct.unpack_from('!H', data, 0)[0]
+        return 20 if etype in (0x0800, 0x86dd) else None
+    if linktype in (12, 14, 101, 228, 229):  # raw IP
+        return 0
+    return None
+
+
+def ip_packets(source: Iterable[PcapPacket],
+               protos=(6, 17)) -> Iterator[IPPacket]:
+    """The TCP and UDP (by default) packets in `source`."""
+    for pkt in source:
+        data = pkt.data
+        try:
+            offset = _ip_offset(pkt.linktype, data)
+            if offset is None:
+                continue
+            version = data[offset] >> 4
+            if version == 4:
+                hlen = (data[offset] & 0x0f) * 4
+                tlen, frag, proto = struct.unpack_from('!H2xHxB', data,
+                                                       offset + 2)
+                if frag & 0x1fff:
+                    continue  # not the first fragment
+                src = socket.inet_ntop(socket.AF_INET,
+                                       data[offset + 12:offset + 16])
+                dst = socket.inet_ntop(socket.AF_INET,
+                                       data[offset + 16:offset + 20])
+                end = offset + tlen if tlen else len(data)
+                offset += hlen
+            elif version == 6:
+                plen = struct.unpack_from('!H', data, offset + 4)[0]
+                proto = data[offset + 6]
+                src = socket.inet_ntop(socket.AF_INET6,
+                                       data[offset + 8:offset + 24])
+                dst = socket.inet_ntop(socket.AF_INET6,
+                                       data[offset + 24:offset + 40])
+                offset += 40
+                end = offset + plen if plen else len(data)
+                while proto in (0, 43, 60):  # skip extension headers
+                    proto = data[offset]
+                    offset += (data[offset + 1] + 1) * 8
+            else:
+                continue
+        except (IndexError, struct.error):
+            continue
+        if proto in protos:
+            yield IPPacket(ts=pkt.ts, proto=proto, src=src, dst=dst,
+                           payload=memoryview(data)[offset:end])
+
+
+class TcpFlow:
+    """The data sent in one direction of a TCP connection.
+
+    Segments are placed by their sequence number, relative to the SYN
+    or the first segment seen. Retransmissions and segments that arrive
+    out of order are handled, data behind a gap is kept until the gap
+    is filled.
+    """
+
+    def __init__(self, src: Tuple[str, int], dst: Tuple[str, int]):
+        self.src = src
+        self.dst = dst
+        self.data = bytearray()
+        self._isn = None
+        self._pending = {}
+        self.fin = False
+
+    def add(self, seq: int, flags: int, payload: memoryview):
+        if self._isn is None:
+            # without the SYN, the first segment starts the stream
+            self._isn = seq if flags & 0x02 else (seq - 1) & 0xffffffff
+        if flags & 0x02:
+            return
+        if flags & 0x01:
+            self.fin = True
+        if len(payload) == 0:
+            return
+        offset = (seq - self._isn - 1) & 0xffffffff
+        if offset > len(self.data):
+            self._pending[offset] = bytes(payload)
+            return
+        self._append(offset, payload)
+        while len(self._pending):
+            ready = [o for o in self._pending if o <= len(self.data)]
+            if len(ready) == 0:
+                break
+            for o in ready:
+                self._append(o, self._pending.pop(o))
+
+    def _append(self, offset: int, payload):
+        skip = len(self.data) - offset
+        if skip < len(payload):
+            self.data += payload[skip:]
+
+    @property
+    def has_gaps(self) -> bool:
+        return len(self._pending) > 0
+
+    def tls_records(self) -> Iterator[Tuple[int, memoryview]]:
+        """The (content type, payload) of the complete TLS records."""
+        d = DataCursor(bytes(self.data))
+        while len(d) >= 5:
+            ctype = d.get_int(1)
+            d.skip(2)  # protocol version
+            rlen = d.get_int(2)
+            if rlen > len(d):
+                break
+            yield ctype, d.get_field(rlen)
+
+    def handshake(self, verbose: int = 0) -> Iterator[HSRecord]:
+        """The handshake records sent in plain text in this flow."""
+        return iter(HandShake(source=(payload for ctype, payload
+                                      in self.tls_records() if ctype == 22),
+                              verbose=verbose))
+
+
+class TcpConnection:
+
+    def __init__(self, client: TcpFlow, server: TcpFlow):
+        self.client = client
+        self.server = server
+
+    def __repr__(self):
+        return f'TcpConnection[{self.client.src[0]}:{self.client.src[1]} -> '\
+               f'{self.server.src[0]}:{self.server.src[1]}]'
+
+    def handshake(self, verbose: int = 0) -> Tuple[List[HSRecord],
+                                                  List[HSRecord]]:
+        """The handshake records (sent, received) by the client, as
+           `OpensslClient` reports them."""
+        return list(self.client.handshake(verbose=verbose)), \
+            list(self.server.handshake(verbose=verbose))
+
+
+def tcp_connections(source: Union[str, Iterable[PcapPacket]],
+                    port: int = None) -> List[TcpConnection]:
+    """Reassemble the TCP connections in a capture file or packets.
+
+    With `port` given, only connections to or from that port are
+    looked at. The client of a connection is the one sending the SYN,
+    or the first packet seen.
+    """
+    if isinstance(source, str):
+        source = PcapReader(source)
+    flows = {}
+    conns = []
+    for pkt in ip_packets(source, protos=(6,)):
+        p = pkt.payload
+        if len(p) < 20:
+            continue
+        sport, dport, seq, ack, off, flags = struct.unpack_from('!HHIIBB', p)
+        if port is not None and port != sport and port != dport:
+            continue
+        src, dst = (pkt.src, sport), (pkt.dst, dport)
+        flow = flows.get((src, dst))
+        if flow is None or (flags & 0x02 and not flags & 0x10
+                            and len(flow.data) > 0):
+            # a new connection, or one reusing the address of an old one
+            flow = TcpFlow(src=src, dst=dst)
+            rflow = TcpFlow(src=dst, dst=src)
+            flows[(src, dst)] = flow
+            flows[(dst, src)] = rflow
+            conns.append(TcpConnection(client=flow, server=rflow))
+        flow.add(seq, flags, p[(off >> 4) * 4:])
+    return conns
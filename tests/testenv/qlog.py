@@ -0,0 +1,175 @@
+import json
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+
+log = logging.getLogger(__name__)
+
+
+class QlogConnection:
+    """Timing and packet counts of one connection in a qlog.
+
+    Times are in milliseconds, as given in the qlog events, relative to
+    the trace's reference time. Packets and bytes are counted per packet
+    number space: 'initial', 'handshake' and 'application_data'.
+    """
+
+    PN_SPACES = {
+        'initial': 'initial',
+        'handshake': 'handshake',
+        '0RTT': 'application_data',
+        '1RTT': 'application_data',
+    }
+
+    def __init__(self, group_id: Optional[str] = None):
+        self.group_id = group_id
+        self.first_initial_sent = None
+        self.handshake_confirmed = None
+        self.first_response_byte = None
+        self.last_event = None
+        self.rtt_samples = []
+        self.smoothed_rtt = None
+        self.min_rtt = None
+        self.spaces = {}
+
+    def _count(self, ptype: str, direction: str, length: int):
+        space = self.PN_SPACES.get(ptype, ptype)
+        if space not in self.spaces:
+            self.spaces[space] = {
+                'packets_sent': 0, 'bytes_sent': 0,
+                'packets_received': 0, 'bytes_received': 0,
+            }
+        self.spaces[space][f'packets_{direction}'] += 1
+        self.spaces[space][f'bytes_{direction}'] += length
+
+    def add_event(self, t: float, name: str, data: Dict[str, Any]):
+        self.last_event = t
+        if name == 'transport:packet_sent' \
+                or name == 'transport:packet_received':
+            direction = 'sent' if name.endswith('sent') else 'received'
+            ptype = data.get('header', {}).get('packet_type')
+            length = data.get('raw', {}).get('length', 0)
+            self._count(ptype, direction, length)
+            if direction == 'sent':
+                if ptype == 'initial' and self.first_initial_sent is None:
+                    self.first_initial_sent = t
+                return
+            for frame in data.get('frames', []):
+                ftype = frame.get('frame_type')
+                if ftype == 'handshake_done':
+                    if self.handshake_confirmed is None:
+                        self.handshake_confirmed = t
+                elif ftype == 'stream' and self.first_response_byte is None \
+                        and frame.get('stream_id', 1) % 4 == 0 \
+                        and frame.get('length', 0) > 0:
+                    self.first_response_byte = t
+        elif name == 'recovery:metrics_updated':
+            if 'latest_rtt' in data:
+                self.rtt_samples.append(data['latest_rtt'])
+            if 'smoothed_rtt' in data:
+                self.smoothed_rtt = data['smoothed_rtt']
+            if 'min_rtt' in data:
+                self.min_rtt = data['min_rtt']
+        elif name == 'connectivity:connection_state_updated':
+            if data.get('new') == 'handshake_confirmed' \
+                    and self.handshake_confirmed is None:
+                self.handshake_confirmed = t
+
+    def _since_start(self, t: Optional[float]) -> Optional[float]:
+        if t is None or self.first_initial_sent is None:
+            return None
+        return t - self.first_initial_sent
+
+    @property
+    def handshake_time(self) -> Optional[float]:
+        """ms from the first Initial sent until the handshake was confirmed."""
+        return self._since_start(self.handshake_confirmed)
+
+    @property
+    def response_time(self) -> Optional[float]:
+        """ms from the first Initial sent until response data arrived."""
+        return self._since_start(self.first_response_byte)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'group_id': self.group_id,
+            'handshake_time': self.handshake_time,
+            'response_time': self.response_time,
+            'rtt_samples': self.rtt_samples,
+            'smoothed_rtt': self.smoothed_rtt,
+            'min_rtt': self.min_rtt,
+            'spaces': self.spaces,
+        }
+
+
+class QlogReader:
+    """Reads a qlog file in JSON-SEQ or NDJSON format as a stream.
+
+    Records are split on the RS character (JSON-SEQ, RFC 7464) or on
+    newlines, so the whole file is never in memory. Events are produced
+    as (time, name, data, group_id). Both the 'name' and the older
+    'category' + 'event' fields of an event are understood.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, path: str):
+        self._path = path
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _records(self) -> Iterator[Dict[str, Any]]:
+        with open(self._path, 'rb') as fd:
+            pending = b''
+            while True:
+                chunk = fd.read(self.CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+                pending += chunk
+                parts = pending.replace(b'\x1e', b'\n').split(b'\n')
+                pending = parts.pop()
+                for part in parts:
+                    rec = self._decode(part)
+                    if rec is not None:
+                        yield rec
+            rec = self._decode(pending)
+            if rec is not None:
+                yield rec
+
+    def _decode(self, part: bytes) -> Optional[Dict[str, Any]]:
+        part = part.strip()
+        if len(part) == 0:
+            return None
+        try:
+            rec = json.loads(part)
+        except ValueError:
+            log.debug(f'{self._path}: skipping invalid qlog record')
+            return None
+        return rec if isinstance(rec, dict) else None
+
+    def events(self) -> Iterator[tuple]:
+        group_id = None
+        for rec in self._records():
+            if 'qlog_version' in rec or 'qlog_format' in rec:
+                # the file header, may carry the trace's group id
+                trace = rec.get('trace', {})
+                group_id = trace.get('common_fields', {}).get(
+                    'group_id', group_id)
+                continue
+            if 'time' not in rec:
+                continue
+            name = rec.get('name')
+            if name is None and 'category' in rec:
+                name = f'{rec["category"]}:{rec.get("event")}'
+            yield rec['time'], name, rec.get('data', {}), \
+                rec.get('group_id', group_id)
+
+    def connections(self) -> List[QlogConnection]:
+        conns = {}
+        for t, name, data, group_id in self.events():
+            if group_id not in conns:
+                conns[group_id] = QlogConnection(group_id=group_id)
+            conns[group_id].add_event(t, name, data)
+        return list(conns.values())
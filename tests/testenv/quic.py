@@ -0,0 +1,300 @@
+import hashlib
+import hmac
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .pcap import PcapPacket, PcapReader, ip_packets
+from .tls import DataCursor, HandShake, HSRecord, ParseError
+
+
+log = logging.getLogger(__name__)
+
+
+def hkdf_extract(salt: bytes, ikm: bytes) -> bytes:
+    return hmac.new(salt, ikm, hashlib.sha256).digest()
+
+
+def hkdf_expand_label(secret: bytes, label: str, length: int,
+                      context: bytes = b'') -> bytes:
+    full_label = f'tls13 {label}'.encode()
+    info = length.to_bytes(2, byteorder='big') \
+        + bytes([len(full_label)]) + full_label \
+        + bytes([len(context)]) + context
+    out = b''
+    block = b''
+    counter = 1
+    while len(out) < length:
+        block = hmac.new(secret, block + info + bytes([counter]),
+                         hashlib.sha256).digest()
+        out += block
+        counter += 1
+    return out[:length]
+
+
+class QuicVersion:
+    # salt and labels for the Initial keys, RFC 9001 ch. 5.2, RFC 9369
+    V1 = 0x00000001
+    V2 = 0x6b3343cf
+    DRAFT29 = 0xff00001d
+
+    INITIAL_SALT = {
+        V1: bytes.fromhex('38762cf7f55934b34d179ae6a4c80cadccbb7f0a'),
+        V2: bytes.fromhex('0dede3def700a6db819381be6e269dcbf9bd2ed9'),
+        DRAFT29: bytes.fromhex('afbfec289993d24c9e9786f19c6111e04390a899'),
+    }
+    LABEL_PREFIX = {
+        V1: 'quic',
+        V2: 'quicv2',
+        DRAFT29: 'quic',
+    }
+    # long header packet types: Initial, 0-RTT, Handshake, Retry
+    PACKET_TYPES = {
+        V1: ['Initial', '0-RTT', 'Handshake', 'Retry'],
+        V2: ['Retry', 'Initial', '0-RTT', 'Handshake'],
+        DRAFT29: ['Initial', '0-RTT', 'Handshake', 'Retry'],
+    }
+
+    @classmethod
+    def is_supported(cls, version: int) -> bool:
+        return version in cls.INITIAL_SALT
+
+    @classmethod
+    def packet_type(cls, version: int, first_byte: int) -> str:
+        return cls.PACKET_TYPES[version][(first_byte & 0x30) >> 4]
+
+
+class InitialKeys:
+    """The packet protection keys of one side for Initial packets."""
+
+    def __init__(self, version: int, dcid: bytes, is_client: bool):
+        prefix = QuicVersion.LABEL_PREFIX[version]
+        initial_secret = hkdf_extract(QuicVersion.INITIAL_SALT[version], dcid)
+        secret = hkdf_expand_label(initial_secret,
+                                   'client in' if is_client else 'server in',
+                                   32)
+        self.key = hkdf_expand_label(secret, f'{prefix} key', 16)
+        self.iv = hkdf_expand_label(secret, f'{prefix} iv', 12)
+        self.hp = hkdf_expand_label(secret, f'{prefix} hp', 16)
+        self._aead = AESGCM(self.key)
+        self._hp_cipher = Cipher(algorithms.AES(self.hp), modes.ECB())
+
+    def hp_mask(self, sample: bytes) -> bytes:
+        encryptor = self._hp_cipher.encryptor()
+        return encryptor.update(sample) + encryptor.finalize()
+
+    def decrypt(self, pn: int, header: bytes, payload: bytes) -> bytes:
+        nonce = bytes([a ^ b for a, b in zip(
+            self.iv, pn.to_bytes(12, byteorder='big'))])
+        return self._aead.decrypt(nonce, payload, header)
+
+
+class QuicPacket:
+    __slots__ = ('ptype', 'version', 'dcid', 'scid', 'pn', 'payload')
+
+    def __init__(self, ptype: str, version: int, dcid: bytes, scid: bytes,
+                 pn: int = None, payload: bytes = None):
+        self.ptype = ptype
+        self.version = version
+        self.dcid = dcid
+        self.scid = scid
+        self.pn = pn
+        self.payload = payload
+
+
+def _long_header(data: memoryview) -> Tuple[int, int, bytes, bytes,
+                                            DataCursor]:
+    d = DataCursor(data)
+    first = d.get_int(1)
+    version = d.get_int(4)
+    dcid = bytes(d.get_len_field(1))
+    scid = bytes(d.get_len_field(1))
+    return first, version, dcid, scid, d
+
+
+def crypto_frames(payload: bytes) -> Iterator[Tuple[int, memoryview]]:
+    """The (offset, data) of the CRYPTO frames in a decrypted Initial
+       or Handshake packet payload."""
+    d = DataCursor(payload)
+    while len(d):
+        ftype = d.get_qint()
+        if ftype == 0x00 or ftype == 0x01:  # PADDING, PING
+            continue
+        elif ftype == 0x02 or ftype == 0x03:  # ACK
+            d.get_qint()
+            d.get_qint()
+            ranges = d.get_qint()
+            d.get_qint()
+            for _ in range(2 * ranges + (3 if ftype == 0x03 else 0)):
+                d.get_qint()
+        elif ftype == 0x06:  # CRYPTO
+            offset = d.get_qint()
+            yield offset, d.get_field(d.get_qint())
+        elif ftype == 0x1c or ftype == 0x1d:  # CONNECTION_CLOSE
+            d.get_qint()
+            if ftype == 0x1c:
+                d.get_qint()
+            d.get_field(d.get_qint())
+        else:
+            raise ParseError(f'frame type 0x{ftype:x} not allowed in '
+                             f'Initial/Handshake packets')
+
+
+class CryptoStream:
+    """The CRYPTO data at one encryption level, ordered by offset."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self._pending = {}
+
+    def add(self, offset: int, data):
+        if offset > len(self.data):
+            self._pending[offset] = bytes(data)
+            return
+        self._append(offset, data)
+        while len(self._pending):
+            ready = [o for o in self._pending if o <= len(self.data)]
+            if len(ready) == 0:
+                break
+            for o in ready:
+                self._append(o, self._pending.pop(o))
+
+    def _append(self, offset, data):
+        skip = len(self.data) - offset
+        if skip < len(data):
+            self.data += data[skip:]
+
+
+class QuicInitialDecoder:
+    """Decrypts the Initial packets of one QUIC connection.
+
+    The keys for both sides are derived from the destination connection
+    id of the client's first Initial, or of the one after a Retry.
+    Packets are given as UDP datagrams, coalesced packets are split and
+    anything not Initial is skipped. The CRYPTO data sent by client and
+    server is available as `CryptoStream`s.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._dcid = None
+        self._keys = {}
+        self.client = CryptoStream()
+        self.server = CryptoStream()
+        self.packets = 0
+
+    @property
+    def original_dcid(self) -> Optional[bytes]:
+        return self._dcid
+
+    def _get_keys(self, is_client: bool) -> InitialKeys:
+        if is_client not in self._keys:
+            self._keys[is_client] = InitialKeys(
+                version=self._version, dcid=self._dcid, is_client=is_client)
+        return self._keys[is_client]
+
+    def add_datagram(self, data: bytes, from_client: bool) -> List[QuicPacket]:
+        """Decode the packets in a UDP datagram, return the Initial ones."""
+        packets = []
+        data = memoryview(data)
+        while len(data) > 0 and data[0] & 0x80:
+            try:
+                pkt, plen = self._decode_packet(data, from_client)
+            except ParseError as ex:
+                log.debug(f'unable to decode QUIC packet: {ex}')
+                break
+            if pkt is not None:
+                packets.append(pkt)
+            if plen == 0:
+                break
+            data = data[plen:]
+        return packets
+
+    def _decode_packet(self, data: memoryview, from_client: bool):
+        first, version, dcid, scid, d = _long_header(data)
+        if not QuicVersion.is_supported(version):
+            return None, 0
+        ptype = QuicVersion.packet_type(version, first)
+        if ptype == 'Retry':
+            # the client's next Initial uses the server's new id
+            self._dcid = None
+            self._keys = {}
+            return QuicPacket(ptype=ptype, version=version, dcid=dcid,
+                              scid=scid), 0
+        if ptype == 'Initial':
+            d.get_field(d.get_qint())  # the token
+        length = d.get_qint()
+        pn_offset = d.pos
+        if length > len(d):
+            raise ParseError(f'packet length {length} exceeds datagram')
+        plen = pn_offset + length
+        if ptype != 'Initial':
+            return None, plen
+        if self._dcid is None:
+            if not from_client:
+                return None, plen
+            self._version = version
+            self._dcid = dcid
+        keys = self._get_keys(is_client=from_client)
+        sample = bytes(data[pn_offset + 4:pn_offset + 20])
+        if len(sample) < 16:
+            raise ParseError('packet too short for header protection')
+        mask = keys.hp_mask(sample)
+        header = bytearray(data[:pn_offset + 4])
+        header[0] ^= mask[0] & 0x0f
+        pn_len = (header[0] & 0x03) + 1
+        pn = 0
+        for i in range(pn_len):
+            header[pn_offset + i] ^= mask[1 + i]
+            pn = (pn << 8) | header[pn_offset + i]
+        header = bytes(header[:pn_offset + pn_len])
+        try:
+            payload = keys.decrypt(pn=pn, header=header,
+                                   payload=bytes(data[pn_offset + pn_len:plen]))
+        except Exception as ex:
+            log.debug(f'Initial packet {pn} does not decrypt: {ex}')
+            return None, plen
+        self.packets += 1
+        stream = self.client if from_client else self.server
+        for offset, cdata in crypto_frames(payload):
+            stream.add(offset, cdata)
+        return QuicPacket(ptype=ptype, version=version, dcid=dcid, scid=scid,
+                          pn=pn, payload=payload), plen
+
+    def handshake(self, verbose: int = 0) -> Tuple[List[HSRecord],
+                                                  List[HSRecord]]:
+        """The handshake records (sent, received) by the client in
+           Initial packets, e.g. ClientHello and ServerHello."""
+        return list(HandShake(source=[bytes(self.client.data)],
+                              verbose=verbose)), \
+            list(HandShake(source=[bytes(self.server.data)],
+                           verbose=verbose))
+
+
+def quic_connections(source: Union[str, Iterable[PcapPacket]],
+                     port: int) -> Dict[Tuple[str, int], QuicInitialDecoder]:
+    """Decode the Initial packets of all QUIC connections to the
+       server `port` in a capture, by the client's address."""
+    if isinstance(source, str):
+        source = PcapReader(source)
+    conns = {}
+    for pkt in ip_packets(source, protos=(17,)):
+        p = pkt.payload
+        if len(p) < 8:
+            continue
+        sport = int.from_bytes(p[0:2], byteorder='big')
+        dport = int.from_bytes(p[2:4], byteorder='big')
+        if dport == port:
+            from_client, client = True, (pkt.src, sport)
+        elif sport == port:
+            from_client, client = False, (pkt.dst, dport)
+        else:
+            continue
+        if client not in conns:
+            if not from_client:
+                continue
+            conns[client] = QuicInitialDecoder()
+        conns[client].add_datagram(p[8:], from_client=from_client)
+    return conns
@@ -1,60 +1,101 @@
 import binascii
+import hashlib
 import logging
 import sys
-from collections.abc import Iterator
-from typing import Dict, Any, Iterable
+from array import array
+from collections import deque
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 
 
 log = logging.getLogger(__name__)
 
+# increase when the records parsed from the same data change
+PARSER_VERSION = 1
+
 
 class ParseError(Exception):
     pass
 
-def _get_int(d, n):
-    if len(d) < n:
-        raise ParseError(f'get_int: {n} bytes needed, but data is {d}')
-    if n == 1:
-        dlen = d[0]
-    else:
-        dlen = int.from_bytes(d[0:n], byteorder='big')
-    return d[n:], dlen
-
-
-def _get_field(d, dlen):
-    if dlen > 0:
-        if len(d) < dlen:
-            raise ParseError(f'field len={dlen}, but data len={len(d)}')
-        field = d[0:dlen]
-        return d[dlen:], field
-    return d, b''
-
-
-def _get_len_field(d, n):
-    d, dlen = _get_int(d, n)
-    return _get_field(d, dlen)
-
-
-# d are bytes that start with a quic variable length integer
-def _get_qint(d):
-    i = d[0] & 0xc0
-    if i == 0:
-        return d[1:], int(d[0])
-    elif i == 0x40:
-        ndata = bytearray(d[0:2])
-        d = d[2:]
-        ndata[0] = ndata[0] & ~0xc0
-        return d, int.from_bytes(ndata, byteorder='big')
-    elif i == 0x80:
-        ndata = bytearray(d[0:4])
-        d = d[4:]
-        ndata[0] = ndata[0] & ~0xc0
-        return d, int.from_bytes(ndata, byteorder='big')
-    else:
-        ndata = bytearray(d[0:8])
-        d = d[8:]
-        ndata[0] = ndata[0] & ~0xc0
-        return d, int.from_bytes(ndata, byteorder='big')
+
+class DataCursor:
+    """Reads TLS/QUIC encoded values from a bytes-like object.
+
+    The cursor keeps a position into a `memoryview` of the data and
+    all fields are returned as views into that buffer. Decoding a record
+    therefore never copies the data that has not been read yet.
+    """
+
+    def __init__(self, data, offset: int = 0, end: int = None):
+        self._buf = data if isinstance(data, memoryview) else memoryview(data)
+        self._pos = offset
+        self._end = len(self._buf) if end is None else end
+
+    def __len__(self):
+        return self._end - self._pos
+
+    @property
+    def pos(self) -> int:
+        return self._pos
+
+    def _need(self, n, what):
+        if self._end - self._pos < n:
+            raise ParseError(f'{what}: {n} bytes needed, but only '
+                             f'{self._end - self._pos} remain')
+
+    def get_int(self, n: int) -> int:
+        self._need(n, 'get_int')
+        if n == 1:
+            val = self._buf[self._pos]
+        else:
+            val = int.from_bytes(self._buf[self._pos:self._pos + n],
+                                 byteorder='big')
+        self._pos += n
+        return val
+
+    def get_field(self, dlen: int) -> memoryview:
+        self._need(dlen, 'field')
+        field = self._buf[self._pos:self._pos + dlen]
+        self._pos += dlen
+        return field
+
+    def skip(self, n: int):
+        self._need(n, 'skip')
+        self._pos += n
+
+    def get_len_field(self, n: int) -> memoryview:
+        return self.get_field(self.get_int(n))
+
+    def get_cursor(self, dlen: int) -> 'DataCursor':
+        self._need(dlen, 'field')
+        c = DataCursor(self._buf, offset=self._pos, end=self._pos + dlen)
+        self._pos += dlen
+        return c
+
+    def get_len_cursor(self, n: int) -> 'DataCursor':
+        return self.get_cursor(self.get_int(n))
+
+    # a quic variable length integer, RFC 9000 ch. 16
+    def get_qint(self) -> int:
+        self._need(1, 'get_qint')
+        n = 1 << (self._buf[self._pos] >> 6)
+        self._need(n, 'get_qint')
+        val = int.from_bytes(self._buf[self._pos:self._pos + n],
+                             byteorder='big')
+        self._pos += n
+        return val & ((1 << (8 * n - 2)) - 1)
+
+    def get_rest(self) -> memoryview:
+        return self.get_field(self._end - self._pos)
+
+    def get_u16_array(self, dlen: int) -> array:
+        # a vector of 2 byte integers, e.g. cipher suites or groups
+        if dlen % 2:
+            raise ParseError(f'u16 vector of odd length {dlen}')
+        values = array('H')
+        values.frombytes(self.get_field(dlen))
+        if sys.byteorder == 'little':
+            values.byteswap()
+        return values
 
 
 class TlsSupportedGroups:
@@ -240,6 +281,7 @@ class QuicTransportParam:
 
 
 class Extension:
+    __slots__ = ('_eid', '_name', '_edata', '_hsid')
 
     def __init__(self, eid, name, edata, hsid):
         self._eid = eid
@@ -247,6 +289,14 @@ class Extension:
         self._edata = edata
         self._hsid = hsid
 
+    @property
+    def eid(self) -> int:
+        return self._eid
+
+    @property
+    def name(self) -> str:
+        return self._name
+
     @property
     def data(self):
         return self._edata
@@ -274,14 +324,18 @@ class Extension:
 
 
 class ExtSupportedGroups(Extension):
+    __slots__ = ('_groups',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = edata
-        self._groups = []
-        while len(d) > 0:
-            d, gid = _get_int(d, 2)
-            self._groups.append(gid)
+        d = DataCursor(edata)
+        if len(d) >= 2:
+            d.skip(2)  # length of the list
+        self._groups = d.get_u16_array(len(d))
+
+    @property
+    def groups(self) -> array:
+        return self._groups
 
     def to_json(self):
         jdata = {
@@ -301,30 +355,40 @@ class ExtSupportedGroups(Extension):
 
 
 class ExtKeyShare(Extension):
+    __slots__ = ('_keys', '_group', '_pubkey')
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = self.data
+        d = DataCursor(self.data)
         self._keys = []
         self._group = None
         self._pubkey = None
         if self.hsid == 2:  # ServerHello
             # single key share (group, pubkey)
-            d, self._group = _get_int(d, 2)
-            d, self._pubkey = _get_len_field(d, 2)
+            self._group = d.get_int(2)
+            self._pubkey = bytes(d.get_len_field(2))
         elif self.hsid == 6:  # HelloRetryRequest
             assert len(d) == 2
-            d, self._group = _get_int(d, 2)
+            self._group = d.get_int(2)
         else:
             # list if key shares (group, pubkey)
-            d, shares = _get_len_field(d, 2)
+            shares = d.get_len_cursor(2)
             while len(shares) > 0:
-                shares, group = _get_int(shares, 2)
-                shares, pubkey = _get_len_field(shares, 2)
-                self._keys.append({
-                    'group': TlsSupportedGroups.name(group),
-                    'pubkey': binascii.hexlify(pubkey).decode()
-                })
+                group = shares.get_int(2)
+                pubkey = bytes(shares.get_len_field(2))
+                self._keys.append((group, pubkey))
+
+    @property
+    def groups(self) -> List[int]:
+        if self._group is not None:
+            return [self._group]
+        return [group for group, pubkey in self._keys]
+
+    def _keys_json(self):
+        return [{
+            'group': TlsSupportedGroups.name(group),
+            'pubkey': binascii.hexlify(pubkey).decode()
+        } for group, pubkey in self._keys]
 
     def to_json(self):
         jdata = super().to_json()
@@ -333,7 +397,7 @@ class ExtKeyShare(Extension):
         if self._pubkey is not None:
             jdata['pubkey'] = binascii.hexlify(self._pubkey).decode()
         if len(self._keys) > 0:
-            jdata['keys'] = self._keys
+            jdata['keys'] = self._keys_json()
         return jdata
 
     def to_text(self, indent: int = 0):
@@ -344,57 +408,64 @@ class ExtKeyShare(Extension):
         if self._pubkey is not None:
             s += f'\n{ind}  pubkey: {binascii.hexlify(self._pubkey).decode()}'
         if len(self._keys) > 0:
-            for idx, key in enumerate(self._keys):
+            for idx, key in enumerate(self._keys_json()):
                 s += f'\n{ind}    {idx}: {key["group"]}, {key["pubkey"]}'
         return s
 
 
 class ExtSNI(Extension):
+    __slots__ = ('_indicators',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = self.data
+        d = DataCursor(self.data)
         self._indicators = []
         while len(d) > 0:
-            d, entry = _get_len_field(d, 2)
-            entry, stype = _get_int(entry, 1)
-            entry, sname = _get_len_field(entry, 2)
-            self._indicators.append({
-                'type': stype,
-                'name': sname.decode()
-            })
+            entry = d.get_len_cursor(2)
+            stype = entry.get_int(1)
+            sname = entry.get_len_field(2)
+            self._indicators.append((stype, str(sname, 'utf-8')))
 
     def to_json(self):
         jdata = super().to_json()
-        for i in self._indicators:
-            if i['type'] == 0:
-                jdata['host_name'] = i['name']
+        for stype, sname in self._indicators:
+            if stype == 0:
+                jdata['host_name'] = sname
             else:
-                jdata[f'0x{i["type"]}'] = i['name']
+                jdata[f'0x{stype}'] = sname
         return jdata
 
     def to_text(self, indent: int = 0):
         ind = ' ' * (indent + 2)
         s = f'{ind}{self._name}(0x{self._eid:0x})'
-        if len(self._indicators) == 1 and self._indicators[0]['type'] == 0:
-            s += f': {self._indicators[0]["name"]}'
+        if len(self._indicators) == 1 and self._indicators[0][0] == 0:
+            s += f': {self._indicators[0][1]}'
         else:
-            for i in self._indicators:
-                ikey = 'host_name' if i["type"] == 0 else f'type(0x{i["type"]:0x}'
-                s += f'\n{ind}    {ikey}: {i["name"]}'
+            for stype, sname in self._indicators:
+                ikey = 'host_name' if stype == 0 else f'type(0x{stype:0x}'
+                s += f'\n{ind}    {ikey}: {sname}'
         return s
 
 
 class ExtALPN(Extension):
+    __slots__ = ('_protocols',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = self.data
-        d, list_len = _get_int(d, 2)
+        d = DataCursor(self.data)
+        d.skip(2)  # length of the list
         self._protocols = []
         while len(d) > 0:
-            d, proto = _get_len_field(d, 1)
-            self._protocols.append(proto.decode())
+            proto = bytes(d.get_len_field(1))
+            try:
+                self._protocols.append(proto.decode('utf-8'))
+            except UnicodeDecodeError:
+                # e.g. GREASE values like 0xfafa
+                self._protocols.append(proto.decode('latin-1'))
+
+    @property
+    def protocols(self) -> List[str]:
+        return self._protocols
 
     def to_json(self):
         jdata = super().to_json()
@@ -410,14 +481,16 @@ class ExtALPN(Extension):
 
 
 class ExtEarlyData(Extension):
+    __slots__ = ('_max_size',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
         self._max_size = None
-        d = self.data
+        d = DataCursor(self.data)
         if hsid == 4:  # SessionTicket
-            assert len(d) == 4, f'expected 4, len is {len(d)} data={d}'
-            d, self._max_size = _get_int(d, 4)
+            assert len(d) == 4, f'expected 4, len is {len(d)} ' \
+                                f'data={binascii.hexlify(self.data)}'
+            self._max_size = d.get_int(4)
         else:
             assert len(d) == 0
 
@@ -429,80 +502,94 @@ class ExtEarlyData(Extension):
 
 
 class ExtSignatureAlgorithms(Extension):
+    __slots__ = ('_algos',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = self.data
-        d, list_len = _get_int(d, 2)
-        self._algos = []
-        while len(d) > 0:
-            d, algo = _get_int(d, 2)
-            self._algos.append(TlsSignatureScheme.name(algo))
+        d = DataCursor(self.data)
+        d.skip(2)  # length of the list
+        self._algos = d.get_u16_array(len(d))
+
+    @property
+    def algorithms(self) -> array:
+        return self._algos
+
+    def _algo_names(self):
+        return [TlsSignatureScheme.name(algo) for algo in self._algos]
 
     def to_json(self):
         jdata = super().to_json()
         if len(self._algos) > 0:
-            jdata['algorithms'] = self._algos
+            jdata['algorithms'] = self._algo_names()
         return jdata
 
     def to_text(self, indent: int = 0):
         ind = ' ' * (indent + 2)
-        return f'{ind}{self._name}(0x{self._eid:0x}): {", ".join(self._algos)}'
+        return f'{ind}{self._name}(0x{self._eid:0x}): ' \
+               f'{", ".join(self._algo_names())}'
 
 
 class ExtPSKExchangeModes(Extension):
+    __slots__ = ('_modes',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = self.data
-        d, list_len = _get_int(d, 1)
-        self._modes = []
-        while len(d) > 0:
-            d, mode = _get_int(d, 1)
-            self._modes.append(PskKeyExchangeMode.name(mode))
+        d = DataCursor(self.data)
+        d.skip(1)  # length of the list
+        self._modes = bytes(d.get_rest())
+
+    def _mode_names(self):
+        return [PskKeyExchangeMode.name(mode) for mode in self._modes]
 
     def to_json(self):
         jdata = super().to_json()
-        jdata['modes'] = self._modes
+        jdata['modes'] = self._mode_names()
         return jdata
 
     def to_text(self, indent: int = 0):
         ind = ' ' * (indent + 2)
-        return f'{ind}{self._name}(0x{self._eid:0x}): {", ".join(self._modes)}'
+        return f'{ind}{self._name}(0x{self._eid:0x}): ' \
+               f'{", ".join(self._mode_names())}'
 
 
 class ExtPreSharedKey(Extension):
+    __slots__ = ('_kid', '_identities', '_binders')
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
         self._kid = None
         self._identities = None
         self._binders = None
-        d = self.data
+        d = DataCursor(self.data)
         if hsid == 1:  # client hello
-            d, idata = _get_len_field(d, 2)
+            idata = d.get_len_cursor(2)
             self._identities = []
             while len(idata):
-                idata, identity = _get_len_field(idata, 2)
-                idata, obfs_age = _get_int(idata, 4)
-                self._identities.append({
-                    'id': binascii.hexlify(identity).decode(),
-                    'age': obfs_age,
-                })
-            d, binders = _get_len_field(d, 2)
+                identity = bytes(idata.get_len_field(2))
+                obfs_age = idata.get_int(4)
+                self._identities.append((identity, obfs_age))
+            binders = d.get_len_cursor(2)
             self._binders = []
             while len(binders) > 0:
-                binders, hmac = _get_len_field(binders, 1)
-                self._binders.append(binascii.hexlify(hmac).decode())
+                self._binders.append(bytes(binders.get_len_field(1)))
             assert len(d) == 0
         else:
-            d, self._kid = _get_int(d, 2)
+            self._kid = d.get_int(2)
+
+    def _identities_json(self):
+        return [{
+            'id': binascii.hexlify(identity).decode(),
+            'age': obfs_age,
+        } for identity, obfs_age in self._identities]
+
+    def _binders_json(self):
+        return [binascii.hexlify(hmac).decode() for hmac in self._binders]
 
     def to_json(self):
         jdata = super().to_json()
         if self.hsid == 1:
-            jdata['identities'] = self._identities
-            jdata['binders'] = self._binders
+            jdata['identities'] = self._identities_json()
+            jdata['binders'] = self._binders_json()
         else:
             jdata['identity'] = self._kid
         return jdata
@@ -511,70 +598,83 @@ class ExtPreSharedKey(Extension):
         ind = ' ' * (indent + 2)
         s = f'{ind}{self._name}(0x{self._hsid:0x})'
         if self.hsid == 1:
-            for idx, i in enumerate(self._identities):
+            for idx, i in enumerate(self._identities_json()):
                 s += f'\n{ind}  {idx}: {i["id"]} ({i["age"]})'
-            s += f'\n{ind}  binders: {self._binders}'
+            s += f'\n{ind}  binders: {self._binders_json()}'
         else:
             s += f'\n{ind}  identity: {self._kid}'
         return s
 
 
 class ExtSupportedVersions(Extension):
+    __slots__ = ('_versions',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = self.data
-        self._versions = []
+        d = DataCursor(self.data)
         if hsid == 1:  # client hello
-            d, list_len = _get_int(d, 1)
-            while len(d) > 0:
-                d, version = _get_int(d, 2)
-                self._versions.append(f'0x{version:0x}')
+            d.skip(1)  # length of the list
+            self._versions = d.get_u16_array(len(d))
         else:
-            d, version = _get_int(d, 2)
-            self._versions.append(f'0x{version:0x}')
+            self._versions = d.get_u16_array(2)
+
+    @property
+    def versions(self) -> array:
+        return self._versions
+
+    def _version_names(self):
+        return [f'0x{version:0x}' for version in self._versions]
 
     def to_json(self):
         jdata = super().to_json()
         if len(self._versions) == 1:
-            jdata['version'] = self._versions[0]
+            jdata['version'] = self._version_names()[0]
         else:
-            jdata['versions'] = self._versions
+            jdata['versions'] = self._version_names()
         return jdata
 
     def to_text(self, indent: int = 0):
         ind = ' ' * (indent + 2)
-        return f'{ind}{self._name}(0x{self._eid:0x}): {", ".join(self._versions)}'
+        return f'{ind}{self._name}(0x{self._eid:0x}): ' \
+               f'{", ".join(self._version_names())}'
 
 
 class ExtQuicTP(Extension):
+    __slots__ = ('_params',)
 
     def __init__(self, eid, name, edata, hsid):
         super().__init__(eid=eid, name=name, edata=edata, hsid=hsid)
-        d = self.data
+        d = DataCursor(self.data)
         self._params = []
         while len(d) > 0:
-            d, ptype = _get_qint(d)
-            d, plen = _get_qint(d)
-            d, pvalue = _get_field(d, plen)
+            ptype = d.get_qint()
+            plen = d.get_qint()
             if QuicTransportParam.is_qint(ptype):
-                _, pvalue = _get_qint(pvalue)
+                pvalue = d.get_cursor(plen).get_qint()
             else:
-                pvalue = binascii.hexlify(pvalue).decode()
-            self._params.append({
-                'key': QuicTransportParam.name(ptype),
-                'value': pvalue,
-            })
+                pvalue = bytes(d.get_field(plen))
+            self._params.append((ptype, pvalue))
+
+    @property
+    def params(self) -> List[tuple]:
+        return self._params
+
+    def _params_json(self):
+        return [{
+            'key': QuicTransportParam.name(ptype),
+            'value': pvalue if isinstance(pvalue, int)
+            else binascii.hexlify(pvalue).decode(),
+        } for ptype, pvalue in self._params]
 
     def to_json(self):
         jdata = super().to_json()
-        jdata['params'] = self._params
+        jdata['params'] = self._params_json()
         return jdata
 
     def to_text(self, indent: int = 0):
         ind = ' ' * (indent + 2)
         s = f'{ind}{self._name}(0x{self._eid:0x})'
-        for p in self._params:
+        for p in self._params_json():
             s += f'\n{ind}  {p["key"]}: {p["value"]}'
         return s
 
@@ -617,33 +717,101 @@ class TlsExtensions:
             cls.NAME_BY_ID[eid] = name
             cls.CLASS_BY_ID[eid] = ecls
 
+    @classmethod
+    def name(cls, eid):
+        if eid in cls.NAME_BY_ID:
+            return cls.NAME_BY_ID[eid]
+        return f'(0x{eid:0x})'
+
+    @classmethod
+    def create(cls, hsid, eid, edata) -> Extension:
+        if eid in cls.NAME_BY_ID:
+            ename = cls.NAME_BY_ID[eid]
+            ecls = cls.CLASS_BY_ID[eid]
+            return ecls(eid=eid, name=ename, edata=edata, hsid=hsid)
+        return Extension(eid=eid, name=f'(0x{eid:0x})',
+                         edata=edata, hsid=hsid)
+
     @classmethod
     def from_data(cls, hsid, data):
         exts = []
-        d = data
+        d = data if isinstance(data, DataCursor) else DataCursor(data)
         while len(d):
-            d, eid = _get_int(d, 2)
-            d, elen = _get_int(d, 2)
-            d, edata = _get_field(d, elen)
-            if eid in cls.NAME_BY_ID:
-                ename = cls.NAME_BY_ID[eid]
-                ecls = cls.CLASS_BY_ID[eid]
-                exts.append(ecls(eid=eid, name=ename, edata=edata, hsid=hsid))
-            else:
-                exts.append(Extension(eid=eid, name=f'(0x{eid:0x})',
-                                      edata=edata, hsid=hsid))
+            eid = d.get_int(2)
+            edata = d.get_len_field(2)
+            exts.append(cls.create(hsid, eid, edata))
         return exts
 
 
 TlsExtensions.init()
 
 
+class ExtensionList:
+    """The extensions of a handshake record, decoded on access.
+
+    Only the extension headers are read on creation. The data of an
+    extension is decoded when it is first looked up or iterated over.
+    """
+    __slots__ = ('_hsid', '_data', '_eids', '_offsets', '_decoded',
+                 '_index')
+
+    def __init__(self, hsid: int, data):
+        self._hsid = hsid
+        self._data = data.get_rest() if isinstance(data, DataCursor) \
+            else memoryview(data)
+        # extension ids and (offset, length) of their data
+        self._eids = array('H')
+        self._offsets = array('I')
+        self._decoded = None
+        # position of each extension id, built on first lookup
+        self._index = None
+        d = DataCursor(self._data)
+        while len(d):
+            self._eids.append(d.get_int(2))
+            elen = d.get_int(2)
+            self._offsets.append(d.pos)
+            self._offsets.append(elen)
+            d.get_field(elen)
+
+    def __len__(self):
+        return len(self._eids)
+
+    def __getitem__(self, idx: int) -> Extension:
+        if self._decoded is None:
+            self._decoded = [None] * len(self._eids)
+        ext = self._decoded[idx]
+        if ext is None:
+            offset = self._offsets[2 * idx]
+            edata = self._data[offset:offset + self._offsets[2 * idx + 1]]
+            ext = TlsExtensions.create(self._hsid, self._eids[idx], edata)
+            self._decoded[idx] = ext
+        return ext
+
+    def __iter__(self) -> Iterator[Extension]:
+        for idx in range(len(self._eids)):
+            yield self[idx]
+
+    @property
+    def ids(self) -> List[int]:
+        return self._eids.tolist()
+
+    def get(self, eid: int) -> Optional[Extension]:
+        if self._index is None:
+            self._index = {}
+            for idx, ext_id in enumerate(self._eids):
+                self._index.setdefault(ext_id, idx)
+        idx = self._index.get(eid)
+        return self[idx] if idx is not None else None
+
+
 class HSRecord:
+    __slots__ = ('_hsid', '_name', '_data', '_extensions')
 
     def __init__(self, hsid: int, name: str, data):
         self._hsid = hsid
         self._name = name
         self._data = data
+        self._extensions = None
 
     @property
     def hsid(self):
@@ -661,6 +829,19 @@ class HSRecord:
     def data(self):
         return self._data
 
+    @property
+    def extensions(self) -> Iterable[Extension]:
+        return self._extensions if self._extensions is not None else []
+
+    @property
+    def extension_ids(self) -> List[int]:
+        return self._extensions.ids if self._extensions is not None else []
+
+    def get_extension(self, eid: int) -> Optional[Extension]:
+        if self._extensions is None:
+            return None
+        return self._extensions.get(eid)
+
     def __repr__(self):
         return f'{self.name}[{binascii.hexlify(self._data).decode()}]'
 
@@ -678,31 +859,124 @@ class HSRecord:
                f'{binascii.hexlify(self._data).decode()}'
 
 
+def _is_grease(value: int) -> bool:
+    # RFC 8701 reserved values 0x0a0a, 0x1a1a, ... 0xfafa
+    return (value & 0x0f0f) == 0x0a0a and (value >> 8) == (value & 0xff)
+
+
+def _ja4_hash(s: str) -> str:
+    if len(s) == 0:
+        return '000000000000'
+    return hashlib.sha256(s.encode()).hexdigest()[:12]
+
+
 class ClientHello(HSRecord):
+    __slots__ = ('_version', '_random', '_session_id', '_ciphers',
+                 '_compressions')
+
+    JA4_VERSIONS = {
+        0x0304: '13',
+        0x0303: '12',
+        0x0302: '11',
+        0x0301: '10',
+        0x0300: 's3',
+        0xfeff: 'd1',
+        0xfefd: 'd2',
+        0xfefc: 'd3',
+    }
 
     def __init__(self, hsid: int, name: str, data):
         super().__init__(hsid=hsid, name=name, data=data)
-        d = data
-        d, self._version = _get_int(d, 2)
-        d, self._random = _get_field(d, 32)
-        d, self._session_id = _get_len_field(d, 1)
-        self._ciphers = []
-        d, ciphers = _get_len_field(d, 2)
-        while len(ciphers):
-            ciphers, cipher = _get_int(ciphers, 2)
-            self._ciphers.append(TlsCipherSuites.name(cipher))
-        d, comps = _get_len_field(d, 1)
-        self._compressions = [int(c) for c in comps]
-        d, edata = _get_len_field(d, 2)
-        self._extensions = TlsExtensions.from_data(hsid, edata)
+        d = DataCursor(data)
+        self._version = d.get_int(2)
+        self._random = bytes(d.get_field(32))
+        self._session_id = bytes(d.get_len_field(1))
+        self._ciphers = d.get_u16_array(d.get_int(2))
+        self._compressions = bytes(d.get_len_field(1))
+        self._extensions = ExtensionList(hsid, d.get_len_cursor(2))
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def ciphers(self) -> array:
+        return self._ciphers
+
+    def _cipher_names(self):
+        return [TlsCipherSuites.name(cipher) for cipher in self._ciphers]
+
+    def _ext_values(self, eid, prop):
+        ext = self.get_extension(eid)
+        if ext is None:
+            return []
+        return [v for v in getattr(ext, prop) if not _is_grease(v)]
+
+    @property
+    def ja3_string(self) -> str:
+        """The JA3 description of this hello: version, ciphers,
+           extensions, groups and EC point formats, GREASE removed."""
+        pformats = self.get_extension(0x0b)
+        pformats = pformats.data[1:] if pformats is not None else b''
+        return ','.join([
+            str(self._version),
+            '-'.join([str(c) for c in self._ciphers if not _is_grease(c)]),
+            '-'.join([str(e) for e in self._extensions.ids
+                      if not _is_grease(e)]),
+            '-'.join([str(g) for g in self._ext_values(0x0a, 'groups')]),
+            '-'.join([str(f) for f in pformats]),
+        ])
+
+    @property
+    def ja3(self) -> str:
+        return hashlib.md5(self.ja3_string.encode()).hexdigest()
+
+    @property
+    def ja4(self) -> str:
+        """The JA4 fingerprint of this hello. Ciphers and extensions
+           are sorted, so it does not change with their order."""
+        ciphers = [c for c in self._ciphers if not _is_grease(c)]
+        exts = [e for e in self._extensions.ids if not _is_grease(e)]
+        versions = self._ext_values(0x2b, 'versions')
+        version = max(versions) if len(versions) else self._version
+        alpn = self.get_extension(0x10)
+        alpn = alpn.protocols[0] if alpn is not None \
+            and len(alpn.protocols) else ''
+        if len(alpn) == 0:
+            alpn = '00'
+        elif not (alpn[0].isalnum() and alpn[-1].isalnum()):
+            alpn = alpn.encode().hex()
+            alpn = alpn[0] + alpn[-1]
+        else:
+            alpn = alpn[0] + alpn[-1]
+        proto = 'q' if 0x39 in exts or 0xffa5 in exts else 't'
+        ja4_a = f'{proto}{self.JA4_VERSIONS.get(version, "00")}' \
+                f'{"d" if 0x00 in exts else "i"}' \
+                f'{min(len(ciphers), 99):02d}{min(len(exts), 99):02d}{alpn}'
+        ja4_b = ','.join(sorted([f'{c:04x}' for c in ciphers]))
+        ja4_c = ','.join(sorted([f'{e:04x}' for e in exts
+                                 if e not in (0x00, 0x10)]))
+        algos = self._ext_values(0x0d, 'algorithms')
+        if len(algos):
+            ja4_c += '_' + ','.join([f'{a:04x}' for a in algos])
+        return f'{ja4_a}_{_ja4_hash(ja4_b)}_{_ja4_hash(ja4_c)}'
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash over the JA3 string and JA4. It changes with the TLS
+           version, ciphers and extensions and their order, supported
+           groups, EC point formats, signature algorithms, the highest
+           supported version, SNI presence and the first ALPN."""
+        return hashlib.sha256(f'{self.ja3_string}|{self.ja4}'.encode())\
+            .hexdigest()[:32]
 
     def to_json(self):
         jdata = super().to_json()
         jdata['version'] = f'0x{self._version:0x}'
         jdata['random'] = f'{binascii.hexlify(self._random).decode()}'
         jdata['session_id'] = binascii.hexlify(self._session_id).decode()
-        jdata['ciphers'] = self._ciphers
-        jdata['compressions'] = self._compressions
+        jdata['ciphers'] = self._cipher_names()
+        jdata['compressions'] = list(self._compressions)
         jdata['extensions'] = [ext.to_json() for ext in self._extensions]
         return jdata
 
@@ -712,13 +986,15 @@ class ClientHello(HSRecord):
             f'{ind}  version: 0x{self._version:0x}\n'\
             f'{ind}  random: {binascii.hexlify(self._random).decode()}\n' \
             f'{ind}  session_id: {binascii.hexlify(self._session_id).decode()}\n' \
-            f'{ind}  ciphers: {", ".join(self._ciphers)}\n'\
-            f'{ind}  compressions: {self._compressions}\n'\
+            f'{ind}  ciphers: {", ".join(self._cipher_names())}\n'\
+            f'{ind}  compressions: {list(self._compressions)}\n'\
             f'{ind}  extensions: \n' + '\n'.join(
                 [ext.to_text(indent=indent+4) for ext in self._extensions])
 
 
 class ServerHello(HSRecord):
+    __slots__ = ('_version', '_random', '_session_id', '_cipher',
+                 '_compression')
 
     HELLO_RETRY_RANDOM = binascii.unhexlify(
         'CF21AD74E59A6111BE1D8C021E65B891C2A211167ABB8C5E079E09E2C8A8339C'
@@ -726,25 +1002,27 @@ class ServerHello(HSRecord):
 
     def __init__(self, hsid: int, name: str, data):
         super().__init__(hsid=hsid, name=name, data=data)
-        d = data
-        d, self._version = _get_int(d, 2)
-        d, self._random = _get_field(d, 32)
+        d = DataCursor(data)
+        self._version = d.get_int(2)
+        self._random = bytes(d.get_field(32))
         if self._random == self.HELLO_RETRY_RANDOM:
             self.name = 'HelloRetryRequest'
             hsid = 6
-        d, self._session_id = _get_len_field(d, 1)
-        d, cipher = _get_int(d, 2)
-        self._cipher = TlsCipherSuites.name(cipher)
-        d, self._compression = _get_int(d, 1)
-        d, edata = _get_len_field(d, 2)
-        self._extensions = TlsExtensions.from_data(hsid, edata)
+        self._session_id = bytes(d.get_len_field(1))
+        self._cipher = d.get_int(2)
+        self._compression = d.get_int(1)
+        self._extensions = ExtensionList(hsid, d.get_len_cursor(2))
+
+    @property
+    def cipher(self) -> int:
+        return self._cipher
 
     def to_json(self):
         jdata = super().to_json()
         jdata['version'] = f'0x{self._version:0x}'
         jdata['random'] = f'{binascii.hexlify(self._random).decode()}'
         jdata['session_id'] = binascii.hexlify(self._session_id).decode()
-        jdata['cipher'] = self._cipher
+        jdata['cipher'] = TlsCipherSuites.name(self._cipher)
         jdata['compression'] = int(self._compression)
         jdata['extensions'] = [ext.to_json() for ext in self._extensions]
         return jdata
@@ -755,19 +1033,19 @@ class ServerHello(HSRecord):
             f'{ind}  version: 0x{self._version:0x}\n'\
             f'{ind}  random: {binascii.hexlify(self._random).decode()}\n' \
             f'{ind}  session_id: {binascii.hexlify(self._session_id).decode()}\n' \
-            f'{ind}  cipher: {self._cipher}\n'\
+            f'{ind}  cipher: {TlsCipherSuites.name(self._cipher)}\n'\
             f'{ind}  compression: {int(self._compression)}\n'\
             f'{ind}  extensions: \n' + '\n'.join(
                 [ext.to_text(indent=indent+4) for ext in self._extensions])
 
 
 class EncryptedExtensions(HSRecord):
+    __slots__ = ()
 
     def __init__(self, hsid: int, name: str, data):
         super().__init__(hsid=hsid, name=name, data=data)
-        d = data
-        d, edata = _get_len_field(d, 2)
-        self._extensions = TlsExtensions.from_data(hsid, edata)
+        d = DataCursor(data)
+        self._extensions = ExtensionList(hsid, d.get_len_cursor(2))
 
     def to_json(self):
         jdata = super().to_json()
@@ -782,13 +1060,13 @@ class EncryptedExtensions(HSRecord):
 
 
 class CertificateRequest(HSRecord):
+    __slots__ = ('_context',)
 
     def __init__(self, hsid: int, name: str, data):
         super().__init__(hsid=hsid, name=name, data=data)
-        d = data
-        d, self._context = _get_int(d, 1)
-        d, edata = _get_len_field(d, 2)
-        self._extensions = TlsExtensions.from_data(hsid, edata)
+        d = DataCursor(data)
+        self._context = d.get_int(1)
+        self._extensions = ExtensionList(hsid, d.get_len_cursor(2))
 
     def to_json(self):
         jdata = super().to_json()
@@ -805,36 +1083,39 @@ class CertificateRequest(HSRecord):
 
 
 class Certificate(HSRecord):
+    __slots__ = ('_context', '_cert_entries')
 
     def __init__(self, hsid: int, name: str, data):
         super().__init__(hsid=hsid, name=name, data=data)
-        d = data
-        d, self._context = _get_int(d, 1)
-        d, clist = _get_len_field(d, 3)
+        d = DataCursor(data)
+        self._context = d.get_int(1)
+        clist = d.get_len_cursor(3)
+        # (cert_data, extensions), cert_data is a view into our data
         self._cert_entries = []
         while len(clist) > 0:
-            clist, cert_data = _get_len_field(clist, 3)
-            clist, cert_exts = _get_len_field(clist, 2)
-            exts = TlsExtensions.from_data(hsid, cert_exts)
-            self._cert_entries.append({
-                'cert': binascii.hexlify(cert_data).decode(),
-                'extensions': exts,
-            })
+            cert_data = clist.get_len_field(3)
+            exts = ExtensionList(hsid, clist.get_len_cursor(2))
+            self._cert_entries.append((cert_data, exts))
+
+    @property
+    def chain_length(self) -> int:
+        return len(self._cert_entries)
 
     def to_json(self):
         jdata = super().to_json()
         jdata['context'] = self._context
         jdata['certificate_list'] = [{
-            'cert': e['cert'],
-            'extensions': [x.to_json() for x in e['extensions']],
-        } for e in self._cert_entries]
+            'cert': binascii.hexlify(cert_data).decode(),
+            'extensions': [x.to_json() for x in exts],
+        } for cert_data, exts in self._cert_entries]
         return jdata
 
     def _enxtry_text(self, e, indent: int = 0):
         ind = ' ' * (indent + 2)
-        return f'{ind} cert: {e["cert"]}\n'\
+        cert_data, exts = e
+        return f'{ind} cert: {binascii.hexlify(cert_data).decode()}\n'\
                f'{ind}  extensions: \n' + '\n'.join(
-            [x.to_text(indent=indent + 4) for x in e['extensions']])
+            [x.to_text(indent=indent + 4) for x in exts])
 
     def to_text(self, indent: int = 0):
         ind = ' ' * (indent + 2)
@@ -845,16 +1126,16 @@ class Certificate(HSRecord):
 
 
 class SessionTicket(HSRecord):
+    __slots__ = ('_lifetime', '_age', '_nonce', '_ticket')
 
     def __init__(self, hsid: int, name: str, data):
         super().__init__(hsid=hsid, name=name, data=data)
-        d = data
-        d, self._lifetime = _get_int(d, 4)
-        d, self._age = _get_int(d, 4)
-        d, self._nonce = _get_len_field(d, 1)
-        d, self._ticket = _get_len_field(d, 2)
-        d, edata = _get_len_field(d, 2)
-        self._extensions = TlsExtensions.from_data(hsid, edata)
+        d = DataCursor(data)
+        self._lifetime = d.get_int(4)
+        self._age = d.get_int(4)
+        self._nonce = bytes(d.get_len_field(1))
+        self._ticket = bytes(d.get_len_field(2))
+        self._extensions = ExtensionList(hsid, d.get_len_cursor(2))
 
     def to_json(self):
         jdata = super().to_json()
@@ -866,24 +1147,6 @@ class SessionTicket(HSRecord):
         return jdata
 
 
-class HSIterator(Iterator):
-
-    def __init__(self, recs):
-        self._recs = recs
-        self._index = 0
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        try:
-            result = self._recs[self._index]
-        except IndexError:
-            raise StopIteration
-        self._index += 1
-        return result
-
-
 class HandShake:
     REC_TYPES = [
         (1, 'ClientHello', ClientHello),
@@ -906,69 +1169,6 @@ class HandShake:
     RT_NAME_BY_ID = {}
     RT_CLS_BY_ID = {}
 
-    def _parse_rec(self, data):
-        d = data
-        if self._skip_rec_header:
-            d, rec_no = _get_int(d, 1)
-            d, prot_version = _get_int(d, 2)
-            d, rec_len = _get_int(d, 2)
-            if rec_len > len(d):
-                # incomplete, need more data
-                return data, None
-        d, hsid = _get_int(d, 1)
-        if hsid not in HandShake.RT_CLS_BY_ID:
-            raise ParseError(f'unknown type {hsid}')
-        d, rec_len = _get_int(d, 3)
-        if rec_len > len(d):
-            # incomplete, need more data
-            return data, None
-        d, rec_data = _get_field(d, rec_len)
-        if hsid in HandShake.RT_CLS_BY_ID:
-            name = HandShake.RT_NAME_BY_ID[hsid]
-            rcls = HandShake.RT_CLS_BY_ID[hsid]
-        else:
-            name = f'CryptoRecord(0x{hsid:0x})'
-            rcls = HSRecord
-        return d, rcls(hsid=hsid, name=name, data=rec_data)
-
-    def _parse(self, source, strict=False, verbose: int = 0):
-        d = b''
-        hsid = 0
-        hsrecs = []
-        if verbose > 0:
-            log.debug(f'scanning for handshake records')
-        blocks = [d for d in source]
-        while len(blocks) > 0:
-            try:
-                total_data = b''.join(blocks)
-                remain, r = self._parse_rec(total_data)
-                if r is None:
-                    # if we could not recognize a record, skip the first
-                    # data block and try again
-                    blocks = blocks[1:]
-                    continue
-                hsrecs.append(r)
-                cons_len = len(total_data) - len(remain)
-                while cons_len > 0 and len(blocks) > 0:
-                    if cons_len >= len(blocks[0]):
-                        cons_len -= len(blocks[0])
-                        blocks = blocks[1:]
-                    else:
-                        blocks[0] = blocks[0][cons_len:]
-                        cons_len = 0
-                if verbose > 2:
-                    log.debug(f'added record: {r.to_text()}')
-            except ParseError as err:
-                # if we could not recognize a record, skip the first
-                # data block and try again
-                blocks = blocks[1:]
-        if len(blocks) > 0 and strict:
-            raise Exception(f'possibly incomplete handshake record '
-                            f'id={hsid}, from raw={blocks}\n')
-        return hsrecs
-
-
-
     @classmethod
     def init(cls):
         for (hsid, name, rcls) in cls.REC_TYPES:
@@ -982,9 +1182,172 @@ class HandShake:
         self._verbose = verbose
         self._skip_rec_header = skip_rec_header
 
-    def __iter__(self):
-        return HSIterator(recs=self._parse(self._source, strict=self._strict,
-                                           verbose=self._verbose))
+    def __iter__(self) -> Iterator[HSRecord]:
+        if self._verbose > 0:
+            log.debug('scanning for handshake records')
+        reassembler = HSReassembler(skip_rec_header=self._skip_rec_header,
+                                    verbose=self._verbose)
+        for block in self._source:
+            yield from reassembler.feed(block)
+        yield from reassembler.finish(strict=self._strict)
 
 
 HandShake.init()
+
+
+class HSReassembler:
+    """Reassembles handshake records from a stream of data blocks.
+
+    Blocks, e.g. the payload of CRYPTO frames or TLS records, are appended
+    to a buffer and records are produced as soon as they are complete.
+    When the data at the start of the buffer cannot be parsed, everything
+    up to the start of the next block is dropped and parsing resumes
+    there.
+    """
+
+    def __init__(self, skip_rec_header: bool = False, verbose: int = 0):
+        self._skip_rec_header = skip_rec_header
+        self._verbose = verbose
+        self._buf = bytearray()
+        self._pos = 0
+        # buffer offsets where fed blocks start, after self._pos
+        self._block_starts = deque()
+
+    def __len__(self):
+        return len(self._buf) - self._pos
+
+    def _parse_rec(self):
+        # returns the number of bytes consumed and the record, if complete
+        d = DataCursor(self._buf, offset=self._pos)
+        if self._skip_rec_header:
+            d.skip(3)  # content type and protocol version
+            rec_len = d.get_int(2)
+            if rec_len > len(d):
+                # incomplete, need more data
+                return 0, None
+        hsid = d.get_int(1)
+        if hsid not in HandShake.RT_CLS_BY_ID:
+            raise ParseError(f'unknown type {hsid}')
+        rec_len = d.get_int(3)
+        if rec_len > len(d):
+            # incomplete, need more data
+            return 0, None
+        rec_data = bytes(d.get_field(rec_len))
+        name = HandShake.RT_NAME_BY_ID[hsid]
+        rcls = HandShake.RT_CLS_BY_ID[hsid]
+        return d.pos - self._pos, rcls(hsid=hsid, name=name, data=rec_data)
+
+    def _consume(self, n):
+        self._pos += n
+        while len(self._block_starts) and self._block_starts[0] <= self._pos:
+            self._block_starts.popleft()
+
+    def _skip_block(self):
+        # resynchronize at the start of the next data block
+        if len(self._block_starts):
+            self._consume(self._block_starts[0] - self._pos)
+        else:
+            self._consume(len(self))
+
+    def _compact(self):
+        if self._pos > 0 and self._pos >= len(self._buf) // 2:
+            self._buf = self._buf[self._pos:]
+            self._block_starts = deque([p - self._pos
+                                        for p in self._block_starts])
+            self._pos = 0
+
+    def _records(self, final: bool):
+        while len(self) > 0:
+            try:
+                cons_len, r = self._parse_rec()
+            except ParseError:
+                cons_len, r = 0, None
+                if not final and len(self) < (9 if self._skip_rec_header else 4):
+                    # not enough data for the headers yet
+                    break
+                self._skip_block()
+                continue
+            if r is None:
+                if not final:
+                    break
+                # the stream ended inside this record, skip the
+                # data block and try again
+                self._skip_block()
+                continue
+            self._consume(cons_len)
+            if self._verbose > 2:
+                log.debug(f'added record: {r.to_text()}')
+            yield r
+        self._compact()
+
+    def feed(self, data: bytes) -> List[HSRecord]:
+        """Add the next block of data, return all records completed."""
+        if len(data) == 0:
+            return []
+        if len(self) > 0:
+            self._block_starts.append(len(self._buf))
+        self._buf += data
+        return list(self._records(final=False))
+
+    def finish(self, strict: bool = False) -> List[HSRecord]:
+        """End of data, return the records found in what is left."""
+        if strict and len(self) > 0:
+            raise ParseError(f'possibly incomplete handshake record, '
+                             f'raw={binascii.hexlify(self._buf[self._pos:])}')
+        return list(self._records(final=True))
+
+
+class ClientHelloIndex:
+    """Groups ClientHello records by their fingerprint.
+
+    `key` selects the fingerprint used: 'fingerprint' (the default)
+    separates hellos on any difference, 'ja4' ignores the order of
+    ciphers and extensions and 'ja3' ignores key shares and ALPN.
+    """
+
+    def __init__(self, key: str = 'fingerprint'):
+        if key not in ['fingerprint', 'ja3', 'ja4']:
+            raise ValueError(f'unknown fingerprint key: {key}')
+        self._key = key
+        self._groups = {}
+        self._hellos = {}
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __contains__(self, fp: str):
+        return fp in self._groups
+
+    def add(self, hello: ClientHello, source: Any = None) -> str:
+        """Add a hello seen in `source`, return its fingerprint."""
+        fp = getattr(hello, self._key)
+        if fp not in self._groups:
+            self._groups[fp] = []
+            self._hellos[fp] = hello
+        self._groups[fp].append(source)
+        return fp
+
+    def add_records(self, records: Iterable[HSRecord],
+                    source: Any = None) -> List[str]:
+        """Add all ClientHellos among `records`."""
+        return [self.add(hrec, source=source) for hrec in records
+                if isinstance(hrec, ClientHello)]
+
+    @property
+    def fingerprints(self) -> List[str]:
+        return list(self._groups.keys())
+
+    def sources(self, fp: str) -> List[Any]:
+        return self._groups.get(fp, [])
+
+    def hello(self, fp: str) -> Optional[ClientHello]:
+        """The first hello seen with this fingerprint."""
+        return self._hellos.get(fp)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {fp: {
+            'ja3': self._hellos[fp].ja3,
+            'ja4': self._hellos[fp].ja4,
+            'count': len(sources),
+            'sources': [str(src) for src in sources],
+        } for fp, sources in self._groups.items()}
@@ -0,0 +1,246 @@
+import logging
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+
+log = logging.getLogger(__name__)
+
+
+class TraceEvent:
+    """One line of a HAProxy trace, like
+
+       [00|quic|5|quic_conn.c:4480] qc_lstnr_pkt_rcv(): new packet : qc@0x.. el=I
+
+    The arguments after the message are available as a dict, as
+    `key=value` or `key@value` pairs.
+    """
+    __slots__ = ('lineno', 'thread', 'source', 'level', 'location', 'func',
+                 'msg', 'args')
+
+    # encryption level chars and packet type names used in the traces
+    PACKET_TYPES = {
+        'I': 'Initial', 'INITIAL': 'Initial',
+        'E': '0RTT', '0RTT': '0RTT',
+        'H': 'Handshake', 'HANDSHAKE': 'Handshake',
+        'A': '1RTT', '1RTT': '1RTT', 'SHORT': '1RTT',
+        'RETRY': 'Retry',
+    }
+    CID_KEYS = ('dcid', 'scid', 'odcid', 'cid')
+    RE_FRAME = re.compile(r'\b(PADDING|PING|ACK|ACK_ECN|RESET_STREAM|'
+                          r'STOP_SENDING|CRYPTO|NEW_TOKEN|STREAM\w*|MAX_DATA|'
+                          r'MAX_STREAM_DATA|MAX_STREAMS\w*|DATA_BLOCKED|'
+                          r'STREAM_DATA_BLOCKED|STREAMS_BLOCKED\w*|'
+                          r'NEW_CONNECTION_ID|RETIRE_CONNECTION_ID|'
+                          r'PATH_CHALLENGE|PATH_RESPONSE|CONNECTION_CLOSE\w*|'
+                          r'HANDSHAKE_DONE)\b')
+
+    def __init__(self, lineno: int, thread: int, source: str, level: int,
+                 location: str, func: str, msg: str, args: Dict[str, str]):
+        self.lineno = lineno
+        self.thread = thread
+        self.source = source
+        self.level = level
+        self.location = location
+        self.func = func
+        self.msg = msg
+        self.args = args
+
+    @property
+    def qc(self) -> Optional[str]:
+        """The address of the QUIC connection."""
+        return self.args.get('qc')
+
+    @property
+    def cids(self) -> List[str]:
+        """The connection ids, as lowercase hex without '0x'."""
+        return [_norm_cid(self.args[key]) for key in self.CID_KEYS
+                if key in self.args]
+
+    @property
+    def packet_type(self) -> Optional[str]:
+        for key in ('type', 'el'):
+            if key in self.args:
+                ptype = self.PACKET_TYPES.get(self.args[key].upper())
+                if ptype is not None:
+                    return ptype
+        return None
+
+    @property
+    def frame(self) -> Optional[str]:
+        m = self.RE_FRAME.search(self.msg)
+        if m is None:
+            m = self.RE_FRAME.search(' '.join(self.args.values()))
+        return m.group(1) if m else None
+
+    @property
+    def is_tls(self) -> bool:
+        return self.location.startswith('ssl_sock') \
+            or 'ssl' in self.func or 'SSL' in self.msg
+
+    @property
+    def kind(self) -> str:
+        if self.is_tls:
+            return 'tls'
+        elif self.frame is not None:
+            return 'frame'
+        elif self.packet_type is not None or 'pkt' in self.func:
+            return 'packet'
+        return 'other'
+
+    def to_json(self):
+        return {
+            'lineno': self.lineno,
+            'thread': self.thread,
+            'level': self.level,
+            'location': self.location,
+            'func': self.func,
+            'msg': self.msg,
+            'args': self.args,
+            'kind': self.kind,
+        }
+
+    def __repr__(self):
+        return f'TraceEvent[{self.lineno}: {self.func}(): {self.msg}]'
+
+
+def _norm_cid(cid: str) -> str:
+    cid = cid.lower()
+    return cid[2:] if cid.startswith('0x') else cid
+
+
+class TraceParser:
+    """Produces `TraceEvent`s from HAProxy trace output.
+
+    Lines that are not trace events, e.g. log lines in the same file,
+    are skipped. The source is read lazily, line by line. Lines are
+    numbered from `first_lineno` on, for sources that continue an
+    earlier one.
+    """
+
+    RE_TRACE = re.compile(r'^(?:.*?\s)?\[(\d+)\|(\w+)\|(\d+)\|([^\]]*)\]\s+'
+                          r'(\w+)\(\):\s*(.*?)\s*$')
+
+    def __init__(self, source: Union[str, Iterable[str]],
+                 first_lineno: int = 0):
+        self._source = source
+        self._first_lineno = first_lineno
+        self._next_lineno = first_lineno
+
+    @property
+    def next_lineno(self) -> int:
+        """The number of the line after the last one read."""
+        return self._next_lineno
+
+    def __iter__(self) -> Iterator[TraceEvent]:
+        if isinstance(self._source, str):
+            with open(self._source, errors='replace') as fd:
+                yield from self._events(fd)
+        else:
+            yield from self._events(self._source)
+
+    def _events(self, lines: Iterable[str]) -> Iterator[TraceEvent]:
+        self._next_lineno = self._first_lineno
+        for lineno, line in enumerate(lines, start=self._first_lineno):
+            self._next_lineno = lineno + 1
+            ev = self.parse_line(line, lineno)
+            if ev is not None:
+                yield ev
+
+    @classmethod
+    def parse_line(cls, line: str, lineno: int = 0) -> Optional[TraceEvent]:
+        if '|' not in line:
+            return None
+        m = cls.RE_TRACE.match(line)
+        if m is None:
+            return None
+        msg, sep, arg_str = m.group(6).partition(' : ')
+        args = {}
+        for tok in arg_str.split():
+            if '=' in tok:
+                key, value = tok.split('=', 1)
+            elif '@' in tok:
+                key, value = tok.split('@', 1)
+            else:
+                continue
+            if key not in args:
+                args[key] = value
+        return TraceEvent(lineno=lineno, thread=int(m.group(1)),
+                          source=m.group(2), level=int(m.group(3)),
+                          location=m.group(4), func=m.group(5),
+                          msg=msg, args=args)
+
+
+class TraceConnection:
+    """The trace events of one QUIC connection."""
+
+    def __init__(self, qc: str):
+        self.qc = qc
+        self.cids = set()
+        self.events = []
+
+    def add(self, ev: TraceEvent):
+        self.events.append(ev)
+        self.cids.update(ev.cids)
+
+    def of_kind(self, kind: str) -> List[TraceEvent]:
+        return [ev for ev in self.events if ev.kind == kind]
+
+    def __len__(self):
+        return len(self.events)
+
+
+class TraceIndex:
+    """The events of a trace, indexed by connection and connection id.
+
+    Events can be added as the trace grows, lines added with `add_lines`
+    are numbered on from the ones added before. Connection addresses are
+    reused by HAProxy; a `qc_new_conn` event for an address seen before
+    starts a new connection.
+    """
+
+    def __init__(self, events: Iterable[TraceEvent] = None):
+        self._connections = []
+        self._by_qc = {}
+        self._by_cid = {}
+        self._lines = 0
+        if events is not None:
+            self.add_events(events)
+
+    def __len__(self):
+        return len(self._connections)
+
+    @property
+    def connections(self) -> List[TraceConnection]:
+        return self._connections
+
+    def add(self, ev: TraceEvent):
+        qc = ev.qc
+        if qc is None:
+            return
+        conn = self._by_qc.get(qc)
+        if conn is None or (ev.func == 'qc_new_conn'
+                            and conn.events[-1].func != 'qc_new_conn'):
+            conn = TraceConnection(qc)
+            self._connections.append(conn)
+            self._by_qc[qc] = conn
+        conn.add(ev)
+        for cid in ev.cids:
+            self._by_cid[cid] = conn
+
+    def add_events(self, events: Iterable[TraceEvent]):
+        for ev in events:
+            self.add(ev)
+
+    def add_lines(self, lines: Iterable[str]):
+        """Add the events in trace `lines` that follow the ones added."""
+        parser = TraceParser(lines, first_lineno=self._lines)
+        self.add_events(parser)
+        self._lines = parser.next_lineno
+
+    def get(self, qc: str) -> Optional[TraceConnection]:
+        """The last connection at address `qc`."""
+        return self._by_qc.get(qc)
+
+    def for_cid(self, cid: str) -> Optional[TraceConnection]:
+        """The connection that used the connection id `cid`."""
+        return self._by_cid.get(_norm_cid(cid))